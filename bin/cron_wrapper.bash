@@ -10,8 +10,8 @@ source ../virtualenv-citizenconnect/bin/activate
 # don't abort on error so we can capture output
 set +e
 
-# run the command
-output="`./manage.py $1`"
+# run the command, passing on any options
+output="`./manage.py "$@"`"
 
 # suppress output unless we got a non-zero exit status
 if [ "$?" -ne 0 ]
@@ -0,0 +1,892 @@
+"""
+Synthetic data and benchmarks, for seeing how the site behaves at national
+scale before it gets there.
+
+SyntheticData fills the database with a made-up, but realistically shaped,
+dataset of whatever size you ask for: CCGs, trusts and GP surgeries,
+organisations and their services, problems and their revision history,
+reviews and their ratings, and Friends and Family surveys. The same seed
+always gives the same data (relative to when it's generated). The big tables
+are written with COPY, into blocks of ids reserved from their sequences, so
+that rows can refer to each other without anything being read back.
+
+Benchmarks times the main pages, queries and commands against whatever is in
+the database, and reports percentiles of how long they took and how many
+queries they ran.
+
+See the create_benchmark_data and run_benchmarks management commands.
+"""
+import json
+import math
+import os
+import random
+import time
+from collections import namedtuple
+from cStringIO import StringIO
+from datetime import date, datetime, timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core import mail, serializers
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.urlresolvers import reverse
+from django.db import connection, reset_queries
+from django.db.models import AutoField, Count
+from django.test.client import Client
+from django.test.utils import override_settings
+from django.utils.timezone import utc
+
+from reversion.models import Revision, Version, VERSION_ADD, VERSION_CHANGE
+
+from issues.models import Problem, ProblemChange
+from organisations import auth
+from organisations.lib import (interval_counts,
+                               refresh_problem_counts,
+                               refresh_review_counts,
+                               refresh_recommendation_ratings,
+                               RECOMMENDATION_RATING_QUESTION)
+from organisations.metaphone import dm
+from organisations.models import (CCG,
+                                  OrganisationParent,
+                                  Organisation,
+                                  OrganisationSearchToken,
+                                  Service,
+                                  FriendsAndFamilySurvey,
+                                  name_search_metaphones)
+from reviews_display.models import Review, Rating
+
+# The prefix of the codes of everything SyntheticData makes, so that it can
+# tell if it's been run before
+CODE_PREFIX = 'BM'
+
+# Made up names for things
+PLACES = ['Ashford', 'Barnsley', 'Bedford', 'Bolton', 'Bradford', 'Brighton',
+          'Bristol', 'Cambridge', 'Carlisle', 'Chester', 'Colchester',
+          'Coventry', 'Derby', 'Doncaster', 'Durham', 'Exeter', 'Gloucester',
+          'Grimsby', 'Halifax', 'Harrogate', 'Hereford', 'Ipswich', 'Kendal',
+          'Lancaster', 'Leeds', 'Leicester', 'Lincoln', 'Luton', 'Maidstone',
+          'Norwich', 'Nottingham', 'Oldham', 'Oxford', 'Penrith', 'Plymouth',
+          'Preston', 'Reading', 'Salisbury', 'Sheffield', 'Shrewsbury',
+          'Southampton', 'Stafford', 'Swindon', 'Taunton', 'Truro',
+          'Wakefield', 'Warrington', 'Winchester', 'Worcester', 'York']
+STREETS = ['Abbey', 'Albert', 'Beech', 'Bridge', 'Castle', 'Church', 'Elm',
+           'Green', 'High', 'Hill', 'King', 'Lime', 'Manor', 'Market', 'Mill',
+           'Oak', 'Park', 'Queen', 'Station', 'Victoria']
+ORGANISATION_KINDS = {
+    'gppractices': ['Surgery', 'Medical Centre', 'Health Centre', 'Medical Practice'],
+    'hospitals': ['General Hospital', 'Community Hospital', 'Royal Infirmary', 'District Hospital'],
+    'clinics': ['Clinic', 'Walk-in Centre', 'Treatment Centre', 'Eye Clinic'],
+}
+# How likely each type of organisation is
+ORGANISATION_TYPE_WEIGHTS = [('gppractices', 75), ('hospitals', 15), ('clinics', 10)]
+SERVICES = ['Accident and emergency', 'Cardiology', 'Dermatology',
+            'General surgery', 'Maternity services', 'Neurology',
+            'Ophthalmology', 'Orthopaedics', 'Paediatrics', 'Urology']
+AUTHORS = ['Anonymous', 'A patient', 'Concerned relative', 'JohnS', 'LanaC',
+           'Mum of two', 'Pat', 'Regular visitor', 'Sam', 'Satisfied patient']
+REVIEW_TITLES = ['Wonderful staff and treatment', 'Could have been better',
+                 'Kept waiting for hours', 'Very pleased with the service',
+                 'Friendly and helpful', 'Difficult to get an appointment',
+                 'Clean and well run', 'Not listened to']
+REVIEW_PHRASES = ['The staff were friendly and helpful.',
+                  'I was seen quickly and everything was explained to me.',
+                  'The waiting room was crowded and I waited a long time.',
+                  'It is very difficult to get through on the telephone.',
+                  'The ward was spotless and the food was good.',
+                  'Nobody told me what was happening.',
+                  'Parking was a nightmare.',
+                  'I would recommend them to anyone.']
+RECOMMENDATION_ANSWERS = {5: 'Extremely likely', 4: 'Likely', 3: 'Neither likely nor unlikely',
+                          2: 'Unlikely', 1: 'Extremely unlikely'}
+OTHER_RATING_QUESTIONS = ['How satisfied are you with the cleanliness of the area you were treated in?',
+                          u'Doctors and nurses worked well together\u2026',
+                          'How satisfied are you that you were treated with dignity and respect by the staff?',
+                          'Are you able to get through to the surgery by telephone?',
+                          'Are you able to get an appointment when you want one?']
+OTHER_RATING_ANSWERS = {5: 'All of the time', 4: 'Most of the time', 3: 'Some of the time',
+                        2: 'Rarely', 1: 'Never'}
+
+# How likely each status and publication status is for a problem
+STATUS_WEIGHTS = [(Problem.NEW, 15), (Problem.ACKNOWLEDGED, 15), (Problem.RESOLVED, 45),
+                  (Problem.UNABLE_TO_RESOLVE, 10), (Problem.REFERRED_TO_OTHER_PROVIDER, 5),
+                  (Problem.UNABLE_TO_CONTACT, 8), (Problem.ABUSIVE, 2)]
+PUBLICATION_STATUS_WEIGHTS = [(Problem.PUBLISHED, 70), (Problem.NOT_MODERATED, 20), (Problem.REJECTED, 10)]
+
+# How many problems or reviews are made before reserving ids for them and
+# writing them out
+BATCH_SIZE = 10000
+
+
+def copy_value(value):
+    """Format a value for COPY's text format"""
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    elif not isinstance(value, basestring):
+        value = unicode(value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def reserve_ids(cursor, model, count):
+    """Take count ids from the sequence of model's table, so that rows can
+    be written with them, and return the first. The rest follow it."""
+    cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [model._meta.db_table, model._meta.pk.column])
+    sequence = cursor.fetchone()[0]
+    cursor.execute("SELECT setval(%s, nextval(%s) + %s - 1)", [sequence, sequence, count])
+    return cursor.fetchone()[0] - count + 1
+
+
+class CopyWriter(object):
+    """
+    Writes rows into a model's table with COPY, batch_size of them at a time.
+
+    Rows are given as keyword arguments of the fields' attnames. Fields
+    which are left out get their default, or the time the writer was made if
+    they're auto_now(_add). Ids are only written if with_ids is True,
+    otherwise the table's sequence gives them out.
+    """
+
+    batch_size = 50000
+
+    def __init__(self, cursor, model, with_ids=False):
+        self.cursor = cursor
+        self.table = model._meta.db_table
+        now = datetime.utcnow().replace(tzinfo=utc)
+        self.fields = []
+        self.auto_now = set()
+        for field in model._meta.local_fields:
+            if isinstance(field, AutoField):
+                if not with_ids:
+                    continue
+                default = None
+            elif getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                default = now
+                self.auto_now.add(field.attname)
+            else:
+                default = field.get_default()
+            self.fields.append((field.attname, field.column, default))
+        self.columns = [column for _, column, _ in self.fields]
+        self.written = 0
+        self.batch = StringIO()
+        self.batch_rows = 0
+
+    def write(self, **values):
+        self.batch.write("\t".join(copy_value(values.get(attname, default))
+                                   for attname, column, default in self.fields) + "\n")
+        self.batch_rows += 1
+        if self.batch_rows >= self.batch_size:
+            self.flush()
+
+    def write_instance(self, instance):
+        """Write an unsaved model instance. Its auto_now(_add) fields are
+        only filled in when it's saved, so they're left to the defaults if
+        they haven't been set."""
+        values = {}
+        for attname, column, default in self.fields:
+            value = getattr(instance, attname)
+            if value is not None or attname not in self.auto_now:
+                values[attname] = value
+        self.write(**values)
+
+    def flush(self):
+        if not self.batch_rows:
+            return
+        self.batch.seek(0)
+        self.cursor.copy_from(self.batch, self.table, columns=self.columns)
+        self.written += self.batch_rows
+        self.batch = StringIO()
+        self.batch_rows = 0
+
+
+class SyntheticDataExists(Exception):
+    """Exception thrown when SyntheticData has already been generated in the
+    database"""
+    pass
+
+
+class SyntheticData(object):
+    """
+    Generates a reproducible, made-up dataset, see the module docstring.
+
+    The numbers of CCGs, trusts, GP surgeries, services and surveys follow
+    from the number of organisations. Problems are spread over the last
+    `days` days, and reviews over as much of that as
+    NHS_CHOICES_API_MAX_REVIEW_AGE_IN_DAYS allows. Busier organisations get
+    many more problems and reviews than quieter ones, as they do in real
+    life. progress(message) is called as each part is done, if it's given.
+    """
+
+    def __init__(self, organisations=10000, problems=1000000, reviews=2000000,
+                 history=True, days=730, seed=0, progress=None):
+        self.organisation_count = organisations
+        self.problem_count = problems
+        self.review_count = reviews
+        self.history = history
+        self.days = days
+        self.random = random.Random(seed)
+        self.progress = progress or (lambda message: None)
+        self.now = datetime.utcnow().replace(tzinfo=utc, microsecond=0)
+        self.cursor = None
+
+    def exists(self):
+        return CCG.objects.filter(code=self.code('C', 0)).exists()
+
+    def code(self, kind, number):
+        return "{0}{1}{2:05d}".format(CODE_PREFIX, kind, number)
+
+    def weighted_choice(self, weights):
+        total = sum(weight for value, weight in weights)
+        point = self.random.random() * total
+        for value, weight in weights:
+            point -= weight
+            if point < 0:
+                return value
+        return weights[-1][0]
+
+    def busy_index(self, count):
+        """Pick an index into a list of count things, favouring the ones at
+        the start"""
+        return int(count * self.random.random() ** 2)
+
+    def generate(self):
+        """Generate the whole dataset, and return a dict of how many of
+        each thing were made"""
+        if self.exists():
+            raise SyntheticDataExists("There's already synthetic data in the database")
+        self.cursor = connection.cursor()
+        counts = {}
+        started = time.time()
+        for name, step in [('ccgs', self.generate_ccgs),
+                           ('organisations', self.generate_organisations),
+                           ('surveys', self.generate_surveys),
+                           ('problems', self.generate_problems),
+                           ('reviews', self.generate_reviews),
+                           ('users', self.generate_users)]:
+            counts[name] = step()
+            self.progress("Made {0} {1} ({2:.0f}s so far)".format(counts[name], name, time.time() - started))
+
+        # None of the signals which keep the rollups up to date get sent when
+        # writing with COPY, so rebuild them from scratch
+        refresh_problem_counts()
+        refresh_review_counts()
+        refresh_recommendation_ratings()
+        self.cursor.execute("ANALYZE")
+        self.progress("Rebuilt the rollups ({0:.0f}s so far)".format(time.time() - started))
+        return counts
+
+    def generate_ccgs(self):
+        count = max(self.organisation_count // 50, 1)
+        first_id = reserve_ids(self.cursor, CCG, count)
+        self.ccg_ids = range(first_id, first_id + count)
+        # Where each CCG's organisations are, roughly, within England
+        self.ccg_centres = [(self.random.uniform(-4.5, 1.0), self.random.uniform(50.5, 54.8))
+                            for ccg_id in self.ccg_ids]
+        writer = CopyWriter(self.cursor, CCG, with_ids=True)
+        for number, ccg_id in enumerate(self.ccg_ids):
+            writer.write(id=ccg_id,
+                         name="{0} CCG {1}".format(PLACES[number % len(PLACES)], number),
+                         code=self.code('C', number),
+                         email="ccg-{0}@example.com".format(number))
+        writer.flush()
+        return count
+
+    def generate_organisations(self):
+        # Work out which parent each organisation has first, since parents
+        # have to be written before their organisations
+        organisation_types = []
+        organisation_parents = []
+        parents = []
+        current_parent = {}
+        for number in range(self.organisation_count):
+            organisation_type = self.weighted_choice(ORGANISATION_TYPE_WEIGHTS)
+            # GP surgeries have a branch or two, trusts run several hospitals
+            # and clinics
+            parent_type = 'gppractices' if organisation_type == 'gppractices' else 'trusts'
+            new_parent_chance = 0.6 if parent_type == 'gppractices' else 0.12
+            if parent_type not in current_parent or self.random.random() < new_parent_chance:
+                current_parent[parent_type] = len(parents)
+                parents.append((self.random.randrange(len(self.ccg_ids)), parent_type))
+            organisation_types.append(organisation_type)
+            organisation_parents.append(current_parent[parent_type])
+
+        first_parent_id = reserve_ids(self.cursor, OrganisationParent, len(parents))
+        parent_writer = CopyWriter(self.cursor, OrganisationParent, with_ids=True)
+        parent_ccgs_writer = CopyWriter(self.cursor, OrganisationParent.ccgs.through)
+        self.parent_ids = []
+        self.trust_ids = []
+        for number, (ccg_index, parent_type) in enumerate(parents):
+            parent_id = first_parent_id + number
+            self.parent_ids.append(parent_id)
+            if parent_type == 'trusts':
+                self.trust_ids.append(parent_id)
+            parent_writer.write(id=parent_id,
+                                name="{0} {1}".format(PLACES[number % len(PLACES)],
+                                                      "NHS Trust" if parent_type == 'trusts' else "Surgery"),
+                                code=self.code('P', number),
+                                choices_id=900000000 + number,
+                                email="parent-{0}@example.com".format(number),
+                                primary_ccg_id=self.ccg_ids[ccg_index],
+                                active=True)
+            parent_ccgs_writer.write(organisationparent_id=parent_id, ccg_id=self.ccg_ids[ccg_index])
+            # Some are commissioned by a second CCG too
+            if self.random.random() < 0.2:
+                other_ccg_index = self.random.randrange(len(self.ccg_ids))
+                if other_ccg_index != ccg_index:
+                    parent_ccgs_writer.write(organisationparent_id=parent_id,
+                                             ccg_id=self.ccg_ids[other_ccg_index])
+        parent_writer.flush()
+        parent_ccgs_writer.flush()
+
+        first_id = reserve_ids(self.cursor, Organisation, self.organisation_count)
+        writer = CopyWriter(self.cursor, Organisation, with_ids=True)
+        token_writer = CopyWriter(self.cursor, OrganisationSearchToken)
+        service_writer = CopyWriter(self.cursor, Service)
+        self.organisations = []
+        branches = {}
+        for number, (organisation_type, parent_index) in enumerate(zip(organisation_types, organisation_parents)):
+            organisation_id = first_id + number
+            place = PLACES[self.random.randrange(len(PLACES))]
+            street = STREETS[self.random.randrange(len(STREETS))]
+            kinds = ORGANISATION_KINDS[organisation_type]
+            name = u"{0} {1}, {2}".format(street, kinds[self.random.randrange(len(kinds))], place)
+            lon, lat = self.ccg_centres[parents[parent_index][0]]
+            writer.write(id=organisation_id,
+                         name=name,
+                         organisation_type=organisation_type,
+                         choices_id=800000000 + number,
+                         ods_code=self.code('O', number),
+                         address_line1="{0} {1} Road".format(number % 200 + 1, street),
+                         city=place,
+                         postcode="{0}{1} {2}AA".format(CODE_PREFIX, number % 99, number % 10),
+                         point="SRID=4326;POINT({0} {1})".format(lon + self.random.uniform(-0.3, 0.3),
+                                                                 lat + self.random.uniform(-0.2, 0.2)),
+                         parent_id=self.parent_ids[parent_index],
+                         name_metaphone=dm(name)[0])
+            for metaphone in name_search_metaphones(name):
+                token_writer.write(organisation_id=organisation_id, metaphone=metaphone)
+            if organisation_type == 'hospitals':
+                for service in self.random.sample(SERVICES, 5):
+                    service_writer.write(name=service,
+                                         service_code="SRV{0:04d}".format(SERVICES.index(service)),
+                                         organisation_id=organisation_id)
+            branches.setdefault(parent_index, []).append(organisation_id)
+            self.organisations.append({'id': organisation_id,
+                                       'name': name,
+                                       'organisation_type': organisation_type,
+                                       'choices_id': 800000000 + number,
+                                       'parent_index': parent_index})
+        writer.flush()
+        token_writer.flush()
+        service_writer.flush()
+
+        # Reviews of GP branches are stored against all of their surgery's
+        # branches
+        for organisation in self.organisations:
+            if organisation['organisation_type'] == 'gppractices':
+                organisation['review_organisation_ids'] = branches[organisation['parent_index']]
+            else:
+                organisation['review_organisation_ids'] = [organisation['id']]
+
+        # Problems can be about a service, at hospitals
+        self.service_ids = {}
+        for organisation_id, service_id in Service.objects.filter(organisation__ods_code__startswith=CODE_PREFIX) \
+                                                          .values_list('organisation_id', 'id'):
+            self.service_ids.setdefault(organisation_id, []).append(service_id)
+        for service_ids in self.service_ids.values():
+            service_ids.sort()
+        return self.organisation_count
+
+    def generate_surveys(self):
+        """A year of monthly surveys for each hospital's A&E and inpatients,
+        and for each trust's inpatients"""
+        writer = CopyWriter(self.cursor, FriendsAndFamilySurvey)
+        organisation_content_type = ContentType.objects.get_for_model(Organisation)
+        parent_content_type = ContentType.objects.get_for_model(OrganisationParent)
+        surveyed = [(organisation_content_type.id, organisation['id'], location)
+                    for organisation in self.organisations
+                    if organisation['organisation_type'] == 'hospitals'
+                    for location in ('aande', 'inpatient')]
+        surveyed.extend((parent_content_type.id, trust_id, 'inpatient') for trust_id in self.trust_ids)
+        month = self.now.date().replace(day=1)
+        for months_ago in range(12):
+            for content_type_id, object_id, location in surveyed:
+                responses = [self.random.randint(0, 200) for answer in range(6)]
+                extremely_likely, likely, neither, unlikely, extremely_unlikely, dont_know = responses
+                total = sum(responses) or 1
+                writer.write(content_type_id=content_type_id,
+                             object_id=object_id,
+                             overall_score=int(100 * (extremely_likely - neither - unlikely - extremely_unlikely) / total),
+                             extremely_likely=extremely_likely,
+                             likely=likely,
+                             neither=neither,
+                             unlikely=unlikely,
+                             extremely_unlikely=extremely_unlikely,
+                             dont_know=dont_know,
+                             location=location,
+                             date=month)
+            month = (month - timedelta(days=1)).replace(day=1)
+        writer.flush()
+        return writer.written
+
+    def later(self, start, max_minutes):
+        """Return a random time up to max_minutes after start, but not in the
+        future, and how many minutes after start it is"""
+        then = min(start + timedelta(minutes=self.random.randint(1, max_minutes)), self.now)
+        return then, Problem.timedelta_to_minutes(then - start)
+
+    def load_seed_problems(self):
+        seed_problem_path = os.path.join(os.path.dirname(__file__), '..', 'issues', 'fixtures', 'seed_problems.json')
+        with open(seed_problem_path) as seed_problem_file:
+            return [seed['fields'] for seed in json.load(seed_problem_file)]
+
+    def make_problem(self, created, seeds):
+        """Return a dict of a problem's fields, and a list of the (date,
+        revision_attrs) of its revisions"""
+        seed = seeds[self.random.randrange(len(seeds))]
+        organisation = self.organisations[self.busy_index(len(self.organisations))]
+        service_ids = self.service_ids.get(organisation['id'])
+        status = self.weighted_choice(STATUS_WEIGHTS)
+        publication_status = self.weighted_choice(PUBLICATION_STATUS_WEIGHTS)
+        public = self.random.random() < 0.7
+        public_reporter_name = public and self.random.random() < 0.5
+        reporter_email = seed['reporter_email']
+
+        attrs = {'publication_status': Problem.NOT_MODERATED,
+                 'status': Problem.NEW,
+                 'requires_second_tier_moderation': False}
+        events = [(created, dict(attrs))]
+
+        problem = {'created': created,
+                   'modified': created,
+                   'description': seed['description'],
+                   'reporter_name': seed['reporter_name'],
+                   'reporter_phone': seed['reporter_phone'],
+                   'reporter_email': reporter_email,
+                   'preferred_contact_method': seed['preferred_contact_method'],
+                   'category': Problem.CATEGORY_CHOICES[self.random.randrange(len(Problem.CATEGORY_CHOICES))][0],
+                   'public': public,
+                   'public_reporter_name': public_reporter_name,
+                   'public_reporter_name_original': public_reporter_name,
+                   'status': status,
+                   'publication_status': publication_status,
+                   'organisation_id': organisation['id'],
+                   'service_id': service_ids[self.random.randrange(len(service_ids))] if service_ids and self.random.random() < 0.5 else None,
+                   'breach': self.random.random() < 0.05,
+                   'formal_complaint': self.random.random() < 0.05,
+                   'requires_second_tier_moderation': False,
+                   'commissioned': self.random.choice([Problem.LOCALLY_COMMISSIONED, Problem.NATIONALLY_COMMISSIONED]),
+                   'cobrand': settings.ALLOWED_COBRANDS[self.random.randrange(len(settings.ALLOWED_COBRANDS))],
+                   'mailed': True,
+                   'confirmation_required': bool(reporter_email),
+                   'version': 1}
+        if reporter_email:
+            problem['confirmation_sent'] = self.later(created, 5)[0]
+
+        if publication_status != Problem.NOT_MODERATED:
+            moderated = self.later(created, 60 * 24 * 2)[0]
+            if publication_status == Problem.PUBLISHED:
+                problem['moderated_description'] = problem['description']
+            events.append((moderated, {'publication_status': publication_status}))
+        elif self.random.random() < 0.1:
+            problem['requires_second_tier_moderation'] = True
+            events.append((self.later(created, 60 * 24)[0], {'requires_second_tier_moderation': True}))
+
+        if status in (Problem.ACKNOWLEDGED, Problem.RESOLVED):
+            acknowledged, problem['time_to_acknowledge'] = self.later(created, 60 * 24 * 5)
+            events.append((acknowledged, {'status': Problem.ACKNOWLEDGED}))
+        if status == Problem.RESOLVED:
+            problem['resolved'], problem['time_to_address'] = self.later(acknowledged, 60 * 24 * 30)
+            problem['time_to_address'] += problem['time_to_acknowledge']
+            problem['closed'] = problem['resolved']
+        elif status in Problem.CLOSED_STATUSES:
+            problem['closed'] = self.later(created, 60 * 24 * 30)[0]
+        if status not in (Problem.NEW, Problem.ACKNOWLEDGED):
+            events.append((problem.get('closed') or self.later(created, 60 * 24 * 30)[0], {'status': status}))
+        if problem.get('closed'):
+            if status != Problem.ABUSIVE:
+                problem['happy_service'] = self.random.choice([True, False, None])
+                problem['happy_outcome'] = self.random.choice([True, False, None])
+            if reporter_email:
+                problem['survey_sent'] = min(problem['closed'] + timedelta(days=1), self.now)
+
+        revisions = []
+        for when, changes in sorted(events, key=lambda event: event[0]):
+            attrs.update(changes)
+            revisions.append((when, dict(attrs)))
+            problem['modified'] = max(problem['modified'], when)
+        return problem, revisions
+
+    def generate_problems(self):
+        seeds = self.load_seed_problems()
+        problem_content_type = ContentType.objects.get_for_model(Problem)
+        writer = CopyWriter(self.cursor, Problem, with_ids=True)
+        revision_writer = CopyWriter(self.cursor, Revision, with_ids=True)
+        version_writer = CopyWriter(self.cursor, Version)
+        change_writer = CopyWriter(self.cursor, ProblemChange)
+        start = self.now - timedelta(days=self.days)
+        span = (self.now - start).total_seconds()
+        for batch_start in range(0, self.problem_count, BATCH_SIZE):
+            batch_count = min(BATCH_SIZE, self.problem_count - batch_start)
+            # Problems are made in the order they were reported
+            batch = [self.make_problem(start + timedelta(seconds=span * (number + self.random.random()) / self.problem_count), seeds)
+                     for number in range(batch_start, batch_start + batch_count)]
+            first_id = reserve_ids(self.cursor, Problem, batch_count)
+            if self.history:
+                revision_id = reserve_ids(self.cursor, Revision, sum(len(revisions) for problem, revisions in batch))
+
+            for problem_id, (problem, revisions) in enumerate(batch, first_id):
+                writer.write(id=problem_id, **problem)
+                if not self.history:
+                    continue
+                # Store the history as reversion would have done
+                instance = Problem(id=problem_id, **problem)
+                serialized = serializers.serialize('python', [instance])[0]
+                previous_revision_attrs = None
+                for when, revision_attrs in revisions:
+                    revision = Revision(id=revision_id, date_created=when)
+                    revision_writer.write_instance(revision)
+                    serialized['fields'].update(revision_attrs)
+                    version_writer.write(revision_id=revision_id,
+                                         object_id=unicode(problem_id),
+                                         object_id_int=problem_id,
+                                         content_type_id=problem_content_type.id,
+                                         format='json',
+                                         serialized_data=json.dumps([serialized], cls=DjangoJSONEncoder),
+                                         object_repr=unicode(instance),
+                                         type=VERSION_CHANGE if previous_revision_attrs else VERSION_ADD)
+                    change_writer.write_instance(ProblemChange.for_revision(problem_id,
+                                                                            revision,
+                                                                            revision_attrs,
+                                                                            previous_revision_attrs))
+                    previous_revision_attrs = revision_attrs
+                    revision_id += 1
+            self.progress("Made {0} of {1} problems".format(batch_start + batch_count, self.problem_count))
+        for each_writer in (writer, revision_writer, version_writer, change_writer):
+            each_writer.flush()
+        return writer.written
+
+    def make_ratings(self, review_id, writer):
+        score = self.weighted_choice([(5, 45), (4, 25), (3, 10), (2, 8), (1, 12)])
+        writer.write(review_id=review_id,
+                     question=RECOMMENDATION_RATING_QUESTION,
+                     answer=RECOMMENDATION_ANSWERS[score],
+                     score=score)
+        for question in self.random.sample(OTHER_RATING_QUESTIONS, 2):
+            score = self.random.randint(1, 5)
+            writer.write(review_id=review_id, question=question, answer=OTHER_RATING_ANSWERS[score], score=score)
+
+    def generate_reviews(self):
+        writer = CopyWriter(self.cursor, Review, with_ids=True)
+        rating_writer = CopyWriter(self.cursor, Rating)
+        link_writer = CopyWriter(self.cursor, Review.organisations.through)
+        # Keep them clear of delete_old_reviews
+        days = min(self.days, settings.NHS_CHOICES_API_MAX_REVIEW_AGE_IN_DAYS - 1)
+        start = self.now - timedelta(days=days)
+        span = (self.now - start).total_seconds()
+        # The latest comment on each organisation, for replies to be to
+        latest_comments = {}
+        for batch_start in range(0, self.review_count, BATCH_SIZE):
+            batch_count = min(BATCH_SIZE, self.review_count - batch_start)
+            first_id = reserve_ids(self.cursor, Review, batch_count)
+            for number, review_id in enumerate(range(first_id, first_id + batch_count), batch_start):
+                published = start + timedelta(seconds=span * (number + self.random.random()) / self.review_count)
+                organisation_index = self.busy_index(len(self.organisations))
+                organisation = self.organisations[organisation_index]
+                review = {'id': review_id,
+                          'api_posting_id': "{0}{1}".format(CODE_PREFIX, number),
+                          'api_postingorganisationid': '0',
+                          'api_published': published,
+                          'api_updated': published,
+                          'api_category': 'comment',
+                          'author_display_name': AUTHORS[self.random.randrange(len(AUTHORS))],
+                          'title': REVIEW_TITLES[self.random.randrange(len(REVIEW_TITLES))],
+                          'content_liked': self.random.choice(REVIEW_PHRASES),
+                          'content_improved': self.random.choice(REVIEW_PHRASES),
+                          'content': " ".join(self.random.sample(REVIEW_PHRASES, 3))}
+                if organisation_index in latest_comments and self.random.random() < 0.1:
+                    review.update({'api_postingorganisationid': '1',
+                                   'api_category': 'reply',
+                                   'in_reply_to_id': latest_comments.pop(organisation_index),
+                                   'author_display_name': organisation['name'],
+                                   'title': u"{0} replies:".format(organisation['name']),
+                                   'content_liked': '',
+                                   'content_improved': ''})
+                else:
+                    latest_comments[organisation_index] = review_id
+                    self.make_ratings(review_id, rating_writer)
+                writer.write(**review)
+                for organisation_id in organisation['review_organisation_ids']:
+                    link_writer.write(review_id=review_id, organisation_id=organisation_id)
+            self.progress("Made {0} of {1} reviews".format(batch_start + batch_count, self.review_count))
+        for each_writer in (writer, rating_writer, link_writer):
+            each_writer.flush()
+        return writer.written
+
+    def generate_users(self):
+        """Make users for the benchmarks to log in as. They can't log in
+        with a password until they're given one."""
+        superuser = User.objects.create_user('benchmark-superuser', 'benchmark-superuser@example.com')
+        superuser.groups.add(auth.NHS_SUPERUSERS)
+
+        ccg_user = User.objects.create_user('benchmark-ccg', 'benchmark-ccg@example.com')
+        ccg_user.groups.add(auth.CCG)
+        CCG.objects.get(code=self.code('C', 0)).users.add(ccg_user)
+
+        trust_user = User.objects.create_user('benchmark-trust', 'benchmark-trust@example.com')
+        trust_user.groups.add(auth.ORGANISATION_PARENTS)
+        if self.trust_ids:
+            OrganisationParent.objects.get(id=self.trust_ids[0]).users.add(trust_user)
+        return 3
+
+
+class BenchmarkError(Exception):
+    """Exception thrown when something being benchmarked doesn't work"""
+    pass
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    index = int(math.ceil(fraction * len(ordered))) - 1
+    return ordered[max(index, 0)]
+
+
+def summarise(timings, queries):
+    """Return the percentiles of a list of timings in milliseconds, and
+    the range of the numbers of queries that went with them"""
+    summary = {'iterations': len(timings),
+               'mean_ms': sum(timings) / len(timings),
+               'min_ms': min(timings),
+               'max_ms': max(timings),
+               'queries_min': min(queries),
+               'queries_max': max(queries),
+               'queries_mean': float(sum(queries)) / len(queries)}
+    for name, fraction in [('p50_ms', 0.5), ('p90_ms', 0.9), ('p95_ms', 0.95), ('p99_ms', 0.99)]:
+        summary[name] = percentile(timings, fraction)
+    return summary
+
+
+# What to do to run a benchmark once: before() and after() are called around
+# each run, without being timed
+Case = namedtuple('Case', ['run', 'before', 'after'])
+
+
+class Benchmarks(object):
+    """
+    Times the main pages, queries and commands, see the module docstring.
+
+    Each benchmark is run `warmup` times without being measured, and then
+    `iterations` times. With cold_cache, the cache is emptied before every
+    run. The email commands are run against the latest email_batch_size
+    problems, which are made unsent before each run and put back afterwards.
+    Pages are fetched as the users that SyntheticData makes.
+    """
+
+    NAMES = ['interval_counts',
+             'live_feed',
+             'summary',
+             'map_json',
+             'ccg_dashboard',
+             'organisation_summary',
+             'problems_csv',
+             'review_ingestion',
+             'email_issues_to_providers',
+             'email_confirmations_to_reporters',
+             'email_surveys_to_reporters']
+
+    def __init__(self, iterations=5, warmup=1, cold_cache=False, email_batch_size=100, progress=None):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.cold_cache = cold_cache
+        self.email_batch_size = email_batch_size
+        self.progress = progress or (lambda message: None)
+        self.clients = {}
+
+    def run(self, names=None):
+        """Run the benchmarks with the given names (or all of them) and return
+        a dict of their results, ready to be turned into JSON"""
+        names = names or self.NAMES
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver'],
+                               EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            for name in names:
+                try:
+                    results[name] = self.measure(getattr(self, 'case_' + name)())
+                except BenchmarkError as e:
+                    results[name] = {'error': unicode(e)}
+                self.progress("{0}: {1}".format(name, results[name]))
+        return {'started': datetime.utcnow().replace(tzinfo=utc).isoformat(),
+                'iterations': self.iterations,
+                'warmup': self.warmup,
+                'cold_cache': self.cold_cache,
+                'table_sizes': self.table_sizes(),
+                'benchmarks': results}
+
+    def measure(self, case):
+        timings = []
+        queries = []
+        try:
+            for iteration in range(self.warmup + self.iterations):
+                if case.before:
+                    case.before()
+                if self.cold_cache:
+                    cache.clear()
+                connection.use_debug_cursor = True
+                reset_queries()
+                started = time.time()
+                case.run()
+                elapsed = (time.time() - started) * 1000
+                if iteration >= self.warmup:
+                    timings.append(elapsed)
+                    queries.append(len(connection.queries))
+        finally:
+            connection.use_debug_cursor = None
+            if case.after:
+                case.after()
+        return summarise(timings, queries)
+
+    def table_sizes(self):
+        """Return the approximate number of rows in the biggest tables"""
+        tables = [model._meta.db_table for model in (Organisation, Problem, Review, Rating, Version,
+                                                     ProblemChange, FriendsAndFamilySurvey)]
+        cursor = connection.cursor()
+        cursor.execute("SELECT relname, reltuples::bigint FROM pg_class WHERE relname IN %s", [tuple(tables)])
+        return dict(cursor.fetchall())
+
+    def client(self, username=None):
+        """Return a Client, logged in as username if it's given"""
+        if username not in self.clients:
+            client = Client()
+            if username is not None:
+                try:
+                    user = User.objects.get(username=username)
+                except User.DoesNotExist:
+                    raise BenchmarkError("There's no {0} user, has create_benchmark_data been run?".format(username))
+                password = uuid4().hex
+                user.set_password(password)
+                user.save()
+                client.login(username=username, password=password)
+            self.clients[username] = client
+        return self.clients[username]
+
+    def page(self, url, username=None):
+        """Return a Case which fetches a page"""
+        client = self.client(username)
+
+        def run():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise BenchmarkError("{0} returned {1}".format(url, response.status_code))
+            # Make sure that anything generated lazily is included
+            response.content
+        return Case(run, None, None)
+
+    def case_interval_counts(self):
+        problem_filters = {'status': tuple(Problem.VISIBLE_STATUSES)}
+        return Case(lambda: interval_counts(problem_filters=problem_filters,
+                                            threshold=settings.SUMMARY_THRESHOLD or None),
+                    None, None)
+
+    def case_live_feed(self):
+        return self.page(reverse('live-feed', kwargs={'cobrand': 'choices'}))
+
+    def case_summary(self):
+        return self.page(reverse('org-all-summary', kwargs={'cobrand': 'choices'}))
+
+    def case_map_json(self):
+        return self.page(reverse('org-map', kwargs={'cobrand': 'choices'}) + '?format=json')
+
+    def case_ccg_dashboard(self):
+        ccg = CCG.objects.filter(users__username='benchmark-ccg').order_by('id')[:1]
+        if not ccg:
+            raise BenchmarkError("The benchmark-ccg user isn't in a CCG")
+        return self.page(reverse('ccg-dashboard', kwargs={'code': ccg[0].code}), 'benchmark-ccg')
+
+    def case_organisation_summary(self):
+        # The organisation with the most problems is the slowest
+        busiest = Organisation.objects.annotate(problem_count=Count('problem')).order_by('-problem_count')[:1]
+        if not busiest:
+            raise BenchmarkError("There are no organisations")
+        return self.page(reverse('public-org-summary', kwargs={'cobrand': 'choices',
+                                                               'ods_code': busiest[0].ods_code}))
+
+    def case_problems_csv(self):
+        return self.page(reverse('problems-csv'), 'benchmark-superuser')
+
+    def case_review_ingestion(self):
+        """A page of reviews from the API, about the first few hospitals,
+        which are new the first time and updates after that. They're deleted
+        again afterwards."""
+        choices_ids = list(Organisation.objects.filter(organisation_type='hospitals')
+                                               .order_by('id')
+                                               .values_list('choices_id', flat=True)[:20])
+        if not choices_ids:
+            raise BenchmarkError("There are no hospitals")
+        published = datetime.utcnow().replace(tzinfo=utc) - timedelta(days=1)
+        api_reviews = []
+        for number in range(100):
+            api_reviews.append({'api_posting_id': "{0}I{1}".format(CODE_PREFIX, number),
+                                'api_postingorganisationid': '0',
+                                'api_published': published.isoformat(),
+                                'api_updated': published.isoformat(),
+                                'api_category': 'comment',
+                                'author_display_name': AUTHORS[number % len(AUTHORS)],
+                                'title': REVIEW_TITLES[number % len(REVIEW_TITLES)],
+                                'content_liked': REVIEW_PHRASES[number % len(REVIEW_PHRASES)],
+                                'content_improved': '',
+                                'content': " ".join(REVIEW_PHRASES),
+                                'in_reply_to_id': None,
+                                'in_reply_to_organisation_id': None,
+                                'organisation_choices_id': unicode(choices_ids[number % len(choices_ids)]),
+                                'ratings': [{'question': RECOMMENDATION_RATING_QUESTION,
+                                             'answer': RECOMMENDATION_ANSWERS[number % 5 + 1],
+                                             'score': number % 5 + 1}]})
+        deletions = [dict(api_review, api_category='deletion') for api_review in api_reviews]
+        return Case(lambda: Review.upsert_or_delete_from_api_data_batch(api_reviews, 'hospitals'),
+                    None,
+                    lambda: Review.upsert_or_delete_from_api_data_batch(deletions, 'hospitals'))
+
+    def email_case(self, command, problems, unsent):
+        """Return a Case which runs one of the email commands after making
+        the given problems unsent, with the update unsent"""
+        problem_ids = list(problems.order_by('-id').values_list('id', flat=True)[:self.email_batch_size])
+        original = list(Problem.objects.filter(id__in=problem_ids)
+                                       .values('id', 'mailed', 'confirmation_sent', 'survey_sent'))
+
+        def before():
+            # The locmem backend keeps everything it sends
+            mail.outbox = []
+            Problem.objects.filter(id__in=problem_ids).update(**unsent)
+
+        def after():
+            mail.outbox = []
+            for values in original:
+                Problem.objects.filter(id=values.pop('id')).update(**values)
+
+        return Case(lambda: call_command(command, stdout=StringIO(), stderr=StringIO()), before, after)
+
+    def case_email_issues_to_providers(self):
+        return self.email_case('email_issues_to_providers',
+                               Problem.objects.all(),
+                               {'mailed': False})
+
+    def case_email_confirmations_to_reporters(self):
+        return self.email_case('email_confirmations_to_reporters',
+                               Problem.objects.filter(confirmation_required=True),
+                               {'confirmation_sent': None})
+
+    def case_email_surveys_to_reporters(self):
+        return self.email_case('email_surveys_to_reporters',
+                               Problem.objects.closed_problems().exclude(status=Problem.ABUSIVE).exclude(reporter_email=''),
+                               {'survey_sent': None})
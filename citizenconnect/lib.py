@@ -0,0 +1,202 @@
+import calendar
+from datetime import datetime, timedelta
+
+from django.db import connection
+from django.utils.timezone import utc
+
+from issues.models import Problem
+from reviews_display.models import Review
+
+
+class InvalidFeedCursor(Exception):
+    """Exception thrown when a live feed cursor string can't be decoded"""
+    pass
+
+
+def encode_feed_cursor(timestamp, item_type, item_id):
+    """Encode the position of an item in the live feed as a string suitable
+    for putting in a querystring.
+
+    The format is <microseconds since the epoch>-<item type>-<item id>.
+    """
+    timestamp = timestamp.astimezone(utc)
+    microseconds = calendar.timegm(timestamp.utctimetuple()) * 1000000 + timestamp.microsecond
+    return "{0}-{1}-{2}".format(microseconds, item_type, item_id)
+
+
+def decode_feed_cursor(cursor):
+    """Decode a string made by encode_feed_cursor back into a tuple of
+    (timestamp, item_type, item_id)"""
+    try:
+        microseconds, item_type, item_id = cursor.split('-')
+        timestamp = datetime(1970, 1, 1, tzinfo=utc) + timedelta(microseconds=int(microseconds))
+        item_id = int(item_id)
+    except (AttributeError, ValueError, OverflowError):
+        raise InvalidFeedCursor(cursor)
+    if item_type not in LiveFeedItems.ITEM_MODELS:
+        raise InvalidFeedCursor(cursor)
+    return (timestamp, item_type, item_id)
+
+
+class LiveFeedItems(object):
+    """A lazy, sliceable list of the Problems and Reviews shown on the live
+    feed, newest first.
+
+    Rather than loading every matching Problem and Review and merging them in
+    Python, this does a single UNION ALL query over both tables, ordered by
+    the effective timestamp (created for Problems, api_published for Reviews),
+    and only fetches the ids for the slice being asked for. The model
+    instances for that slice are then loaded with one query per type.
+
+    It implements count() and slicing, so it can be handed straight to a
+    Django Paginator for numbered pages. For cheap "next" and "previous"
+    pages, use before() and after() to seek from a cursor (see
+    encode_feed_cursor) rather than using an OFFSET.
+    """
+
+    ITEM_MODELS = {
+        'problem': Problem,
+        'review': Review,
+    }
+
+    def __init__(self, start, end=None, organisation=None):
+        self.start = start
+        self.end = end
+        self.organisation = organisation
+        self._count = None
+
+    def _problems_sql(self, params):
+        # We have to show all problems that are either open or closed, but we
+        # don't want things that have been completely removed
+        # (publication_status=REJECTED) or that are awaiting complicated legal
+        # moderation. This mirrors
+        # Problem.objects.all_not_rejected_visible_problems()
+        clauses = ["issues_problem.status IN %s",
+                   "issues_problem.publication_status != %s",
+                   "issues_problem.requires_second_tier_moderation = %s",
+                   "issues_problem.created >= %s"]
+        params.extend([tuple(Problem.VISIBLE_STATUSES), Problem.REJECTED, False, self.start])
+        if self.end is not None:
+            clauses.append("issues_problem.created <= %s")
+            params.append(self.end)
+        if self.organisation is not None:
+            clauses.append("issues_problem.organisation_id = %s")
+            params.append(self.organisation.id)
+        return """SELECT 'problem' AS item_type,
+                         issues_problem.id AS id,
+                         issues_problem.created AS timestamp
+                  FROM issues_problem
+                  WHERE %s""" % " AND ".join(clauses)
+
+    def _reviews_sql(self, params):
+        tables = "reviews_display_review"
+        if self.organisation is not None:
+            # A review can belong to several organisations (GP branches), so
+            # we only join to the link table when filtering to one of them.
+            tables += """ INNER JOIN reviews_display_review_organisations
+                          ON reviews_display_review_organisations.review_id = reviews_display_review.id
+                          AND reviews_display_review_organisations.organisation_id = %s"""
+            params.append(self.organisation.id)
+        # We don't want any "replies" to show up in the feed
+        clauses = ["reviews_display_review.in_reply_to_id IS NULL",
+                   "reviews_display_review.api_published >= %s"]
+        params.append(self.start)
+        if self.end is not None:
+            clauses.append("reviews_display_review.api_published <= %s")
+            params.append(self.end)
+        return """SELECT 'review' AS item_type,
+                         reviews_display_review.id AS id,
+                         reviews_display_review.api_published AS timestamp
+                  FROM %s
+                  WHERE %s""" % (tables, " AND ".join(clauses))
+
+    def _feed_sql(self, params):
+        return "(%s UNION ALL %s) AS feed" % (self._problems_sql(params), self._reviews_sql(params))
+
+    def count(self):
+        """Return the total number of items in the feed"""
+        if self._count is None:
+            params = []
+            db_cursor = connection.cursor()
+            db_cursor.execute("SELECT COUNT(*) FROM %s" % self._feed_sql(params), params)
+            self._count = db_cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError("LiveFeedItems only supports simple slicing")
+        offset = index.start or 0
+        if index.stop is None:
+            raise TypeError("LiveFeedItems slices must have an end")
+        return self._fetch(limit=max(index.stop - offset, 0), offset=offset)
+
+    def before(self, cursor, limit):
+        """Return up to limit items which come after the item at cursor in
+        the feed, ie: the next (older) page."""
+        return self._fetch(limit=limit, cursor=decode_feed_cursor(cursor), direction='before')
+
+    def after(self, cursor, limit):
+        """Return up to limit items which come before the item at cursor in
+        the feed, ie: the previous (newer) page."""
+        return self._fetch(limit=limit, cursor=decode_feed_cursor(cursor), direction='after')
+
+    def _fetch(self, limit, offset=0, cursor=None, direction='before'):
+        if limit <= 0:
+            return []
+
+        params = []
+        query = "SELECT item_type, id, timestamp FROM %s" % self._feed_sql(params)
+
+        if direction == 'before':
+            order = "DESC"
+            comparison = "<"
+        else:
+            # To seek backwards we walk the feed the other way and then
+            # reverse the rows we get back
+            order = "ASC"
+            comparison = ">"
+
+        if cursor is not None:
+            query += " WHERE (feed.timestamp, feed.item_type, feed.id) %s (%%s, %%s, %%s)" % comparison
+            params.extend(cursor)
+
+        query += " ORDER BY feed.timestamp {0}, feed.item_type {0}, feed.id {0}".format(order)
+        query += " LIMIT %s OFFSET %s"
+        params.extend([limit, offset])
+
+        db_cursor = connection.cursor()
+        db_cursor.execute(query, params)
+        rows = db_cursor.fetchall()
+        if direction == 'after':
+            rows.reverse()
+
+        return self._load_items(rows)
+
+    def _load_items(self, rows):
+        """Turn (item_type, id, timestamp) rows into model instances, keeping
+        the order of the rows."""
+        ids_by_type = {}
+        for item_type, item_id, timestamp in rows:
+            ids_by_type.setdefault(item_type, []).append(item_id)
+
+        instances = {}
+        if ids_by_type.get('problem'):
+            problems = Problem.objects.select_related('organisation').in_bulk(ids_by_type['problem'])
+            for problem_id, problem in problems.items():
+                instances[('problem', problem_id)] = problem
+        if ids_by_type.get('review'):
+            reviews = Review.objects.all().in_bulk(ids_by_type['review'])
+            for review_id, review in reviews.items():
+                instances[('review', review_id)] = review
+
+        items = []
+        for item_type, item_id, timestamp in rows:
+            item = instances.get((item_type, item_id))
+            # Something might have been deleted in between the two queries
+            if item is not None:
+                item.feed_cursor = encode_feed_cursor(timestamp, item_type, item_id)
+                items.append(item)
+        return items
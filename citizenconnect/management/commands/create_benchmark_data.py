@@ -0,0 +1,53 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import transaction
+
+from ...benchmark import SyntheticData, SyntheticDataExists
+
+
+class Command(NoArgsCommand):
+    help = 'Fill the database with a made-up national scale dataset to run the benchmarks against'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--organisations', action='store', dest='organisations', type='int', default=10000,
+                    help='How many organisations to make.'),
+        make_option('--problems', action='store', dest='problems', type='int', default=1000000,
+                    help='How many problems to make.'),
+        make_option('--reviews', action='store', dest='reviews', type='int', default=2000000,
+                    help='How many reviews to make.'),
+        make_option('--days', action='store', dest='days', type='int', default=730,
+                    help='How many days back to spread the problems and reviews over.'),
+        make_option('--seed', action='store', dest='seed', type='int', default=0,
+                    help='The random seed, the same seed always makes the same data.'),
+        make_option('--without-history', action='store_false', dest='history', default=True,
+                    help="Don't make the problems' revision history."),
+    )
+
+    def handle_noargs(self, *args, **options):
+        # This adds millions of fake problems, so don't let it near the live site
+        if not settings.STAGING:
+            raise CommandError("create_benchmark_data can only be run on a staging site")
+        verbosity = int(options.get('verbosity'))
+
+        def progress(message):
+            if verbosity >= 2:
+                self.stdout.write("{0}\n".format(message))
+
+        synthetic_data = SyntheticData(organisations=options['organisations'],
+                                       problems=options['problems'],
+                                       reviews=options['reviews'],
+                                       history=options['history'],
+                                       days=options['days'],
+                                       seed=options['seed'],
+                                       progress=progress)
+        try:
+            with transaction.commit_on_success():
+                counts = synthetic_data.generate()
+        except SyntheticDataExists as e:
+            raise CommandError(unicode(e))
+
+        if verbosity >= 1:
+            for name, count in sorted(counts.items()):
+                self.stdout.write("Made {0} {1}\n".format(count, name))
@@ -0,0 +1,54 @@
+import json
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+
+from ...benchmark import Benchmarks
+
+
+class Command(NoArgsCommand):
+    help = 'Time the main pages, queries and commands, and print the results as JSON'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--iterations', action='store', dest='iterations', type='int', default=5,
+                    help='How many times to run each benchmark.'),
+        make_option('--warmup', action='store', dest='warmup', type='int', default=1,
+                    help='How many times to run each benchmark before timing it.'),
+        make_option('--only', action='store', dest='only', default='',
+                    help='A comma separated list of the benchmarks to run, out of: {0}.'.format(', '.join(Benchmarks.NAMES))),
+        make_option('--cold-cache', action='store_true', dest='cold_cache', default=False,
+                    help='Empty the cache before every run.'),
+        make_option('--email-batch-size', action='store', dest='email_batch_size', type='int', default=100,
+                    help='How many problems the email commands should send each run.'),
+        make_option('--output', action='store', dest='output', default='',
+                    help='A file to write the results to, rather than printing them.'),
+    )
+
+    def handle_noargs(self, *args, **options):
+        # This resets the benchmark users' passwords, emails real problems
+        # and adds and deletes reviews, so don't let it near the live site
+        if not settings.STAGING:
+            raise CommandError("run_benchmarks can only be run on a staging site")
+        verbosity = int(options.get('verbosity'))
+        names = [name.strip() for name in options.get('only', '').split(',') if name.strip()]
+        unknown = [name for name in names if name not in Benchmarks.NAMES]
+        if unknown:
+            raise CommandError("Unknown benchmarks: {0}".format(', '.join(unknown)))
+
+        def progress(message):
+            if verbosity >= 2:
+                self.stderr.write("{0}\n".format(message))
+
+        benchmarks = Benchmarks(iterations=max(options['iterations'], 1),
+                                warmup=max(options['warmup'], 0),
+                                cold_cache=options['cold_cache'],
+                                email_batch_size=max(options['email_batch_size'], 1),
+                                progress=progress)
+        results = json.dumps(benchmarks.run(names), indent=2, sort_keys=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(results + "\n")
+        else:
+            self.stdout.write(results + "\n")
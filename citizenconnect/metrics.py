@@ -0,0 +1,302 @@
+"""
+Per-view performance metrics.
+
+MetricsMiddleware measures every request (wall time, database queries and
+time, queries which look like ones already run in the same request, template
+rendering time and cache hits and misses), and adds the measurements to
+histograms for the view that handled it. These are kept in memory in each
+process, and can be seen with the Metrics view.
+
+It's turned on with settings.METRICS_ENABLED. Requests slower than
+settings.METRICS_SLOW_REQUEST_SECONDS are also logged, along with the SQL
+they ran.
+"""
+import logging
+logger = logging.getLogger(__name__)
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template.base import Template
+
+# Measurements for the request being handled by the current thread
+_local = threading.local()
+
+# The upper bounds of the histogram buckets for timings, in milliseconds, and
+# for counts
+TIME_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Used to tell apart queries which only differ in their parameters, so that
+# we can spot the same query being run over and over (eg: for each row of a
+# table)
+QUERY_PARAMETERS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class Histogram(object):
+    """Counts how many measurements fall into each of a set of buckets"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One more for anything bigger than the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        buckets = [[upper_bound, count] for upper_bound, count in zip(self.buckets, self.counts)]
+        buckets.append(['+Inf', self.counts[-1]])
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': float(self.sum) / self.count if self.count else 0,
+            'buckets': buckets
+        }
+
+
+class ViewMetrics(object):
+    """The measurements of all the requests to one view"""
+
+    HISTOGRAMS = (
+        ('time_ms', TIME_BUCKETS),
+        ('db_time_ms', TIME_BUCKETS),
+        ('db_queries', COUNT_BUCKETS),
+        ('duplicate_queries', COUNT_BUCKETS),
+        ('template_time_ms', TIME_BUCKETS),
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.histograms = dict((name, Histogram(buckets)) for name, buckets in self.HISTOGRAMS)
+
+    def record(self, request_metrics):
+        self.requests += 1
+        self.cache_hits += request_metrics.cache_hits
+        self.cache_misses += request_metrics.cache_misses
+        for name, _ in self.HISTOGRAMS:
+            self.histograms[name].observe(getattr(request_metrics, name))
+
+    def as_dict(self):
+        data = {
+            'requests': self.requests,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+        for name, histogram in self.histograms.items():
+            data[name] = histogram.as_dict()
+        return data
+
+
+class MetricsRegistry(object):
+    """Collects the ViewMetrics of every view in this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.started = time.time()
+
+    def record(self, view_name, request_metrics):
+        with self.lock:
+            if view_name not in self.views:
+                self.views[view_name] = ViewMetrics()
+            self.views[view_name].record(request_metrics)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'uptime_seconds': time.time() - self.started,
+                'views': dict((name, view.as_dict()) for name, view in self.views.items())
+            }
+
+    def as_text(self):
+        """Return the metrics as lines of "name{labels} value", like
+        Prometheus's text format"""
+        data = self.as_dict()
+        lines = []
+        for view_name, view in sorted(data['views'].items()):
+            labels = 'view="{0}",pid="{1}"'.format(view_name, data['pid'])
+            for name in ('requests', 'cache_hits', 'cache_misses'):
+                lines.append('{0}{{{1}}} {2}'.format(name, labels, view[name]))
+            for name, _ in ViewMetrics.HISTOGRAMS:
+                histogram = view[name]
+                cumulative = 0
+                for upper_bound, count in histogram['buckets']:
+                    cumulative += count
+                    lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(name, labels, upper_bound, cumulative))
+                lines.append('{0}_sum{{{1}}} {2}'.format(name, labels, histogram['sum']))
+                lines.append('{0}_count{{{1}}} {2}'.format(name, labels, histogram['count']))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetrics(object):
+    """The measurements of a single request"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.time_ms = 0
+        self.db_time_ms = 0
+        self.db_queries = 0
+        self.duplicate_queries = 0
+        self.template_time_ms = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.queries = []
+        # How many templates deep we are, so that included and extended
+        # templates aren't counted twice
+        self.template_depth = 0
+
+    def finish(self, queries):
+        self.time_ms = (time.time() - self.started) * 1000
+        self.queries = queries
+        self.db_queries = len(queries)
+        self.db_time_ms = sum(float(query['time']) for query in queries) * 1000
+        seen = set()
+        for query in queries:
+            normalised = QUERY_PARAMETERS.sub('?', query['sql'])
+            if normalised in seen:
+                self.duplicate_queries += 1
+            seen.add(normalised)
+
+
+def current_request_metrics():
+    """Return the RequestMetrics for the request this thread is handling, if
+    it's being measured"""
+    return getattr(_local, 'request_metrics', None)
+
+
+# Wrappers around template rendering and the cache, to measure them for the
+# current request. These are installed by MetricsMiddleware, if it's turned
+# on, in the same way Django's test runner instruments template rendering.
+_installed = False
+_MISSING = object()
+
+
+def _instrumented_template_render(original_render):
+    def render(self, context):
+        request_metrics = current_request_metrics()
+        if request_metrics is None:
+            return original_render(self, context)
+        request_metrics.template_depth += 1
+        started = time.time()
+        try:
+            return original_render(self, context)
+        finally:
+            request_metrics.template_depth -= 1
+            if request_metrics.template_depth == 0:
+                request_metrics.template_time_ms += (time.time() - started) * 1000
+    return render
+
+
+def _instrumented_cache_get(original_get):
+    def get(key, default=None, version=None):
+        value = original_get(key, _MISSING, version=version)
+        request_metrics = current_request_metrics()
+        if value is _MISSING:
+            if request_metrics is not None:
+                request_metrics.cache_misses += 1
+            return default
+        if request_metrics is not None:
+            request_metrics.cache_hits += 1
+        return value
+    return get
+
+
+def _instrumented_cache_get_many(original_get_many):
+    def get_many(keys, version=None):
+        keys = list(keys)
+        values = original_get_many(keys, version=version)
+        request_metrics = current_request_metrics()
+        if request_metrics is not None:
+            request_metrics.cache_hits += len(values)
+            request_metrics.cache_misses += len(keys) - len(values)
+        return values
+    return get_many
+
+
+def install_instrumentation():
+    global _installed
+    if _installed:
+        return
+    Template._render = _instrumented_template_render(Template._render)
+    cache.get = _instrumented_cache_get(cache.get)
+    cache.get_many = _instrumented_cache_get_many(cache.get_many)
+    _installed = True
+
+
+class MetricsMiddleware(object):
+    """Measure every request, see the module docstring. This should be the
+    first middleware, so that it measures as much of the request as
+    possible."""
+
+    def __init__(self):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        install_instrumentation()
+
+    def process_request(self, request):
+        _local.request_metrics = RequestMetrics()
+        request._metrics_view_name = None
+        # Make the database connection record the queries it runs, as it
+        # does when DEBUG is on. Django forgets them at the start of each
+        # request.
+        request._metrics_first_query = len(connection.queries)
+        connection.use_debug_cursor = True
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Class based views' as_view() gives us a function named after the
+        # class
+        request._metrics_view_name = "{0}.{1}".format(view_func.__module__, view_func.__name__)
+
+    def process_response(self, request, response):
+        request_metrics = current_request_metrics()
+        if request_metrics is None:
+            return response
+        _local.request_metrics = None
+        connection.use_debug_cursor = None
+
+        request_metrics.finish(connection.queries[getattr(request, '_metrics_first_query', 0):])
+        # Requests which didn't get as far as a view (eg: 404s and
+        # redirects from other middleware) are counted together
+        view_name = getattr(request, '_metrics_view_name', None) or 'unresolved'
+        registry.record(view_name, request_metrics)
+
+        slow_request_seconds = settings.METRICS_SLOW_REQUEST_SECONDS
+        if slow_request_seconds and request_metrics.time_ms >= slow_request_seconds * 1000:
+            logger.warning("Slow request: {0} {1} ({2}) took {3:.0f}ms, {4} queries ({5} duplicates) took {6:.0f}ms:\n{7}".format(
+                request.method,
+                request.get_full_path(),
+                view_name,
+                request_metrics.time_ms,
+                request_metrics.db_queries,
+                request_metrics.duplicate_queries,
+                request_metrics.db_time_ms,
+                # Without their parameters, which can be people's details
+                "\n".join("{0}: {1}".format(query['time'], QUERY_PARAMETERS.sub('?', query['sql']))
+                          for query in request_metrics.queries)
+            ))
+        return response
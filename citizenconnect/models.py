@@ -5,7 +5,7 @@ import random
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, connection, transaction
 
 logger = logging.getLogger(__name__)
 
@@ -74,3 +74,33 @@ def delete_uploaded_file(storage, path, name, delete_empty_directory=False):
     except Exception:
         # Something else bad happened, we should probably look at this.
         logger.exception("Error whilst cleaning up image: %s", path)
+
+
+def delete_in_chunks(table, where_sql, params, delete_chunk, chunk_size=1000, progress=None):
+    """
+    Delete the rows of table matching where_sql a chunk of ids at a time,
+    committing after each chunk, so that deleting lots of rows doesn't hold
+    locks for one long transaction or load them all into memory (as
+    QuerySet.delete() does to find what else it needs to delete).
+
+    delete_chunk(cursor, chunk_where_sql, chunk_params) is called for each
+    chunk to do the actual deleting, with an SQL clause which matches the rows
+    of table in that chunk, and should return how many rows it deleted.
+    progress(deleted, done_up_to_id, max_id) is called after each chunk, if
+    it's given. Returns how many rows were deleted altogether.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT min(id), max(id) FROM {0} WHERE {1}".format(table, where_sql), params)
+    min_id, max_id = cursor.fetchone()
+    deleted = 0
+    if min_id is None:
+        return deleted
+
+    chunk_where_sql = "{0}.id >= %s AND {0}.id <= %s AND ({1})".format(table, where_sql)
+    for start in xrange(min_id, max_id + 1, chunk_size):
+        end = min(start + chunk_size - 1, max_id)
+        with transaction.commit_on_success():
+            deleted += delete_chunk(connection.cursor(), chunk_where_sql, [start, end] + list(params))
+        if progress is not None:
+            progress(deleted, end, max_id)
+    return deleted
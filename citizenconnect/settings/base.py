@@ -95,6 +95,9 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    # This is first so that it measures everything else, and is only used if
+    # METRICS_ENABLED is set
+    'citizenconnect.metrics.MetricsMiddleware',
     'djangomiddleware.redirect_middleware.FullyQualifiedRedirectMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -165,6 +168,11 @@ INSTALLED_APPS = (
 IGNORE_APPS_FOR_TESTING = ('south', 'pagination', 'reversion', 'sorl.thumbnail', 'geocoder')
 TEST_RUNNER = 'citizenconnect.tests.runner.AppsTestSuiteRunner'
 
+# Whether citizenconnect.transaction_hooks.on_commit should run things
+# straight away rather than waiting for the transaction to commit. The test
+# runner turns this on, because TestCase never commits.
+RUN_ON_COMMIT_IMMEDIATELY = False
+
 
 # Log WARN and above to stderr; ERROR and above by email when DEBUG is False.
 LOGGING = {
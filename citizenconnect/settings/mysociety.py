@@ -27,6 +27,20 @@ NHS_CHOICES_API_KEY = config.get('NHS_CHOICES_API_KEY')
 NHS_CHOICES_BASE_URL = config.get('NHS_CHOICES_BASE_URL')
 NHS_CHOICES_POSTING_ORGANISATION_ID = config.get('NHS_CHOICES_POSTING_ORGANISATION_ID')
 NHS_CHOICES_API_MAX_REVIEW_AGE_IN_DAYS = config.get('NHS_CHOICES_API_MAX_REVIEW_AGE_IN_DAYS')
+# How long to wait for the NHS Choices API (in seconds), how many times to
+# retry GETs it gives a server error for, and how long to wait before the
+# first retry (doubled for each retry after that)
+NHS_CHOICES_API_TIMEOUT_SECONDS = config.get('NHS_CHOICES_API_TIMEOUT_SECONDS', 30)
+NHS_CHOICES_API_RETRIES = config.get('NHS_CHOICES_API_RETRIES', 3)
+NHS_CHOICES_API_RETRY_BACKOFF_SECONDS = config.get('NHS_CHOICES_API_RETRY_BACKOFF_SECONDS', 1)
+# How many connections to the NHS Choices API to keep open
+NHS_CHOICES_API_POOL_SIZE = config.get('NHS_CHOICES_API_POOL_SIZE', 10)
+# How many pages of reviews of each organisation type get_reviews_from_choices_api
+# fetches at once
+NHS_CHOICES_API_REVIEW_WORKERS = config.get('NHS_CHOICES_API_REVIEW_WORKERS', 4)
+# Where to keep NHS Choices API responses, so that we only download them
+# again if they've changed. Blank to not keep them.
+NHS_CHOICES_API_CACHE_DIR = config.get('NHS_CHOICES_API_CACHE_DIR', '')
 
 
 API_BASICAUTH_USERNAME = config.get('API_BASICAUTH_USERNAME')
@@ -35,6 +49,8 @@ API_BASICAUTH_PASSWORD = config.get('API_BASICAUTH_PASSWORD')
 ALLOWED_COBRANDS = config.get('ALLOWED_COBRANDS')
 
 MAPIT_BASE_URL = config.get('MAPIT_BASE_URL')
+MAPIT_TIMEOUT_SECONDS = config.get('MAPIT_TIMEOUT_SECONDS', 5)
+POSTCODE_MAPIT_FALLBACK = config.get('POSTCODE_MAPIT_FALLBACK', True)
 
 WGS_84 = 4326
 
@@ -91,6 +107,46 @@ ALLOWED_HOSTS = [] if STAGING else config.get('ALLOWED_HOSTS', [])
 LIVE_FEED_CUTOFF_DAYS = config.get("LIVE_FEED_CUTOFF_DAYS")
 LIVE_FEED_PER_PAGE = config.get("LIVE_FEED_PER_PAGE")
 
+# The cache has to be shared by all the web processes and cron jobs (eg:
+# memcached), because cached map tiles and user access are invalidated from
+# wherever the data behind them changes
+CACHES = {
+    'default': {
+        'BACKEND': config.get('CACHE_BACKEND', 'django.core.cache.backends.memcached.MemcachedCache'),
+        'LOCATION': config.get('CACHE_LOCATION', '127.0.0.1:11211'),
+        'KEY_PREFIX': config.get('CACHE_KEY_PREFIX', 'citizenconnect'),
+    }
+}
+
+# How long to cache the data for each tile of the map for (in seconds), and
+# the zoom level below which organisations on it are clustered together
+MAP_TILE_CACHE_SECONDS = config.get("MAP_TILE_CACHE_SECONDS", 3600)
+MAP_TILE_CLUSTER_ZOOM = config.get("MAP_TILE_CLUSTER_ZOOM", 12)
+
+# How long to share the groups, CCGs and Organisation Parents a user can
+# access between requests for (in seconds), 0 to load them every request.
+# Changes to them have to reach every process as soon as they're committed,
+# so this needs a shared cache.
+USER_ACCESS_CACHE_SECONDS = config.get("USER_ACCESS_CACHE_SECONDS", 0)
+if USER_ACCESS_CACHE_SECONDS and CACHES['default']['BACKEND'] in ('django.core.cache.backends.locmem.LocMemCache',
+                                                                  'django.core.cache.backends.dummy.DummyCache'):
+    from django.core.exceptions import ImproperlyConfigured
+    raise ImproperlyConfigured("USER_ACCESS_CACHE_SECONDS needs a CACHE_BACKEND which is shared between processes")
+
+# How often to write the log of pages NHS Superusers have accessed (in
+# seconds), and how many entries to collect before writing them sooner.
+# Setting SUPERUSER_LOG_FLUSH_SECONDS to 0 writes every entry immediately.
+SUPERUSER_LOG_FLUSH_SECONDS = config.get("SUPERUSER_LOG_FLUSH_SECONDS", 5)
+SUPERUSER_LOG_FLUSH_SIZE = config.get("SUPERUSER_LOG_FLUSH_SIZE", 100)
+
+# Whether to measure the time, database queries and cache hits of every
+# request, how slow a request has to be (in seconds) to be logged with the SQL
+# it ran (0 to not log any), and a token which lets monitoring tools see the
+# metrics without logging in
+METRICS_ENABLED = config.get("METRICS_ENABLED", False)
+METRICS_SLOW_REQUEST_SECONDS = config.get("METRICS_SLOW_REQUEST_SECONDS", 0)
+METRICS_ACCESS_TOKEN = config.get("METRICS_ACCESS_TOKEN", "")
+
 # Monitoring settings
 # Each setting effectively is a deadline for a specific check, (in hours)
 PROBLEMS_MUST_BE_SENT = config.get("PROBLEMS_MUST_BE_SENT", 2)
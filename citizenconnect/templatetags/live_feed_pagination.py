@@ -3,6 +3,23 @@ register = template.Library()
 
 from organisations.templatetags.organisation_extras import paginator
 
+# GET params which say where in the feed a page starts, these shouldn't be
+# carried over into links to other pages
+CURSOR_PARAMS = ('page', 'before', 'after')
+
+
+def page_querystring(request, page, **cursor):
+    """Return a querystring for the given page of the live feed, keeping any
+    filters from the current request."""
+    params = request.GET.copy()
+    for param in CURSOR_PARAMS:
+        params.pop(param, None)
+    params['page'] = page
+    for name, value in cursor.items():
+        params[name] = value
+    return '?' + params.urlencode()
+
+
 def live_feed_paginator(context, adjacent_pages=2):
     """
     Adds pagination context variables for use in displaying the live feed
@@ -11,8 +28,34 @@ def live_feed_paginator(context, adjacent_pages=2):
                                 request: the request context
     """
     pagination_context = paginator(context, adjacent_pages)
+    request = context['request']
+    page_obj = pagination_context['page_obj']
     # Pass through the request context so that we can update querystrings with pagination params
-    pagination_context['request'] = context['request']
+    pagination_context['request'] = request
+
+    pagination_context['first_page_querystring'] = page_querystring(request, 1)
+    pagination_context['last_page_querystring'] = page_querystring(request, page_obj.paginator.num_pages)
+    pagination_context['page_links'] = [
+        (page, page_querystring(request, page))
+        for page in pagination_context['page_numbers']
+    ]
+
+    # Next and previous links seek from the last/first item on this page
+    # rather than making the database count through to a page number
+    items = list(page_obj.object_list)
+    if page_obj.has_previous():
+        if items and hasattr(items[0], 'feed_cursor'):
+            cursor = {'after': items[0].feed_cursor}
+        else:
+            cursor = {}
+        pagination_context['previous_page_querystring'] = page_querystring(request, page_obj.previous_page_number(), **cursor)
+    if page_obj.has_next():
+        if items and hasattr(items[-1], 'feed_cursor'):
+            cursor = {'before': items[-1].feed_cursor}
+        else:
+            cursor = {}
+        pagination_context['next_page_querystring'] = page_querystring(request, page_obj.next_page_number(), **cursor)
+
     return pagination_context
 
 
@@ -8,3 +8,6 @@ from .concurrent_form import *
 from .requirements import *
 from .live_feed_page import *
 from .health_check import *
+from .metrics import *
+from .benchmark import *
+from .transaction_hooks import *
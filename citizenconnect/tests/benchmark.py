@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Sum
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from reversion.models import Version
+
+from issues.models import Problem, ProblemChange
+from organisations.models import CCG, Organisation, OrganisationParent, DailyProblemCount, DailyReviewCount
+from reviews_display.models import Review, Rating
+
+from ..benchmark import SyntheticData, SyntheticDataExists, Benchmarks, percentile, copy_value
+
+
+class BenchmarkHelperTests(TestCase):
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile(values, 1), 100)
+        self.assertEqual(percentile([7], 0.99), 7)
+
+    def test_copy_value(self):
+        self.assertEqual(copy_value(None), '\\N')
+        self.assertEqual(copy_value(True), 't')
+        self.assertEqual(copy_value(u'a\tb\\c\nd'), 'a\\tb\\\\c\\nd')
+
+
+class SyntheticDataTests(TestCase):
+
+    def generate(self, **kwargs):
+        options = {'organisations': 20, 'problems': 60, 'reviews': 80}
+        options.update(kwargs)
+        return SyntheticData(**options).generate()
+
+    def test_generate(self):
+        counts = self.generate()
+
+        self.assertEqual(Organisation.objects.count(), 20)
+        self.assertEqual(Problem.objects.count(), 60)
+        self.assertEqual(Review.objects.count(), 80)
+        self.assertEqual(counts['problems'], 60)
+        self.assertTrue(CCG.objects.filter(code='BMC00000').exists())
+        self.assertTrue(OrganisationParent.objects.exists())
+        self.assertTrue(Rating.objects.exists())
+
+        # Every problem has a history which starts with it being reported
+        for problem in Problem.objects.all():
+            versions = Version.objects.get_for_object(problem)
+            self.assertTrue(versions.count() >= 1)
+            self.assertEqual(ProblemChange.objects.filter(problem=problem).count(), versions.count())
+            self.assertEqual(versions[0].field_dict['description'], problem.description)
+
+        # And the rollups have been rebuilt
+        self.assertEqual(DailyProblemCount.objects.aggregate(Sum('count'))['count__sum'], 60)
+        self.assertTrue(DailyReviewCount.objects.exists())
+
+    def test_generate_without_history(self):
+        self.generate(history=False)
+        self.assertEqual(Problem.objects.count(), 60)
+        self.assertEqual(Version.objects.count(), 0)
+
+    def test_generate_is_reproducible(self):
+        self.generate(seed=42)
+        first = list(Problem.objects.order_by('id').values_list('description', 'status', 'organisation__ods_code'))
+        Problem.objects.all().delete()
+        Review.objects.all().delete()
+        Organisation.objects.all().delete()
+        OrganisationParent.objects.all().delete()
+        CCG.objects.all().delete()
+        User.objects.filter(username__startswith='benchmark-').delete()
+        self.generate(seed=42)
+        second = list(Problem.objects.order_by('id').values_list('description', 'status', 'organisation__ods_code'))
+        self.assertEqual(first, second)
+
+    def test_generate_refuses_to_run_twice(self):
+        self.generate()
+        self.assertRaises(SyntheticDataExists, self.generate)
+
+    @override_settings(STAGING=False)
+    def test_command_only_runs_on_staging(self):
+        self.assertRaises(CommandError, call_command, 'create_benchmark_data', organisations=20, problems=60, reviews=80)
+
+
+class BenchmarksTests(TestCase):
+
+    def setUp(self):
+        SyntheticData(organisations=20, problems=60, reviews=80).generate()
+
+    def test_run(self):
+        results = Benchmarks(iterations=2, warmup=0).run(['interval_counts', 'live_feed'])
+        for name in ('interval_counts', 'live_feed'):
+            stats = results['benchmarks'][name]
+            self.assertEqual(stats['iterations'], 2)
+            self.assertTrue(stats['p50_ms'] <= stats['max_ms'])
+            self.assertTrue(stats['queries_max'] > 0)
+
+    def test_email_commands_are_put_back(self):
+        before = list(Problem.objects.order_by('id').values_list('mailed', 'survey_sent'))
+        results = Benchmarks(iterations=1, warmup=0, email_batch_size=5).run(['email_issues_to_providers',
+                                                                              'email_surveys_to_reporters'])
+        self.assertFalse('error' in results['benchmarks']['email_issues_to_providers'])
+        after = list(Problem.objects.order_by('id').values_list('mailed', 'survey_sent'))
+        self.assertEqual(before, after)
+
+    def test_review_ingestion_is_cleaned_up(self):
+        review_count = Review.objects.count()
+        Benchmarks(iterations=2, warmup=0).run(['review_ingestion'])
+        self.assertEqual(Review.objects.count(), review_count)
+
+    @override_settings(STAGING=True)
+    def test_command(self):
+        output_fd, output_path = tempfile.mkstemp()
+        os.close(output_fd)
+        try:
+            call_command('run_benchmarks', iterations=1, warmup=0, only='interval_counts,summary', output=output_path)
+            with open(output_path) as output:
+                results = json.load(output)
+        finally:
+            os.remove(output_path)
+        self.assertEqual(sorted(results['benchmarks'].keys()), ['interval_counts', 'summary'])
+        self.assertTrue(results['table_sizes'])
+
+    @override_settings(STAGING=True)
+    def test_command_rejects_unknown_benchmarks(self):
+        self.assertRaises(CommandError, call_command, 'run_benchmarks', only='nonsense')
+
+    @override_settings(STAGING=False)
+    def test_command_only_runs_on_staging(self):
+        self.assertRaises(CommandError, call_command, 'run_benchmarks', iterations=1, warmup=0, only='interval_counts')
@@ -337,3 +337,48 @@ class LiveFeedTests(TestCase):
         self.assertContains(resp, review.organisations.all()[0].name)
         self.assertContains(resp, django_date(localtime(review.api_published), formats.DATETIME_FORMAT))
         self.assertContains(resp, capfirst(review.title))
+
+    @override_settings(LIVE_FEED_PER_PAGE=2)
+    def test_pagination_with_cursors(self):
+        # Mix problems and reviews so that the cursor has to order across both
+        problem3 = create_problem_with_age(self.organisation, 3)
+        review2 = create_review_with_age(self.organisation, 2)
+        problem1 = create_problem_with_age(self.organisation, 1)
+
+        problem1_url = reverse('problem-view', kwargs={'pk': problem1.id, 'cobrand': 'choices'})
+        problem3_url = reverse('problem-view', kwargs={'pk': problem3.id, 'cobrand': 'choices'})
+        review2_url = reverse(
+            'review-detail',
+            kwargs={
+                'api_posting_id': review2.api_posting_id,
+                'ods_code': self.organisation.ods_code,
+                'cobrand': 'choices'
+            }
+        )
+
+        resp = self.client.get(self.live_feed_url)
+        self.assertEqual(list(resp.context['issues']), [problem1, review2])
+        self.assertContains(resp, problem1_url)
+        self.assertContains(resp, review2_url)
+        self.assertNotContains(resp, problem3_url)
+
+        # The next link should seek from the last item on the page
+        next_cursor = resp.context['issues'][1].feed_cursor
+        resp = self.client.get(self.live_feed_url, {'page': 2, 'before': next_cursor})
+        self.assertEqual(list(resp.context['issues']), [problem3])
+        self.assertEqual(resp.context['page_obj'].number, 2)
+
+        # And the previous link from the first item on the page
+        previous_cursor = resp.context['issues'][0].feed_cursor
+        resp = self.client.get(self.live_feed_url, {'page': 1, 'after': previous_cursor})
+        self.assertEqual(list(resp.context['issues']), [problem1, review2])
+
+    @override_settings(LIVE_FEED_PER_PAGE=2)
+    def test_pagination_ignores_bad_cursors(self):
+        create_problem_with_age(self.organisation, 3)
+        create_problem_with_age(self.organisation, 2)
+        problem1 = create_problem_with_age(self.organisation, 1)
+
+        resp = self.client.get(self.live_feed_url, {'page': 1, 'before': 'not-a-cursor'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context['issues'][0], problem1)
@@ -0,0 +1,102 @@
+from mock import patch
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.urlresolvers import reverse
+from django.utils import simplejson as json
+
+from organisations.tests.lib import AuthorizationTestCase
+
+from .. import metrics
+from ..metrics import registry, Histogram, RequestMetrics
+
+
+class HistogramTests(TestCase):
+
+    def test_observe(self):
+        histogram = Histogram((10, 100))
+        for value in (1, 10, 50, 1000):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 1061)
+
+
+class RequestMetricsTests(TestCase):
+
+    def test_finish_counts_queries_and_duplicates(self):
+        request_metrics = RequestMetrics()
+        queries = [
+            {'sql': 'SELECT * FROM "issues_problem" WHERE "id" = 1', 'time': '0.002'},
+            {'sql': 'SELECT * FROM "issues_problem" WHERE "id" = 2', 'time': '0.003'},
+            {'sql': 'SELECT * FROM "auth_user" WHERE "username" = \'bob\'', 'time': '0.005'},
+        ]
+        request_metrics.finish(queries)
+        self.assertEqual(request_metrics.db_queries, 3)
+        self.assertEqual(request_metrics.duplicate_queries, 1)
+        self.assertAlmostEqual(request_metrics.db_time_ms, 10)
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_ACCESS_TOKEN='secret')
+class MetricsMiddlewareTests(AuthorizationTestCase):
+
+    def setUp(self):
+        super(MetricsMiddlewareTests, self).setUp()
+        registry.reset()
+        self.about_url = reverse('about', kwargs={'cobrand': 'choices'})
+        self.metrics_url = reverse('metrics')
+
+    def tearDown(self):
+        super(MetricsMiddlewareTests, self).tearDown()
+        registry.reset()
+
+    def test_requests_are_recorded_by_view(self):
+        self.client.get(self.about_url)
+        self.client.get(self.about_url)
+        view_metrics = registry.views['citizenconnect.views.About']
+        self.assertEqual(view_metrics.requests, 2)
+        self.assertEqual(view_metrics.histograms['time_ms'].count, 2)
+        self.assertTrue(view_metrics.histograms['template_time_ms'].sum > 0)
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=0.000001)
+    def test_slow_requests_are_logged_without_query_parameters(self):
+        self.login_as(self.trust_user)
+        session_key = self.client.cookies['sessionid'].value
+        with patch.object(metrics.logger, 'warning') as mock_warning:
+            self.client.get(self.about_url)
+        message = mock_warning.call_args[0][0]
+        self.assertTrue(message.startswith('Slow request: GET {0}'.format(self.about_url)))
+        self.assertTrue('?' in message)
+        self.assertFalse(session_key in message)
+
+    def test_metrics_requires_superuser_or_token(self):
+        resp = self.client.get(self.metrics_url)
+        self.assertEqual(resp.status_code, 403)
+
+        resp = self.client.get(self.metrics_url, {'token': 'wrong'})
+        self.assertEqual(resp.status_code, 403)
+
+        resp = self.client.get(self.metrics_url, {'token': 'secret'})
+        self.assertEqual(resp.status_code, 200)
+
+        for user in self.users_who_can_access_everything:
+            self.login_as(user)
+            resp = self.client.get(self.metrics_url)
+            self.assertEqual(resp.status_code, 200)
+
+    def test_metrics_json(self):
+        self.client.get(self.about_url)
+        resp = self.client.get(self.metrics_url, {'token': 'secret'})
+        data = json.loads(resp.content)
+        self.assertEqual(data['views']['citizenconnect.views.About']['requests'], 1)
+
+    def test_metrics_text(self):
+        self.client.get(self.about_url)
+        resp = self.client.get(self.metrics_url, {'token': 'secret', 'format': 'text'})
+        self.assertEqual(resp['Content-Type'], 'text/plain')
+        self.assertContains(resp, 'requests{view="citizenconnect.views.About"')
+
+    @override_settings(METRICS_ACCESS_TOKEN='')
+    def test_empty_token_does_not_allow_access(self):
+        resp = self.client.get(self.metrics_url, {'token': ''})
+        self.assertEqual(resp.status_code, 403)
@@ -49,6 +49,12 @@ class AppsTestSuiteRunner(DjangoTestSuiteRunner):
         settings.MEDIA_ROOT = tempfile.mkdtemp()
         settings.STATICFILES_STORAGE = 'pipeline.storage.PipelineFinderStorage'
         pipeline_settings.PIPELINE_ENABLED = True
+        # Write superuser logs straight away, because the background thread
+        # that writes them otherwise can't see the test's transaction
+        settings.SUPERUSER_LOG_FLUSH_SECONDS = 0
+        # Nothing's ever committed in a TestCase, so cache invalidations and
+        # the like have to happen straight away
+        settings.RUN_ON_COMMIT_IMMEDIATELY = True
 
     def teardown_test_environment(self):
         super(AppsTestSuiteRunner, self).teardown_test_environment
@@ -0,0 +1,42 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+
+from ..transaction_hooks import on_commit
+
+
+@override_settings(RUN_ON_COMMIT_IMMEDIATELY=False)
+class OnCommitTests(TransactionTestCase):
+
+    def setUp(self):
+        self.called = []
+
+    def callback(self):
+        self.called.append(True)
+
+    def test_runs_straight_away_without_a_transaction(self):
+        on_commit(self.callback)
+        self.assertEqual(self.called, [True])
+
+    def test_waits_for_the_transaction_to_commit(self):
+        with transaction.commit_on_success():
+            User.objects.create_user('hooked', 'hooked@example.com')
+            on_commit(self.callback)
+            self.assertEqual(self.called, [])
+        self.assertEqual(self.called, [True])
+
+    def test_is_forgotten_when_the_transaction_rolls_back(self):
+        try:
+            with transaction.commit_on_success():
+                User.objects.create_user('hooked', 'hooked@example.com')
+                on_commit(self.callback)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.called, [])
+
+        # And not run by the next commit either
+        with transaction.commit_on_success():
+            User.objects.create_user('hooked', 'hooked@example.com')
+        self.assertEqual(self.called, [])
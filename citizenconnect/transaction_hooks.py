@@ -0,0 +1,82 @@
+"""
+Running things once the current transaction has committed.
+
+Django 1.4 doesn't have a way to do this, so on_commit wraps the database
+connection's commit and rollback (in the same way that metrics.py wraps
+template rendering) to run or throw away the functions it's been given.
+This is for things like invalidating cached data, which mustn't happen
+before the new data can be seen by other processes, otherwise they can cache
+the old data again.
+"""
+import logging
+logger = logging.getLogger(__name__)
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+# Functions waiting for the current thread's transaction to commit
+_local = threading.local()
+_install_lock = threading.Lock()
+_installed = False
+
+
+def _pending():
+    if not hasattr(_local, 'callbacks'):
+        _local.callbacks = []
+    return _local.callbacks
+
+
+def _run_pending():
+    callbacks, _local.callbacks = _pending(), []
+    for func in callbacks:
+        # The commit has already happened, so don't make it look as though it
+        # failed
+        try:
+            func()
+        except Exception:
+            logger.exception("Error running {0} after a commit".format(func))
+
+
+def _discard_pending():
+    _local.callbacks = []
+
+
+def install():
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        wrapper_class = connections[DEFAULT_DB_ALIAS].__class__
+        original_commit = wrapper_class._commit
+        original_rollback = wrapper_class._rollback
+
+        def _commit(self):
+            result = original_commit(self)
+            if self.alias == DEFAULT_DB_ALIAS:
+                _run_pending()
+            return result
+
+        def _rollback(self):
+            result = original_rollback(self)
+            if self.alias == DEFAULT_DB_ALIAS:
+                _discard_pending()
+            return result
+
+        wrapper_class._commit = _commit
+        wrapper_class._rollback = _rollback
+        _installed = True
+
+
+def on_commit(func):
+    """
+    Call func once everything written so far is committed. That's straight
+    away unless a transaction is being managed (eg: by TransactionMiddleware
+    or commit_on_success), in which case it's when that transaction commits.
+    If it's rolled back instead, func is never called.
+    """
+    if settings.RUN_ON_COMMIT_IMMEDIATELY or not transaction.is_managed():
+        func()
+        return
+    install()
+    _pending().append(func)
@@ -15,7 +15,8 @@ from .views import (
     CommonQuestions,
     Boom,
     LiveFeed,
-    HealthCheck
+    HealthCheck,
+    Metrics
 )
 
 # Admin section
@@ -64,6 +65,9 @@ urlpatterns = patterns(
 
     # Healthcheck page
     url(r'^health$', HealthCheck.as_view(), name='healthcheck'),
+
+    # Performance metrics
+    url(r'^metrics$', Metrics.as_view(), name='metrics'),
 )
 
 # Append /careconnect to everything above, to fix proxy relative link issues
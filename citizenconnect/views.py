@@ -1,26 +1,32 @@
 from datetime import datetime, date, time, timedelta
 
 # Django imports
-from django.views.generic import TemplateView
+from django.views.generic import TemplateView, View
 from django.views.generic.edit import FormView
 from django.core.urlresolvers import reverse, reverse_lazy
 from django.conf import settings
-from django.http import HttpResponseRedirect, HttpResponsePermanentRedirect
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponsePermanentRedirect
 from django.template.loader import get_template
 from django.core import mail
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.paginator import Paginator, Page, EmptyPage, PageNotAnInteger
 from django.template import Context
 from django.utils import timezone
+from django.utils import simplejson as json
+from django.core.exceptions import PermissionDenied
 
 from django.contrib.auth.models import User
+from django.db.models import Q
 
 # App imports
+from organisations.auth import user_is_superuser
 from issues.forms import PublicLookupForm
 from issues.models import Problem
 from reviews_display.models import Review
 from reviews_submit.models import Review as SubmittedReview
 
 from .forms import LiveFeedFilterForm, FeedbackForm
+from .lib import LiveFeedItems, InvalidFeedCursor
+from .metrics import registry as metrics_registry
 
 
 class Home(FormView):
@@ -164,10 +170,12 @@ class LiveFeed(FormView):
 
         # Pass form kwargs from GET instead of POST
         if self.request.GET:
-            # We pop the page GET variable because otherwise the form will
+            # We pop the page GET variables because otherwise the form will
             # ignore initial data just because you specified a page
             data = self.request.GET.copy()
             data.pop('page', None)
+            data.pop('before', None)
+            data.pop('after', None)
             if data:
                 kwargs['data'] = data
         return kwargs
@@ -187,14 +195,6 @@ class LiveFeed(FormView):
     def get_context_data(self, **kwargs):
         context = super(LiveFeed, self).get_context_data(**kwargs)
 
-        # Get base queryset of problems and reviews
-        # Problems - we have to show all problems that are either open or
-        # closed, but we don't want things that have been completely removed
-        # (publication_status=REJECTED) or that are awaiting complicated legal
-        # moderation.
-        problems = Problem.objects.all_not_rejected_visible_problems().order_by('-created')
-        reviews = Review.objects.all().filter(in_reply_to=None).order_by('-api_published')
-
         filters = self.build_filters(context['form'])
 
         # Apply filters
@@ -207,40 +207,23 @@ class LiveFeed(FormView):
         # We have to make this a timezone-aware datetime to keep the ORM happy
         start_datetime = datetime.combine(start_date, time.min).replace(tzinfo=timezone.utc)
         context['cutoff_date'] =  start_datetime
-        problems = problems.filter(created__gte=start_datetime)
-        reviews = reviews.filter(api_published__gte=start_datetime)
 
         # End date
+        end_datetime = None
         if filters.get('end'):
             end_date = filters['end']
             # We also have to make this a timezone-aware datetime to keep the ORM happy
             end_datetime = datetime.combine(end_date, time.max).replace(tzinfo=timezone.utc)
-            problems = problems.filter(created__lte=end_datetime)
-            reviews = reviews.filter(api_published__lte=end_datetime)
 
-        # Organisation
-        if filters.get('organisation'):
-            organisation = filters['organisation']
-            problems = problems.filter(organisation=organisation)
-            reviews = reviews.filter(organisations=organisation)
-
-        # Merge and reverse date sort, getting most recent from merged list
-        # TODO - this is really inefficient and will probably take a long
-        # time for large date ranges, perhaps we need to rewrite the whole
-        # thing as custom SQL one day to avoid merging/sorting these two lists...
-        issues = (list(problems) + list(reviews))
-        date_created = lambda issue: issue.api_published if hasattr(issue, 'api_published') else issue.created
-        issues.sort(key=date_created, reverse=True)
+        # Problems and Reviews merged and reverse date sorted in the database,
+        # see LiveFeedItems for details of what's included
+        feed_items = LiveFeedItems(start=start_datetime,
+                                   end=end_datetime,
+                                   organisation=filters.get('organisation'))
 
         # Deal with pagination
-        paginator = Paginator(issues, settings.LIVE_FEED_PER_PAGE)
-        page = self.request.GET.get('page', 1)
-        try:
-            issues = paginator.page(page)
-        except PageNotAnInteger:
-            issues = paginator.page(1)
-        except EmptyPage:
-            issues = paginator.page(paginator.num_pages)
+        paginator = Paginator(feed_items, settings.LIVE_FEED_PER_PAGE)
+        issues = self.get_page(paginator, feed_items)
 
         context['issues'] = issues
         context['page_obj'] = issues
@@ -248,6 +231,33 @@ class LiveFeed(FormView):
 
         return context
 
+    def get_page(self, paginator, feed_items):
+        """Return the page of the feed that was asked for.
+
+        Following the next/previous links gives us a cursor to seek from, which
+        is much cheaper than counting through the feed to a page number, so we
+        use that if we can, and fall back to the page number otherwise.
+        """
+        page = self.request.GET.get('page', 1)
+        try:
+            number = paginator.validate_number(page)
+        except PageNotAnInteger:
+            return paginator.page(1)
+        except EmptyPage:
+            return paginator.page(paginator.num_pages)
+
+        for direction in ['before', 'after']:
+            cursor = self.request.GET.get(direction)
+            if cursor:
+                try:
+                    items = getattr(feed_items, direction)(cursor, settings.LIVE_FEED_PER_PAGE)
+                except InvalidFeedCursor:
+                    break
+                if items:
+                    return Page(items, number, paginator)
+
+        return paginator.page(number)
+
 
 class HealthCheck(TemplateView):
 
@@ -298,14 +308,11 @@ class HealthCheck(TemplateView):
             context['unsent_confirmations_healthy'] = False
 
         # Unsent surveys
-        unsent_surveys = list(Problem.objects.requiring_survey_to_be_sent())
-        # These are a bit trickier because we don't have a timestamp for when
-        # they are closed, which is the key piece of information to see if
-        # the email sending is late. To find this out, we inspect the revision
-        # history to find any that were closed more than two hours ago.
-        for problem in unsent_surveys:
-            if problem.closed_timestamp >= surveys_must_be_sent_by:
-                unsent_surveys.remove(problem)
+        # Problems closed before we stored when problems were closed (which
+        # haven't been backfilled) are counted as late, as we can't tell
+        unsent_surveys = Problem.objects.requiring_survey_to_be_sent().filter(
+            Q(closed__lt=surveys_must_be_sent_by) | Q(closed__isnull=True)
+        )
         context['unsent_surveys'] = unsent_surveys
         context['unsent_surveys_healthy'] = True
 
@@ -335,3 +342,27 @@ class HealthCheck(TemplateView):
                 context['latest_choices_review_healthy'] = False
 
         return context
+
+
+class Metrics(View):
+    """
+    The per-view performance metrics collected by
+    citizenconnect.metrics.MetricsMiddleware, as JSON, or in Prometheus's
+    text format with ?format=text.
+
+    Metrics are kept separately by each process, so this only shows the ones
+    of the process which happens to serve it (its pid is included).
+
+    Only superusers can see this, or anyone giving settings.METRICS_ACCESS_TOKEN
+    as ?token=, for monitoring tools.
+    """
+
+    def get(self, request, *args, **kwargs):
+        token = request.GET.get('token')
+        token_allowed = settings.METRICS_ACCESS_TOKEN and token == settings.METRICS_ACCESS_TOKEN
+        if not token_allowed and not user_is_superuser(request.user):
+            raise PermissionDenied()
+
+        if request.GET.get('format') == 'text':
+            return HttpResponse(metrics_registry.as_text(), content_type='text/plain')
+        return HttpResponse(json.dumps(metrics_registry.as_dict()), content_type='application/json')
@@ -49,41 +49,48 @@ def changes_as_string(changed_attrs, transitions):
 def changed_attrs_by_version(model, interesting_attrs):
     """Produce an ordered dictionary of changed attrs for a model, keyed by version"""
     changed = OrderedDict()
-    history = reversion.get_for_object(model).order_by("revision__date_created")
+    history = list(reversion.get_for_object(model).order_by("revision__date_created"))
+    field_dicts = []
+    for version in history:
+        try:
+            field_dicts.append(version.field_dict)
+        except DeserializationError:
+            # Django's deserialisation framework gets upset if it tries to get
+            # a model instance from some json or xml and the instance has fields
+            # which are no longer in the Model - eg: because you just deleted them
+            # in a South migration.
+            # In Django 1.5 you can tell it to ignorenonexistent and it'll just work
+            # which django-reversion helpfully does since:
+            # https://github.com/etianen/django-reversion/issues/221
+            # In Django 1.4 there is not this option, and thus django-reversion
+            # hits a block when trying to get its' historical versions of the model
+            # and passes on this error to us. At which point we can nothing useful
+            # with it, and so we just ignore that point in history.
+            field_dicts.append(None)
     for index, version in enumerate(history):
         # We're only interested in changes
         if index > 0:
-            try:
-                old = history[index - 1].field_dict
-                new = version.field_dict
+            old = field_dicts[index - 1]
+            new = field_dicts[index]
+            if old is not None and new is not None:
                 changed[version] = changed_attrs(old, new, interesting_attrs)
-            except DeserializationError:
-                # Django's deserialisation framework gets upset if it tries to get
-                # a model instance from some json or xml and the instance has fields
-                # which are no longer in the Model - eg: because you just deleted them
-                # in a South migration.
-                # In Django 1.5 you can tell it to ignorenonexistent and it'll just work
-                # which django-reversion helpfully does since:
-                # https://github.com/etianen/django-reversion/issues/221
-                # In Django 1.4 there is not this option, and thus django-reversion
-                # hits a block when trying to get its' historical versions of the model
-                # and passes on this error to us. At which point we can nothing useful
-                # with it, and so we just ignore that point in history.
-                pass
     return changed
 
 
 def changes_for_model(model):
-    """Return a list of changes in English for a given model."""
+    """Return a list of changes in English for a given model.
+
+    These come from the :model:`issues.ProblemChange`s stored when each of
+    the model's revisions were saved, so this is a single query however
+    many revisions there are."""
     change_strings = []
-    for version, changes in changed_attrs_by_version(model, model.REVISION_ATTRS).items():
-        change_string = changes_as_string(changes, model.TRANSITIONS)
-        if change_string:
-            change_strings.append({
-                "user": version.revision.user,
-                "description": change_string,
-                "when": version.revision.date_created
-            })
+    changes = model.changes.exclude(description='').select_related('user').order_by('date_created', 'id')
+    for change in changes:
+        change_strings.append({
+            "user": change.user,
+            "description": change.description,
+            "when": change.date_created
+        })
 
     return change_strings
 
@@ -0,0 +1,80 @@
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.core.serializers.base import DeserializationError
+from django.db import transaction
+
+from reversion.models import Version, VERSION_DELETE
+
+from ...models import Problem, ProblemChange
+
+
+@transaction.commit_manually
+class Command(BaseCommand):
+    help = "Rebuild the stored changes in each problem's revisions from their revision history"
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--batch-size',
+            action='store',
+            dest='batch_size',
+            type='int',
+            default=200,
+            help='How many problems to rebuild the changes of before committing.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity'))
+        batch_size = max(int(options.get('batch_size') or 200), 1)
+
+        problem_content_type = ContentType.objects.get_for_model(Problem)
+        problem_ids = list(Problem.objects.order_by('id').values_list('id', flat=True))
+        # Finish the transaction that the query above started
+        transaction.commit()
+
+        recorded = 0
+        for start in range(0, len(problem_ids), batch_size):
+            batch_ids = problem_ids[start:start + batch_size]
+            try:
+                # Get all the versions of the whole batch of problems at once
+                versions = Version.objects.filter(content_type=problem_content_type,
+                                                  object_id_int__in=batch_ids) \
+                                          .exclude(type=VERSION_DELETE) \
+                                          .select_related('revision') \
+                                          .order_by('revision__date_created', 'id')
+                versions_by_problem = {}
+                for version in versions:
+                    versions_by_problem.setdefault(version.object_id_int, []).append(version)
+
+                changes = []
+                for problem_id, problem_versions in versions_by_problem.items():
+                    previous_revision_attrs = None
+                    for version in problem_versions:
+                        try:
+                            revision_attrs = ProblemChange.revision_attrs_from_version(version)
+                        except DeserializationError:
+                            # See the comment in issues.lib.changed_attrs_by_version
+                            continue
+                        changes.append(ProblemChange.for_revision(problem_id,
+                                                                  version.revision,
+                                                                  revision_attrs,
+                                                                  previous_revision_attrs))
+                        previous_revision_attrs = revision_attrs
+
+                ProblemChange.objects.filter(problem_id__in=batch_ids).delete()
+                ProblemChange.objects.bulk_create(changes)
+                transaction.commit()
+                recorded += len(changes)
+            except Exception as e:
+                if verbosity >= 1:
+                    self.stderr.write("{0}\n".format(e))
+                    self.stderr.write("Error rebuilding the changes of problems {0} to {1}\n".format(batch_ids[0], batch_ids[-1]))
+                transaction.rollback()
+
+            if verbosity >= 2:
+                self.stdout.write("Rebuilt the changes of {0} problems\n".format(start + len(batch_ids)))
+
+        if verbosity >= 1:
+            self.stdout.write("Stored {0} problem changes\n".format(recorded))
@@ -0,0 +1,58 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Problem
+
+
+@transaction.commit_manually
+class Command(BaseCommand):
+    help = 'Fill in when closed problems were closed, from their revision history'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--batch-size',
+            action='store',
+            dest='batch_size',
+            type='int',
+            default=500,
+            help='How many problems to fill in before committing.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity'))
+        batch_size = max(int(options.get('batch_size') or 500), 1)
+
+        problems = Problem.objects.filter(status__in=Problem.CLOSED_STATUSES, closed__isnull=True).order_by('id')
+        filled_in = 0
+        last_id = 0
+        while True:
+            batch = list(problems.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            try:
+                for problem in batch:
+                    closed = problem.closed_timestamp_from_history()
+                    # Update rather than save, so that we don't make a new
+                    # revision, or change the problem's version under
+                    # anyone who's editing it
+                    Problem.objects.filter(pk=problem.pk).update(closed=closed)
+                transaction.commit()
+                filled_in += len(batch)
+            except Exception as e:
+                if verbosity >= 1:
+                    self.stderr.write("{0}\n".format(e))
+                    self.stderr.write("Error filling in problems {0} to {1}\n".format(batch[0].id, last_id))
+                transaction.rollback()
+
+            if verbosity >= 2:
+                self.stdout.write("Filled in {0} problems\n".format(filled_in))
+
+        # Finish the transaction that the last query started
+        transaction.commit()
+
+        if verbosity >= 1:
+            self.stdout.write("Filled in when {0} problems were closed\n".format(filled_in))
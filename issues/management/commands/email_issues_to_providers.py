@@ -1,8 +1,13 @@
+from optparse import make_option
+
+from django.core import mail
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.db.models import F
 from django.template.loader import get_template
 from django.template import Context
 from django.conf import settings
+from django.utils import timezone
 
 from issues.models import Problem
 
@@ -11,37 +16,95 @@ from issues.models import Problem
 class Command(BaseCommand):
     help = 'Email new problems to providers'
 
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--batch-size',
+            action='store',
+            dest='batch_size',
+            type='int',
+            default=20,
+            help='How many problems to send over each SMTP connection, and mark as mailed at once. '
+                 'If the command is stopped part way through a batch, the problems it has already '
+                 'sent in that batch will be sent again next time, so keep this small.'
+        ),
+    )
+
     def handle(self, *args, **options):
         verbosity = self.verbosity = int(options.get('verbosity'))
-        new_problems = Problem.objects.all().filter(mailed=False)
+        batch_size = max(int(options.get('batch_size') or 20), 1)
+        new_problem_ids = list(Problem.objects.all().filter(mailed=False).order_by('id').values_list('id', flat=True))
+        # Finish the transaction that the query above started
+        transaction.commit()
 
         if verbosity >= 2:
-            self.stdout.write("{0} New problems to email\n".format(len(new_problems)))
+            self.stdout.write("{0} New problems to email\n".format(len(new_problem_ids)))
 
-        if len(new_problems) > 0:
+        if len(new_problem_ids) > 0:
             # Get the template
             problem_template = get_template('organisations/new_problem_email.txt')
-            # Loop over them and send
-            for problem in new_problems:
+            # Send them in batches
+            for start in range(0, len(new_problem_ids), batch_size):
+                self.send_batch(problem_template, new_problem_ids[start:start + batch_size])
+
+    def send_batch(self, template, problem_ids):
+        """Send the problems with the given ids, over a single SMTP connection,
+        and then mark all the ones which were sent as mailed at once.
+
+        A problem which fails to send doesn't stop the rest of the batch, it
+        just doesn't get marked as mailed, so we'll try it again next time.
+        Nothing is marked as mailed until the end of the batch though, so if
+        we're killed part way through one, the problems already sent in it
+        will be sent again next time."""
+        # Load the problems afresh, in case something else has mailed them
+        # since we made our list
+        problems = Problem.objects.filter(pk__in=problem_ids, mailed=False).select_related('organisation__parent').order_by('id')
+        mailed_ids = []
+
+        connection = mail.get_connection()
+        try:
+            connection.open()
+            for problem in problems:
                 try:
-                    self.send_problem(problem_template, problem)
-                    # reload the problem from db to be sure that the version is fresh
-                    problem = Problem.objects.get(pk=problem.id)
-                    problem.mailed = True
-                    problem.save()
-                    transaction.commit()
+                    self.send_problem(template, problem, connection)
+                    mailed_ids.append(problem.id)
                 except Exception as e:
-                    if verbosity >= 1:
+                    if self.verbosity >= 1:
                         self.stderr.write("{0}\n".format(e))
                         self.stderr.write("Error mailing problem: {0}\n".format(problem.reference_number))
-                    transaction.rollback()
+                    # The error might have broken the connection, so start
+                    # a new one for the rest of the batch
+                    connection.close()
+                    connection.open()
+            connection.close()
+        except Exception as e:
+            # Something went wrong with the connection itself, we still want
+            # to record the problems we managed to send before it did
+            if self.verbosity >= 1:
+                self.stderr.write("{0}\n".format(e))
+                self.stderr.write("Error connecting to send problems\n")
+
+        try:
+            if mailed_ids:
+                # Bump the version and modified too, as saving the problem
+                # would, so that anyone editing one of these problems with an
+                # out of date copy doesn't set mailed back to False
+                Problem.objects.filter(pk__in=mailed_ids).update(mailed=True,
+                                                                 version=F('version') + 1,
+                                                                 modified=timezone.now())
+            transaction.commit()
+        except Exception as e:
+            if self.verbosity >= 1:
+                self.stderr.write("{0}\n".format(e))
+                self.stderr.write("Error marking problems as mailed: {0}\n".format(", ".join(map(str, mailed_ids))))
+            transaction.rollback()
 
-    def send_problem(self, template, problem):
+    def send_problem(self, template, problem, connection=None):
         context = Context({'problem': problem, 'site_base_url': settings.SITE_BASE_URL})
         if self.verbosity >= 2:
             self.stdout.write("Emailing problem reference number: {0}\n".format(problem.reference_number))
 
         problem.organisation.parent.send_mail(
             subject='Care Connect: New Problem',
-            message=template.render(context)
+            message=template.render(context),
+            connection=connection
         )
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    depends_on = (
+        ("reversion", "0005_auto__add_field_revision_manager_slug"),
+    )
+
+    def forwards(self, orm):
+        # Adding model 'ProblemChange'
+        db.create_table('issues_problemchange', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('problem', self.gf('django.db.models.fields.related.ForeignKey')(related_name='changes', to=orm['issues.Problem'])),
+            ('revision', self.gf('django.db.models.fields.related.ForeignKey')(related_name='problem_changes', to=orm['reversion.Revision'])),
+            ('user', self.gf('django.db.models.fields.related.ForeignKey')(blank=True, related_name='problem_changes', null=True, to=orm['auth.User'])),
+            ('date_created', self.gf('django.db.models.fields.DateTimeField')()),
+            ('revision_attrs', self.gf('django.db.models.fields.TextField')()),
+            ('changed_attrs', self.gf('django.db.models.fields.TextField')()),
+            ('description', self.gf('django.db.models.fields.TextField')(blank=True)),
+        ))
+        db.send_create_signal('issues', ['ProblemChange'])
+
+        # Adding unique constraint on 'ProblemChange', fields ['problem', 'revision']
+        db.create_unique('issues_problemchange', ['problem_id', 'revision_id'])
+
+        # A problem's history is read in date order
+        db.create_index('issues_problemchange', ['problem_id', 'date_created'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'ProblemChange', fields ['problem', 'date_created']
+        db.delete_index('issues_problemchange', ['problem_id', 'date_created'])
+
+        # Removing unique constraint on 'ProblemChange', fields ['problem', 'revision']
+        db.delete_unique('issues_problemchange', ['problem_id', 'revision_id'])
+
+        # Deleting model 'ProblemChange'
+        db.delete_table('issues_problemchange')
+
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'issues.problem': {
+            'Meta': {'object_name': 'Problem'},
+            'breach': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'category': ('django.db.models.fields.CharField', [], {'default': "'other'", 'max_length': '100', 'db_index': 'True'}),
+            'closed': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'cobrand': ('django.db.models.fields.CharField', [], {'default': "'choices'", 'max_length': '30'}),
+            'commissioned': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'confirmation_required': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'confirmation_sent': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'formal_complaint': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'happy_outcome': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'happy_service': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'mailed': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'moderated_description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'organisation': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['organisations.Organisation']"}),
+            'preferred_contact_method': ('django.db.models.fields.CharField', [], {'default': "'email'", 'max_length': '100'}),
+            'priority': ('django.db.models.fields.IntegerField', [], {'default': '50', 'db_index': 'True'}),
+            'public': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'public_reporter_name': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'public_reporter_name_original': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'publication_status': ('django.db.models.fields.IntegerField', [], {'default': '2', 'db_index': 'True'}),
+            'reporter_email': ('django.db.models.fields.EmailField', [], {'max_length': '254', 'blank': 'True'}),
+            'reporter_name': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'reporter_phone': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'reporter_under_16': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'requires_second_tier_moderation': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'resolved': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'service': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['organisations.Service']", 'null': 'True', 'blank': 'True'}),
+            'source': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'status': ('django.db.models.fields.IntegerField', [], {'default': '0', 'db_index': 'True'}),
+            'survey_sent': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'time_to_acknowledge': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'time_to_address': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'version': ('concurrency.fields.IntegerVersionField', [], {'name': "'version'", 'db_tablespace': "''"})
+        },
+        'issues.problemchange': {
+            'Meta': {'unique_together': "(('problem', 'revision'),)", 'object_name': 'ProblemChange'},
+            'changed_attrs': ('django.db.models.fields.TextField', [], {}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'problem': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'changes'", 'to': "orm['issues.Problem']"}),
+            'revision': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'problem_changes'", 'to': "orm['reversion.Revision']"}),
+            'revision_attrs': ('django.db.models.fields.TextField', [], {}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'problem_changes'", 'null': 'True', 'to': "orm['auth.User']"})
+        },
+        'issues.problemimage': {
+            'Meta': {'object_name': 'ProblemImage'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('sorl.thumbnail.fields.ImageField', [], {'max_length': '100'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'problem': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'images'", 'to': "orm['issues.Problem']"})
+        },
+        'organisations.ccg': {
+            'Meta': {'object_name': 'CCG'},
+            'code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '8', 'db_index': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '254'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'intro_email_sent': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {}),
+            'users': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'ccgs'", 'symmetrical': 'False', 'to': "orm['auth.User']"})
+        },
+        'organisations.friendsandfamilysurvey': {
+            'Meta': {'ordering': "['-date']", 'unique_together': "(('content_type', 'object_id', 'date', 'location'),)", 'object_name': 'FriendsAndFamilySurvey'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date': ('django.db.models.fields.DateField', [], {'db_index': 'True'}),
+            'dont_know': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'extremely_likely': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'extremely_unlikely': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'likely': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'location': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '100', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'neither': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'overall_score': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'unlikely': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        'organisations.organisation': {
+            'Meta': {'object_name': 'Organisation'},
+            'address_line1': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'address_line2': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'address_line3': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'average_recommendation_rating': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'choices_id': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'city': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'county': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('sorl.thumbnail.fields.ImageField', [], {'max_length': '100', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {'db_index': 'True'}),
+            'name_metaphone': ('django.db.models.fields.TextField', [], {}),
+            'ods_code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '12', 'db_index': 'True'}),
+            'organisation_type': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'parent': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'organisations'", 'to': "orm['organisations.OrganisationParent']"}),
+            'point': ('django.contrib.gis.db.models.fields.PointField', [], {}),
+            'postcode': ('django.db.models.fields.CharField', [], {'max_length': '10', 'blank': 'True'})
+        },
+        'organisations.organisationparent': {
+            'Meta': {'object_name': 'OrganisationParent'},
+            'ccgs': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'organisation_parents'", 'symmetrical': 'False', 'to': "orm['organisations.CCG']"}),
+            'choices_id': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '8', 'db_index': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '254'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'intro_email_sent': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {}),
+            'primary_ccg': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'primary_organisation_parents'", 'to': "orm['organisations.CCG']"}),
+            'secondary_email': ('django.db.models.fields.EmailField', [], {'max_length': '254', 'blank': 'True'}),
+            'users': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'organisation_parents'", 'symmetrical': 'False', 'to': "orm['auth.User']"})
+        },
+        'organisations.service': {
+            'Meta': {'unique_together': "(('service_code', 'organisation'),)", 'object_name': 'Service'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {'db_index': 'True'}),
+            'organisation': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'services'", 'to': "orm['organisations.Organisation']"}),
+            'service_code': ('django.db.models.fields.TextField', [], {'db_index': 'True'})
+        },
+        'reversion.revision': {
+            'Meta': {'object_name': 'Revision'},
+            'comment': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'manager_slug': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '200', 'db_index': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']", 'null': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['issues']
@@ -4,13 +4,17 @@ import os
 
 from datetime import datetime
 import hmac
+import json
 import hashlib
 from uuid import uuid4
 from time import strftime, gmtime
 
 from django.db import models
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
+from django.core.serializers.base import DeserializationError
 from django.core.validators import MaxLengthValidator
 from django.db.models import Q
 from django.utils.timezone import utc
@@ -18,13 +22,18 @@ from django.dispatch import receiver
 
 from concurrency.fields import IntegerVersionField
 from concurrency.api import concurrency_check
+from reversion.models import Revision, VERSION_DELETE, post_revision_commit
 
 from citizenconnect.models import (
     AuditedModel,
     validate_file_extension,
     delete_uploaded_file
 )
-from .lib import base32_to_int, int_to_base32, changed_attrs_by_version
+from .lib import (base32_to_int,
+                  int_to_base32,
+                  changed_attrs,
+                  changed_attrs_by_version,
+                  changes_as_string)
 from sorl.thumbnail import ImageField as sorlImageField
 
 
@@ -380,6 +389,8 @@ class Problem(AuditedModel):
     time_to_address = models.IntegerField(blank=True, null=True)
     # When exactly the problem was resolved
     resolved = models.DateTimeField(blank=True, null=True)
+    # When the problem was first closed (with any of the CLOSED_STATUSES)
+    closed = models.DateTimeField(blank=True, null=True, db_index=True)
     # A status field which determines how much of the problem is displayed to
     # the user, set during the moderation process.
     publication_status = models.IntegerField(default=NOT_MODERATED,
@@ -419,12 +430,14 @@ class Problem(AuditedModel):
 
     def __init__(self, *args, **kwargs):
         """Overriden __init__ to save an initial copy of
-        public_reporter_name_original to check against when saving.
+        public_reporter_name_original to check against when saving, and of
+        status to tell when the problem is being closed.
 
         See: http://stackoverflow.com/questions/1355150/django-when-saving-how-can-you-check-if-a-field-has-changed
         """
         super(Problem, self).__init__(*args, **kwargs)
         self.__initial_public_reporter_name_original = self.public_reporter_name_original
+        self.__initial_status = self.status
 
     @models.permalink
     def get_absolute_url(self):
@@ -570,9 +583,16 @@ class Problem(AuditedModel):
         return (self.is_publicly_visible() or self.organisation.can_be_accessed_by(user))
 
     def set_time_to_values(self):
-        """Set the time_to_address, time_to_acknowledge and resolved times"""
+        """Set the time_to_address, time_to_acknowledge, resolved and closed
+        times"""
         now = datetime.utcnow().replace(tzinfo=utc)
         minutes_since_created = self.timedelta_to_minutes(now - self.created)
+        # Only when it's being closed, so that saving problems closed before
+        # we stored this doesn't make them look like they were closed now
+        if self.closed is None \
+                and int(self.status) in Problem.CLOSED_STATUSES \
+                and int(self.__initial_status) not in Problem.CLOSED_STATUSES:
+            self.closed = now
         statuses_which_indicate_acknowledgement = [Problem.ACKNOWLEDGED,
                                                    Problem.RESOLVED]
         if self.time_to_acknowledge is None and int(self.status) in statuses_which_indicate_acknowledgement:
@@ -605,8 +625,17 @@ class Problem(AuditedModel):
             # set the public_reporter_name_original to match public_reporter_name
             self.public_reporter_name_original = self.public_reporter_name
 
+        is_new = not self.pk
         super(Problem, self).save(*args, **kwargs)  # Call the "real" save() method.
         self.__initial_public_reporter_name_original = self.public_reporter_name_original
+        self.__initial_status = self.status
+
+        # Problems which are closed when they're created were closed when
+        # they were created, but we don't know when that is until after
+        # they've been saved
+        if is_new and self.closed is None and int(self.status) in Problem.CLOSED_STATUSES:
+            self.closed = self.created
+            Problem.objects.filter(pk=self.pk).update(closed=self.closed)
 
     def check_token(self, token):
         """Check that a given token is valid for this Problem"""
@@ -644,14 +673,23 @@ class Problem(AuditedModel):
         if not self.id or self.status not in self.CLOSED_STATUSES:
             return None
         else:
-            for version, changes in changed_attrs_by_version(self, ['status']).iteritems():
-                status = changes.get('status', False)
-                if status and status[1] in self.CLOSED_STATUSES:
-                    return version.revision.date_created
-            # If we didn't find a revision which closed the object, but the object
-            # is closed, it must have been created closed, so the closed
-            # timestamp is the same as the created one
+            return self.closed
+
+    def closed_timestamp_from_history(self):
+        """Work out when this problem was first closed from its revision
+        history, for problems from before we stored it in closed.
+
+        Returns None if the problem has never been closed."""
+        for version, changes in changed_attrs_by_version(self, ['status']).iteritems():
+            status = changes.get('status', False)
+            if status and status[1] in self.CLOSED_STATUSES:
+                return version.revision.date_created
+        # If we didn't find a revision which closed the object, but the object
+        # is closed, it must have been created closed, so the closed
+        # timestamp is the same as the created one
+        if self.status in self.CLOSED_STATUSES:
             return self.created
+        return None
 
 
 def obfuscated_upload_path_and_name(instance, filename):
@@ -695,3 +733,84 @@ def article_post_delete_handler(sender, **kwargs):
     path = image.image.path
     name = image.image.name
     delete_uploaded_file(storage, path, name, delete_empty_directory=True)
+
+
+class ProblemChange(models.Model):
+    """Stores what changed in a :model:`issues.Problem` in one of its
+    revisions, worked out when the revision is saved, so that showing a
+    problem's history doesn't mean going through all of its versions.
+
+    There's a row for every revision of a problem, even those where none of
+    Problem.REVISION_ATTRS changed, so that the next revision has something
+    to be compared with. Rows for revisions from before these were stored
+    can be made with the backfill_problem_changes management command.
+    """
+    problem = models.ForeignKey(Problem, related_name='changes')
+    revision = models.ForeignKey(Revision, related_name='problem_changes')
+    # Copied from the revision, so that showing the history doesn't need it
+    user = models.ForeignKey(User, null=True, blank=True, related_name='problem_changes')
+    date_created = models.DateTimeField()
+    # The values of Problem.REVISION_ATTRS in this revision, as json
+    revision_attrs = models.TextField()
+    # The REVISION_ATTRS which changed since the previous revision, as json
+    # of {attr: [old value, new value]}
+    changed_attrs = models.TextField()
+    # An English description of the changes, eg: "Acknowledged and Published",
+    # blank if nothing interesting changed
+    description = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = (("problem", "revision"),)
+
+    @classmethod
+    def revision_attrs_from_version(cls, version):
+        """Return the values of Problem.REVISION_ATTRS in a reversion Version
+        of a problem. Raises DeserializationError if the version can't be
+        read."""
+        field_dict = version.field_dict
+        return dict((attr, field_dict.get(attr)) for attr in Problem.REVISION_ATTRS)
+
+    @classmethod
+    def for_revision(cls, problem_id, revision, revision_attrs, previous_revision_attrs=None):
+        """Return an unsaved ProblemChange for a problem's revision, given the
+        REVISION_ATTRS in it and in the previous revision (if there was one)"""
+        if previous_revision_attrs is None:
+            changed = {}
+        else:
+            changed = changed_attrs(previous_revision_attrs, revision_attrs, Problem.REVISION_ATTRS)
+        return cls(problem_id=problem_id,
+                   revision=revision,
+                   user_id=revision.user_id,
+                   date_created=revision.date_created,
+                   revision_attrs=json.dumps(revision_attrs),
+                   changed_attrs=json.dumps(changed),
+                   description=changes_as_string(changed, Problem.TRANSITIONS))
+
+    @classmethod
+    def record(cls, problem_id, revision, version):
+        """Store the changes in a new revision of a problem, comparing it
+        with the last revision we stored"""
+        try:
+            revision_attrs = cls.revision_attrs_from_version(version)
+        except DeserializationError:
+            # See the comment in issues.lib.changed_attrs_by_version, there's
+            # nothing useful we can do with this version
+            return None
+        previous_changes = list(cls.objects.filter(problem_id=problem_id).order_by('-date_created', '-id')[:1])
+        if previous_changes:
+            previous_revision_attrs = json.loads(previous_changes[0].revision_attrs)
+        else:
+            previous_revision_attrs = None
+        change = cls.for_revision(problem_id, revision, revision_attrs, previous_revision_attrs)
+        change.save()
+        return change
+
+
+@receiver(post_revision_commit)
+def record_problem_changes(sender, **kwargs):
+    """post_revision_commit signal handler to store the changes made to any
+    problems in the revision as ProblemChanges."""
+    problem_content_type = ContentType.objects.get_for_model(Problem)
+    for version in kwargs['versions']:
+        if version.content_type_id == problem_content_type.id and version.type != VERSION_DELETE:
+            ProblemChange.record(int(version.object_id), kwargs['revision'], version)
@@ -1,5 +1,17 @@
+# encoding: utf-8
 import django_tables2 as tables
 
+from django.core.urlresolvers import reverse
+from django.template.defaultfilters import floatformat
+from django.utils.encoding import force_unicode, iri_to_uri
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+
+from organisations.templatetags.organisation_extras import (formatted_boolean,
+                                                            formatted_time_interval,
+                                                            percent,
+                                                            star_class)
+
 
 class BreachColumn(tables.TemplateColumn):
 
@@ -15,3 +27,113 @@ class BreachColumn(tables.TemplateColumn):
         defaults.update(kwargs)
 
         return super(BreachColumn, self).__init__(*args, **defaults)
+
+
+# Python versions of the column templates in
+# organisations/templates/organisations/includes/tables/columns/, which give
+# exactly the same HTML, whitespace and all, without rendering a template for
+# every cell. If you change one, change the other.
+NO_VALUE_HTML = u'\n    <span class="icon-circle" aria-hidden="true"></span>\n    <span class="hide-text">—</span>\n'
+
+
+def render_time_interval(value):
+    """time_interval_column.html"""
+    if value is None:
+        return mark_safe(u'\n' + NO_VALUE_HTML + u'\n')
+    return mark_safe(u'\n\n    ' + conditional_escape(formatted_time_interval(value)) + u'\n\n')
+
+
+def render_percent(value):
+    """percent_column.html"""
+    if value is None:
+        return mark_safe(u'\n' + NO_VALUE_HTML + u'\n')
+    return mark_safe(u'\n\n    ' + conditional_escape(percent(value)) + u'\n\n')
+
+
+def render_boolean(value):
+    """boolean_column.html"""
+    boolean = formatted_boolean(value)
+    if boolean == 'True':
+        html = u'\n    <span class="icon-checkmark" aria-hidden="true"></span>\n    <span class="hide-text">yes</span>\n'
+    elif boolean == 'False':
+        html = u'\n    <span class="icon-x" aria-hidden="true"></span>\n    <span class="hide-text">no</span>\n'
+    else:
+        html = NO_VALUE_HTML
+    return mark_safe(u'\n' + html + u'\n')
+
+
+def render_rating(value, css_class=None, description=None):
+    """rating_column.html"""
+    if value is None:
+        return mark_safe(u'\n\n\n<div class="rating--grey">' + NO_VALUE_HTML + u'</div>\n\n')
+    title = floatformat(value) + u'/5'
+    if description:
+        title += u': ' + conditional_escape(description)
+    stars = u''.join(u'\n    <span class="{0}" aria-hidden="true"></span>'.format(star_class(value, star))
+                     for star in range(1, 6))
+    return mark_safe(u'\n\n\n<div\n    class="{0}"\n    title="{1}"\n>{2}\n</div>\n\n'.format(force_unicode(css_class or 'rating'),
+                                                                                      title,
+                                                                                      stars))
+
+
+class CompiledTemplateColumn(tables.TemplateColumn):
+    """
+    A TemplateColumn which renders its cells with a Python function, one of
+    the ones above, rather than with its template. Subclasses set
+    default_template_name to the template the function is a copy of, and
+    render_value to the function.
+    """
+
+    default_template_name = None
+
+    def __init__(self, *args, **kwargs):
+        defaults = {'template_name': self.default_template_name}
+        defaults.update(kwargs)
+        super(CompiledTemplateColumn, self).__init__(*args, **defaults)
+
+    def render(self, value, **kwargs):
+        return self.render_value(value)
+
+
+class TimeIntervalColumn(CompiledTemplateColumn):
+    default_template_name = 'organisations/includes/tables/columns/time_interval_column.html'
+    render_value = staticmethod(render_time_interval)
+
+
+class PercentColumn(CompiledTemplateColumn):
+    default_template_name = 'organisations/includes/tables/columns/percent_column.html'
+    render_value = staticmethod(render_percent)
+
+
+class BooleanColumn(CompiledTemplateColumn):
+    default_template_name = 'organisations/includes/tables/columns/boolean_column.html'
+    render_value = staticmethod(render_boolean)
+
+
+class RatingColumn(CompiledTemplateColumn):
+    default_template_name = 'organisations/includes/tables/columns/rating_column.html'
+    render_value = staticmethod(render_rating)
+
+
+class ReversedURL(object):
+    """
+    A URL which is reversed once, with a placeholder in place of one of its
+    kwargs, so that it can be filled in for each row of a table without
+    calling reverse() for every one. The placeholder has to match the
+    kwarg's pattern in the urlconf, and not appear anywhere else in the URL.
+    """
+
+    # Placeholders for the kinds of kwargs tables link with
+    PK_PLACEHOLDER = '9876543210'
+    ODS_CODE_PLACEHOLDER = 'ODSCODEPLACEHOLDER'
+
+    def __init__(self, viewname, kwarg, placeholder, kwargs=None):
+        kwargs = dict(kwargs or {})
+        kwargs[kwarg] = placeholder
+        url = reverse(viewname, kwargs=kwargs)
+        if url.count(placeholder) != 1:
+            raise ValueError("The placeholder {0} isn't in {1} exactly once".format(placeholder, url))
+        self.prefix, self.suffix = url.split(placeholder)
+
+    def __call__(self, value):
+        return self.prefix + iri_to_uri(force_unicode(value)) + self.suffix
@@ -2,9 +2,8 @@ import django_tables2 as tables
 
 from django.utils.safestring import mark_safe
 from django.utils.html import conditional_escape
-from django.core.urlresolvers import reverse
 
-from .table_columns import BreachColumn
+from .table_columns import BreachColumn, BooleanColumn, TimeIntervalColumn, ReversedURL
 
 
 class BaseProblemTable(tables.Table):
@@ -38,6 +37,12 @@ class BaseProblemTable(tables.Table):
             self.base_columns['summary'].accessor = 'summary'
             self.base_columns['breach'].visible = False
 
+        # row_classes and row_href are called for each row by the template,
+        # and row_href again by render_summary, so remember what they returned
+        self._row_classes = {}
+        self._row_hrefs = {}
+        self._row_url = None
+
         super(BaseProblemTable, self).__init__(*args, **kwargs)
 
     def render_summary_as_response_link(self, record):
@@ -49,27 +54,37 @@ class BaseProblemTable(tables.Table):
         return mark_safe(u'<a href="{0}">{1}</a>'.format(detail_link, conditional_escape(record.summary)))
 
     def row_classes(self, record):
-        try:
-            super_row_classes = super(BaseProblemTable, self).row_classes(record)
-        except AttributeError:
-            super_row_classes = ""
-        return '{0} table-link__row'.format(super_row_classes)
+        if record.id not in self._row_classes:
+            try:
+                super_row_classes = super(BaseProblemTable, self).row_classes(record)
+            except AttributeError:
+                super_row_classes = ""
+            self._row_classes[record.id] = '{0} table-link__row'.format(super_row_classes)
+        return self._row_classes[record.id]
 
     def row_href(self, record):
         """Return an href for the given row
 
         Where we link to depends on whether this is public or private
         """
-
-        if self.private:
-            return reverse('response-form', kwargs={'pk': record.id})
-        else:
-            # self.cobrand might not be set
-            try:
-                cobrand = self.cobrand or 'choices'
-            except AttributeError:
-                cobrand = 'choices'
-            return reverse('problem-view', kwargs={'pk': record.id, 'cobrand': cobrand})
+        if record.id not in self._row_hrefs:
+            self._row_hrefs[record.id] = self.row_url()(record.id)
+        return self._row_hrefs[record.id]
+
+    def row_url(self):
+        """Return a ReversedURL for the rows' hrefs, which is only reversed
+        once for the whole table"""
+        if self._row_url is None:
+            if self.private:
+                self._row_url = ReversedURL('response-form', 'pk', ReversedURL.PK_PLACEHOLDER)
+            else:
+                # self.cobrand might not be set
+                try:
+                    cobrand = self.cobrand or 'choices'
+                except AttributeError:
+                    cobrand = 'choices'
+                self._row_url = ReversedURL('problem-view', 'pk', ReversedURL.PK_PLACEHOLDER, {'cobrand': cobrand})
+        return self._row_url
 
     class Meta:
         attrs = {'class': 'problem-table problem-table--expanded'}
@@ -81,12 +96,8 @@ class ProblemTable(BaseProblemTable):
     Explicitly not for dashboards, where action related to those problems
     is implied or the primary focus.
     """
-    happy_service = tables.TemplateColumn(verbose_name='Manner',
-                                          template_name="organisations/includes/tables/columns/boolean_column.html",
-                                          orderable=False)
-    happy_outcome = tables.TemplateColumn(verbose_name='Resolution',
-                                          template_name="organisations/includes/tables/columns/boolean_column.html",
-                                          orderable=False)
+    happy_service = BooleanColumn(verbose_name='Manner', orderable=False)
+    happy_outcome = BooleanColumn(verbose_name='Resolution', orderable=False)
     status = tables.Column()
 
     split_columns = True
@@ -121,12 +132,8 @@ class ExtendedProblemTable(ProblemTable):
     has_time_limits are true meaning we show extra stats
     """
     service = tables.Column(verbose_name='Department', orderable=False)
-    time_to_acknowledge = tables.TemplateColumn(verbose_name='Acknowledge',
-                                                template_name='organisations/includes/tables/columns/time_interval_column.html',
-                                                orderable=False)
-    time_to_address = tables.TemplateColumn(verbose_name='Close',
-                                            template_name='organisations/includes/tables/columns/time_interval_column.html',
-                                            orderable=False)
+    time_to_acknowledge = TimeIntervalColumn(verbose_name='Acknowledge', orderable=False)
+    time_to_address = TimeIntervalColumn(verbose_name='Close', orderable=False)
     resolved = tables.DateTimeColumn(verbose_name="Resolved")
 
     class Meta:
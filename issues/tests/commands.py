@@ -1,5 +1,6 @@
 from StringIO import StringIO
 from mock import patch
+import reversion
 from datetime import datetime, timedelta
 
 from django.test import TestCase
@@ -13,7 +14,8 @@ from organisations.tests.lib import (create_test_organisation_parent,
                                      create_test_organisation,
                                      create_test_service,
                                      create_test_problem)
-from ..models import Problem
+from ..models import Problem, ProblemChange
+from ..lib import changes_for_model
 
 
 class EmailToReportersBase(object):
@@ -212,3 +214,104 @@ class EmailProblemsToOrganisationParentTests(TestCase):
             # # And that the successful one got marked as mailed
             self.other_test_problem = Problem.objects.get(pk=self.other_test_problem.id)
             self.assertTrue(self.other_test_problem.mailed)
+
+    def test_sends_in_batches_over_one_connection_each(self):
+        third_test_problem = create_test_problem({'organisation': self.test_organisation})
+        connection = mail.get_connection()
+        with patch.object(mail, 'get_connection', return_value=connection) as mock_get_connection:
+            with patch.object(connection, 'open') as mock_open:
+                self._call_command(batch_size=2)
+                # Three problems in batches of two
+                self.assertEqual(mock_get_connection.call_count, 2)
+                self.assertEqual(mock_open.call_count, 2)
+        self.assertEqual(len(mail.outbox), 3)
+        for problem in [self.test_problem, self.other_test_problem, third_test_problem]:
+            problem = Problem.objects.get(pk=problem.id)
+            self.assertTrue(problem.mailed)
+
+    def test_marking_as_mailed_changes_version(self):
+        stale_problem = Problem.objects.get(pk=self.test_problem.id)
+        self._call_command()
+        self.assertNotEqual(Problem.objects.get(pk=self.test_problem.id).version, stale_problem.version)
+
+    def test_marking_as_mailed_changes_modified(self):
+        stale_problem = Problem.objects.get(pk=self.test_problem.id)
+        self._call_command()
+        self.assertTrue(Problem.objects.get(pk=self.test_problem.id).modified > stale_problem.modified)
+
+
+class BackfillProblemClosedTests(TestCase):
+
+    def setUp(self):
+        self.test_organisation = create_test_organisation()
+
+    def _call_command(self, **kwargs):
+        call_command('backfill_problem_closed', stdout=StringIO(), **kwargs)
+
+    def test_fills_in_closed_from_revisions(self):
+        with reversion.create_revision():
+            problem = create_test_problem({'organisation': self.test_organisation})
+        problem.status = Problem.RESOLVED
+        with reversion.create_revision():
+            problem.save()
+        # Make it look like it was closed before we stored when problems
+        # were closed, and a while after it was created
+        closed = problem.created + timedelta(hours=1)
+        versions = list(reversion.get_for_object(problem).order_by("revision__date_created"))
+        versions[1].revision.date_created = closed
+        versions[1].revision.save()
+        Problem.objects.filter(pk=problem.pk).update(closed=None)
+
+        self._call_command(batch_size=1)
+
+        self.assertEqual(Problem.objects.get(pk=problem.pk).closed, closed)
+
+    def test_fills_in_created_for_problems_created_closed(self):
+        problems = [create_test_problem({'organisation': self.test_organisation,
+                                         'status': Problem.RESOLVED}) for i in range(3)]
+        open_problem = create_test_problem({'organisation': self.test_organisation})
+        Problem.objects.all().update(closed=None)
+
+        self._call_command(batch_size=2)
+
+        for problem in problems:
+            problem = Problem.objects.get(pk=problem.pk)
+            self.assertEqual(problem.closed, problem.created)
+        self.assertEqual(Problem.objects.get(pk=open_problem.pk).closed, None)
+
+
+class BackfillProblemChangesTests(TestCase):
+
+    def setUp(self):
+        # Call the hompage to force the reversion.middleware to be loaded, see
+        # issues.tests.lib.LibTests.test_changes_for_model
+        self.client.get('/')
+        self.test_organisation = create_test_organisation()
+
+    def _call_command(self, **kwargs):
+        call_command('backfill_problem_changes', stdout=StringIO(), **kwargs)
+
+    def test_rebuilds_changes_from_revisions(self):
+        problems = []
+        for i in range(3):
+            with reversion.create_revision():
+                problem = create_test_problem({'organisation': self.test_organisation})
+            problem.status = Problem.ACKNOWLEDGED
+            with reversion.create_revision():
+                problem.save()
+            problem.publication_status = Problem.PUBLISHED
+            problem.status = Problem.RESOLVED
+            with reversion.create_revision():
+                problem.save()
+            problems.append(problem)
+
+        expected_changes = [changes_for_model(created) for created in problems]
+        ProblemChange.objects.all().delete()
+
+        self._call_command(batch_size=2)
+
+        self.assertEqual(ProblemChange.objects.count(), 9)
+        for problem, expected in zip(problems, expected_changes):
+            changes = changes_for_model(problem)
+            self.assertEqual(changes, expected)
+            self.assertEqual([change['description'] for change in changes], ['Acknowledged', 'Published and Resolved'])
@@ -134,6 +134,22 @@ class LibTests(TestCase):
             self.assertGreaterEqual(when, start_timestamp)
             self.assertLessEqual(when, end_timestamp)
 
+    def test_changes_for_model_is_one_query(self):
+        # See test_changes_for_model
+        self.client.get('/')
+
+        with reversion.create_revision():
+            problem = create_test_problem({'status': Problem.NEW})
+        for status in [Problem.ACKNOWLEDGED, Problem.ACKNOWLEDGED, Problem.RESOLVED]:
+            problem = Problem.objects.get(pk=problem.id)
+            problem.status = status
+            with reversion.create_revision():
+                problem.save()
+
+        with self.assertNumQueries(1):
+            changes = changes_for_model(problem)
+        self.assertEqual([change['description'] for change in changes], ['Acknowledged', 'Resolved'])
+
     def test_base32_roundtrip_conversion(self):
         self.assertEqual(829384, base32_to_int(int_to_base32(829384)))
 
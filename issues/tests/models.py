@@ -363,6 +363,33 @@ class ProblemModelTests(ProblemTestCase):
         self.test_problem.save()
         self.assertEqual(self.test_problem.closed_timestamp, self.test_problem.created)
 
+    def test_closed_is_set_when_problem_is_closed(self):
+        self.test_problem.save()
+        self.assertEqual(self.test_problem.closed, None)
+        self.test_problem.status = Problem.RESOLVED
+        self.test_problem.save()
+        now = datetime.utcnow().replace(tzinfo=utc)
+        self.assertAlmostEqual(self.test_problem.closed, now, delta=timedelta(seconds=10))
+        self.assertEqual(Problem.objects.get(pk=self.test_problem.pk).closed, self.test_problem.closed)
+
+    def test_closed_is_only_set_the_first_time_a_problem_is_closed(self):
+        self.test_problem.status = Problem.RESOLVED
+        self.test_problem.save()
+        closed = self.test_problem.closed
+        self.test_problem.status = Problem.ACKNOWLEDGED
+        self.test_problem.save()
+        self.test_problem.status = Problem.UNABLE_TO_RESOLVE
+        self.test_problem.save()
+        self.assertEqual(self.test_problem.closed, closed)
+
+    def test_closed_is_not_set_when_saving_problems_closed_before_it_was_stored(self):
+        self.test_problem.status = Problem.RESOLVED
+        self.test_problem.save()
+        Problem.objects.filter(pk=self.test_problem.pk).update(closed=None)
+        problem = Problem.objects.get(pk=self.test_problem.pk)
+        problem.save()
+        self.assertEqual(problem.closed, None)
+
     def test_closed_timestamp_is_determined_from_revisions_for_closed_problems(self):
         # Save the problem to setup an initial revision
         self.test_problem.save()
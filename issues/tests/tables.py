@@ -1,11 +1,17 @@
 # encoding: utf-8
 from django.test import TestCase
 from django.core.urlresolvers import reverse
+from django.template.loader import render_to_string
 
 from organisations.tests.lib import create_test_organisation, create_test_problem
 
 from ..models import Problem
 from ..tables import ProblemTable
+from ..table_columns import (render_time_interval,
+                             render_percent,
+                             render_boolean,
+                             render_rating,
+                             ReversedURL)
 
 
 class ProblemTableTest(TestCase):
@@ -52,3 +58,58 @@ class ProblemTableTest(TestCase):
 
         # Test similar methods too
         table.render_summary_as_response_link(self.problem)
+
+    def test_row_href(self):
+        private_table = ProblemTable([], private=True)
+        self.assertEqual(private_table.row_href(self.problem),
+                         reverse('response-form', kwargs={'pk': self.problem.id}))
+        public_table = ProblemTable([], private=False, cobrand='myhealthlondon')
+        self.assertEqual(public_table.row_href(self.problem),
+                         reverse('problem-view', kwargs={'pk': self.problem.id, 'cobrand': 'myhealthlondon'}))
+        self.assertEqual(public_table.row_classes(self.problem), ' table-link__row')
+
+
+class CompiledColumnTest(TestCase):
+    """The column render functions should give exactly the same HTML as the
+    templates they're copies of"""
+
+    def assertRendersLikeTemplate(self, render, template_name, values, **context):
+        for value in values:
+            expected = render_to_string(template_name, dict(context, value=value))
+            self.assertEqual(render(value, **context), expected)
+
+    def test_render_time_interval(self):
+        self.assertRendersLikeTemplate(render_time_interval,
+                                       'organisations/includes/tables/columns/time_interval_column.html',
+                                       [None, 0, 1440, 2000.5, 100000])
+
+    def test_render_percent(self):
+        self.assertRendersLikeTemplate(render_percent,
+                                       'organisations/includes/tables/columns/percent_column.html',
+                                       [None, 0, 0.5, 0.333, 1])
+
+    def test_render_boolean(self):
+        self.assertRendersLikeTemplate(render_boolean,
+                                       'organisations/includes/tables/columns/boolean_column.html',
+                                       [None, True, False, 'True'])
+
+    def test_render_rating(self):
+        values = [None, 0, 1, 2.5, 3.7, 5]
+        self.assertRendersLikeTemplate(render_rating,
+                                       'organisations/includes/tables/columns/rating_column.html',
+                                       values)
+        self.assertRendersLikeTemplate(render_rating,
+                                       'organisations/includes/tables/columns/rating_column.html',
+                                       values,
+                                       css_class='rating--review_details',
+                                       description="<b>Likely</b>")
+
+
+class ReversedURLTest(TestCase):
+
+    def test_reversed_url(self):
+        url = ReversedURL('public-org-summary', 'ods_code', ReversedURL.ODS_CODE_PLACEHOLDER, {'cobrand': 'choices'})
+        self.assertEqual(url('RA9'), reverse('public-org-summary', kwargs={'ods_code': 'RA9', 'cobrand': 'choices'}))
+
+    def test_placeholder_must_be_in_url_once(self):
+        self.assertRaises(ValueError, ReversedURL, 'public-org-summary', 'ods_code', 'choices', {'cobrand': 'choices'})
@@ -11,8 +11,9 @@ users belonging to one of the ccgs/parents/organisations use to manage the
 :model:`issues.Problem`s assigned to them.
 
 Commands are provided to load ccgs/parents/organisations from CSV files, as
-well as to load in users for them. A command is also provided to retrieve the
-"average_recommendation_rating" of an Organisation from the NHS Choices API.
+well as to load in users for them. Commands are also provided to calculate the
+"average_recommendation_rating" of Organisations from their reviews, and to
+retrieve it from the NHS Choices API for those without any.
 
 Several useful helper functions, libraries or mixins are also contained:
 - interval_counts, for summarising data about Organisations in an efficient DB query
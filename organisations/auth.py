@@ -2,8 +2,11 @@ import re
 import os
 import string
 import random
+import uuid
 
 from django import forms
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
@@ -12,6 +15,8 @@ from django.utils.translation import ugettext_lazy as _
 
 from passwords.fields import PasswordField
 
+from citizenconnect.transaction_hooks import on_commit
+
 """
 Helpers to do with authorisation of users
 """
@@ -31,6 +36,91 @@ ALL_GROUPS = [ORGANISATION_PARENTS,
               SECOND_TIER_MODERATORS]
 
 
+# Keys in the cache for sharing UserAccess between requests, see user_access
+USER_ACCESS_GENERATION_KEY = 'user-access-generation'
+USER_ACCESS_KEY = 'user-access:{0}:{1}'
+
+
+class UserAccess(object):
+    """
+    The ids of the groups, Organisation Parents and CCGs a user belongs to,
+    and of the Organisation Parents they can see through their CCGs, so that
+    access checks can be answered without going back to the database.
+    """
+
+    def __init__(self,
+                 group_ids=(),
+                 organisation_parent_ids=(),
+                 ccg_ids=(),
+                 ccg_organisation_parent_ids=()):
+        self.group_ids = frozenset(group_ids)
+        self.organisation_parent_ids = frozenset(organisation_parent_ids)
+        self.ccg_ids = frozenset(ccg_ids)
+        self.ccg_organisation_parent_ids = frozenset(ccg_organisation_parent_ids)
+
+    @classmethod
+    def load(cls, user):
+        """Load the access a user has from the database"""
+        ccg_organisation_parent_ids = user.ccgs.values_list('organisation_parents', flat=True)
+        return cls(
+            group_ids=user.groups.values_list('id', flat=True),
+            organisation_parent_ids=user.organisation_parents.values_list('id', flat=True),
+            ccg_ids=user.ccgs.values_list('id', flat=True),
+            # CCGs without any Organisation Parents give us a None
+            ccg_organisation_parent_ids=[id for id in ccg_organisation_parent_ids if id is not None]
+        )
+
+
+def user_access(user):
+    """
+    Return the UserAccess for a user.
+
+    This is loaded the first time it's needed and then kept on the user
+    object, in the same way that Django's ModelBackend keeps permissions in
+    user._perm_cache, so it lasts for as long as the request does. If
+    settings.USER_ACCESS_CACHE_SECONDS is set, it's also kept in the cache for
+    that long, to share it between requests.
+    """
+    try:
+        return user._user_access_cache
+    except AttributeError:
+        pass
+
+    if not user.is_authenticated():
+        access = UserAccess()
+    else:
+        access = None
+        timeout = settings.USER_ACCESS_CACHE_SECONDS
+        if timeout:
+            generation = cache.get(USER_ACCESS_GENERATION_KEY, 0)
+            key = USER_ACCESS_KEY.format(generation, user.id)
+            access = cache.get(key)
+        if access is None:
+            access = UserAccess.load(user)
+            if timeout:
+                cache.set(key, access, timeout)
+
+    user._user_access_cache = access
+    return access
+
+
+def invalidate_user_access(user=None):
+    """
+    Forget the UserAccess kept on a user object, if one is given, and
+    everything that's been shared between requests in the cache.
+    """
+    if user is not None and hasattr(user, '_user_access_cache'):
+        del user._user_access_cache
+    if settings.USER_ACCESS_CACHE_SECONDS:
+        # Cached UserAccess is only kept for USER_ACCESS_CACHE_SECONDS, so the
+        # generation only has to last that long too. It's changed once the
+        # change to the user's access is committed, so that nothing can cache
+        # the old access again under the new generation.
+        on_commit(lambda: cache.set(USER_ACCESS_GENERATION_KEY,
+                                    uuid.uuid4().hex,
+                                    settings.USER_ACCESS_CACHE_SECONDS))
+
+
 def user_is_superuser(user):
     """
     Like Django's is_superuser, but it knows about NHS Superusers too
@@ -42,13 +132,65 @@ def user_in_groups(user, groups):
     """
     Helper for seeing if a user is in any of a list of user groups.
     """
-    return user.groups.filter(pk__in=groups).exists()
+    return not user_access(user).group_ids.isdisjoint(groups)
 
 
 def user_in_group(user, group):
     return user_in_groups(user, [group])
 
 
+def user_can_access_ccg(user, ccg_id):
+    """Can a user access the CCG with the given id?"""
+
+    # Deactivated users - NO
+    if not user.is_active:
+        return False
+
+    # Django superusers - YES
+    if user.is_superuser:
+        return True
+
+    # NHS Superusers, Case Handlers - YES
+    if user_in_groups(user, [NHS_SUPERUSERS, CASE_HANDLERS]):
+        return True
+
+    # Users in this ccg - YES
+    if ccg_id in user_access(user).ccg_ids:
+        return True
+
+    # Everyone else - NO
+    return False
+
+
+def user_can_access_organisation_parent(user, organisation_parent_id):
+    """Can a user access the Organisation Parent with the given id?"""
+
+    # Deactivated users - NO
+    if not user.is_active:
+        return False
+
+    # Django superusers - YES
+    if user.is_superuser:
+        return True
+
+    # NHS Superusers, Moderators - YES
+    if user_in_groups(user, [NHS_SUPERUSERS, CASE_HANDLERS]):
+        return True
+
+    access = user_access(user)
+
+    # Users in this Parent - YES
+    if organisation_parent_id in access.organisation_parent_ids:
+        return True
+
+    # CCG users for a CCG associated with this Parent - YES
+    if organisation_parent_id in access.ccg_organisation_parent_ids:
+        return True
+
+    # Everyone else - NO
+    return False
+
+
 def enforce_organisation_access_check(organisation, user):
     if not organisation.can_be_accessed_by(user):
         raise PermissionDenied()
@@ -4,6 +4,15 @@ import urllib2
 import xml.etree.ElementTree as ET
 import os
 import logging
+import hashlib
+import tempfile
+import threading
+import time
+import cPickle as pickle
+from cStringIO import StringIO
+
+import requests
+from requests.adapters import HTTPAdapter
 
 # Django imports
 from django.conf import settings
@@ -11,10 +20,222 @@ from django.conf import settings
 logger = logging.getLogger(__name__)
 
 
+class StreamedResponse(object):
+    """
+    A file-like object which reads the body of a streamed requests.Response
+    as it arrives, so that it can be parsed without holding all of it in
+    memory. The body is decompressed if the API gzipped it.
+    """
+
+    chunk_size = 16 * 1024
+
+    def __init__(self, response):
+        self.response = response
+        self.chunks = response.iter_content(self.chunk_size)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self.buffer = self.buffer, ''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        # Let the connection go back to the pool, whether or not we read
+        # everything
+        release_conn = getattr(self.response.raw, 'release_conn', None)
+        if release_conn is not None:
+            release_conn()
+
+
+class ChoicesAPITransport(object):
+    """
+    Sends requests to the NHS Choices API over a pool of kept-alive
+    connections, which every ChoicesAPI in the process shares (see
+    shared_transport).
+
+    GETs that fail with a server error, or that can't connect or time out,
+    are retried settings.NHS_CHOICES_API_RETRIES times, waiting twice as long
+    each time, starting at settings.NHS_CHOICES_API_RETRY_BACKOFF_SECONDS.
+
+    If settings.NHS_CHOICES_API_CACHE_DIR is set, responses with an ETag or
+    Last-Modified header are kept there, and are asked for with a conditional
+    GET the next time, so that unchanged responses aren't downloaded again.
+
+    GET responses are streamed, either straight to whoever is reading them or
+    into the cache file as they arrive, so that a whole page of the API never
+    has to be held in memory.
+    """
+
+    user_agent = "CitizenConnect ChoicesAPI"
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = self.user_agent
+        adapter = HTTPAdapter(pool_connections=settings.NHS_CHOICES_API_POOL_SIZE,
+                              pool_maxsize=settings.NHS_CHOICES_API_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, retries=0, **kwargs):
+        """Send a request, retrying it up to retries times if it fails with
+        a server error or doesn't get a response. Returns the
+        requests.Response, or raises urllib2.URLError if there wasn't one."""
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method,
+                                                url,
+                                                timeout=settings.NHS_CHOICES_API_TIMEOUT_SECONDS,
+                                                **kwargs)
+                if response.status_code < 500 or attempt >= retries:
+                    return response
+                # Read the error, so that a streamed response's connection
+                # can be used again
+                response.content
+                logger.warning("Got a {0} from the Choices API for {1}, retrying".format(response.status_code, url))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= retries:
+                    raise urllib2.URLError(e)
+                logger.warning("Error fetching {0} from the Choices API, retrying: {1}".format(url, e))
+            time.sleep(settings.NHS_CHOICES_API_RETRY_BACKOFF_SECONDS * (2 ** attempt))
+            attempt += 1
+
+    def get(self, url):
+        """GET a url, returning a file-like object with the body of the
+        response, which should be closed when it's been read. Raises
+        urllib2.HTTPError for error responses, like urllib2 does."""
+        cached = self.read_cache(url)
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        try:
+            response = self.request('get', url, retries=settings.NHS_CHOICES_API_RETRIES, headers=headers, stream=True)
+
+            if response.status_code == 304 and cached is not None:
+                # Read the (empty) body so the connection can be used again
+                response.content
+                body, cached = cached['body'], None
+                return body
+            if response.status_code >= 400:
+                raise urllib2.HTTPError(url, response.status_code, response.reason, response.headers, StringIO(response.content))
+        finally:
+            if cached is not None:
+                cached['body'].close()
+
+        cache_file = self.write_cache(url, response)
+        if cache_file is not None:
+            return cache_file
+        return StreamedResponse(response)
+
+    def post(self, url, data, headers):
+        """POST data to a url, returning the requests.Response. These aren't
+        retried, because we can't tell if the API acted on them or not."""
+        return self.request('post', url, data=data, headers=headers)
+
+    def cache_path(self, url):
+        return os.path.join(settings.NHS_CHOICES_API_CACHE_DIR, hashlib.sha1(url).hexdigest())
+
+    def read_cache(self, url):
+        """Return a dictionary of the etag and last_modified headers of the
+        cached response for url, and its body as an open file, or None if
+        there isn't one.
+
+        Cache files are the pickled headers followed by the body, so that
+        the body can be written and read a piece at a time."""
+        if not settings.NHS_CHOICES_API_CACHE_DIR:
+            return None
+        try:
+            cache_file = open(self.cache_path(url), 'rb')
+        except Exception:
+            # Missing, or unreadable, which is the same as missing
+            return None
+        try:
+            cached = pickle.load(cache_file)
+            # Files from before the body followed the headers have it in the
+            # pickle instead, and will be replaced
+            if 'body' not in cached:
+                cached['body'] = cache_file
+                return cached
+        except Exception:
+            pass
+        cache_file.close()
+        return None
+
+    def write_cache(self, url, response):
+        """Stream the body of response into the cache, if it's one we can
+        ask about again, and return the cache file, open at the start of the
+        body. Returns None if the response wasn't cached, in which case its
+        body hasn't been read yet."""
+        if not settings.NHS_CHOICES_API_CACHE_DIR:
+            return None
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            # We wouldn't be able to ask if it has changed
+            return None
+        try:
+            if not os.path.isdir(settings.NHS_CHOICES_API_CACHE_DIR):
+                os.makedirs(settings.NHS_CHOICES_API_CACHE_DIR)
+            # Write to a temporary file and move it into place, so that other
+            # threads and processes never see half a response
+            (handle, temp_path) = tempfile.mkstemp(dir=settings.NHS_CHOICES_API_CACHE_DIR)
+        except (IOError, OSError) as e:
+            logger.warning("Couldn't cache the Choices API response for {0}: {1}".format(url, e))
+            return None
+
+        cache_file = os.fdopen(handle, 'w+b')
+        try:
+            pickle.dump({'etag': etag, 'last_modified': last_modified},
+                        cache_file,
+                        pickle.HIGHEST_PROTOCOL)
+            body_start = cache_file.tell()
+            for chunk in response.iter_content(StreamedResponse.chunk_size):
+                cache_file.write(chunk)
+            cache_file.flush()
+            cache_file.seek(body_start)
+        except Exception:
+            cache_file.close()
+            os.remove(temp_path)
+            raise
+        try:
+            os.rename(temp_path, self.cache_path(url))
+        except OSError as e:
+            logger.warning("Couldn't cache the Choices API response for {0}: {1}".format(url, e))
+            # We've still got it open to read
+            os.remove(temp_path)
+        return cache_file
+
+
+_shared_transport = None
+_shared_transport_lock = threading.Lock()
+
+
+def shared_transport():
+    """Return the ChoicesAPITransport for this process, making it the first
+    time it's needed"""
+    global _shared_transport
+    with _shared_transport_lock:
+        if _shared_transport is None:
+            _shared_transport = ChoicesAPITransport()
+        return _shared_transport
+
+
 class ChoicesAPI():
 
 
     def __init__(self):
+        self.transport = shared_transport()
         self.atom_namespace = '{http://www.w3.org/2005/Atom}'
         self.services_namespace = '{http://syndication.nhschoices.nhs.uk/services}'
         self.syndication_namespace = '{http://schemas.datacontract.org/2004/07/NHSChoices.Syndication.Resources}'
@@ -38,14 +259,13 @@ class ChoicesAPI():
         return url
 
     def send_api_request(self, url):
-        """Send a request to the API, return response object. Adds user agent."""
-        user_agent = "CitizenConnect ChoicesAPI"
-
-        opener = urllib2.build_opener()
-        opener.addheaders = [('User-agent', user_agent)]
-        response = opener.open(url)
+        """Send a GET request to the API, return a file-like object with the
+        response. Raises urllib2.HTTPError for error responses."""
+        return self.transport.get(url)
 
-        return response
+    def send_api_post(self, url, data, headers):
+        """POST data to the API, return the requests.Response"""
+        return self.transport.post(url, data, headers)
 
     def _query_api(self, path_elements, parameters):
         url = self.construct_url(path_elements, parameters)
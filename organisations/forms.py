@@ -2,22 +2,22 @@
 import re
 from ukpostcodeutils import validation
 import json
+import socket
 import urllib
-from itertools import chain
+import urllib2
 
 # Django imports
 from django import forms
 from django.conf import settings
 from django.contrib.gis.geos import Point
 from django.contrib.gis.measure import Distance
-from django.db.models import Q
 
 # App imports
 from issues.models import Problem
 from citizenconnect.widgets import MonthYearWidget
 
-from .models import Organisation, CCG, Service
-from .metaphone import dm
+from .models import Organisation, CCG, Service, Postcode
+from .search import search_organisations
 
 
 class MapitError(Exception): pass
@@ -32,9 +32,31 @@ class MapitPostCodeLookup(object):
     def postcode_to_point(cls, postcode, partial=False):
         """Lookup a lat/lon from a postcode and return a Point.
 
+        Postcodes are looked up in our own store of :model:`organisations.Postcode`s
+        first, and only looked up on Mapit when they're not in there (and
+        settings.POSTCODE_MAPIT_FALLBACK is on), in which case Mapit's answer
+        is stored for next time.
+
         Raises various Mapit errors if the api is unavailable or the postcode
         is invalid/not found, and None if the postcode exists and is valid but
-        Mapit can't geocode it."""
+        can't be geocoded."""
+        try:
+            return Postcode.objects.get(postcode=Postcode.normalise(postcode)).point
+        except Postcode.DoesNotExist:
+            pass
+
+        if not settings.POSTCODE_MAPIT_FALLBACK:
+            raise MapitPostcodeNotFoundError()
+
+        point = cls.mapit_postcode_to_point(postcode, partial)
+        Postcode.remember(postcode, point, partial)
+        return point
+
+    @classmethod
+    def mapit_postcode_to_point(cls, postcode, partial=False):
+        """Lookup a lat/lon from a postcode on Mapit and return a Point, or
+        None if Mapit can't geocode it. Raises the same errors as
+        postcode_to_point."""
 
         path_elements = ['postcode']
         if partial:
@@ -45,13 +67,20 @@ class MapitPostCodeLookup(object):
         url = "%(base_url)s%(query_path)s" % {'base_url': settings.MAPIT_BASE_URL,
                                               'query_path': query_path}
         try:
-            point_response = urllib.urlopen(url)
-        except IOError:
+            point_response = urllib2.urlopen(url, timeout=settings.MAPIT_TIMEOUT_SECONDS)
+        except urllib2.HTTPError as e:
+            # urllib2 raises errors for responses we need to look at, but
+            # they can be treated just like a response
+            point_response = e
+        except (IOError, socket.timeout):
             raise MapitUnavailableError()
 
         response_code = point_response.getcode()
         if response_code == 200:
-            point_data = json.load(point_response)
+            try:
+                point_data = json.load(point_response)
+            except (IOError, socket.timeout):
+                raise MapitUnavailableError()
             if point_data.get("wgs84_lon"):
                 return Point(point_data["wgs84_lon"], point_data["wgs84_lat"])
             else:
@@ -66,7 +95,6 @@ class MapitPostCodeLookup(object):
             raise MapitUnavailableError()
 
 
-
 class OrganisationFinderForm(forms.Form):
     location = forms.CharField(required=True, error_messages={'required': 'Please enter a location'})
 
@@ -109,20 +137,7 @@ class OrganisationFinderForm(forms.Form):
                 organisations = self.organisations_from_postcode(postcode, partial=True)
                 validation_message = "Sorry, there are no matches within 5 miles of %s. Please try again. %s" % (location, self.PILOT_SEARCH_CAVEAT)
             else:
-                organisations = self.queryset.filter(name__icontains=location)
-                if len(organisations) < 5:
-                    # Try a metaphone search to give more results
-                    location_metaphone = dm(location)
-                    # First do a __startswith or __endswith
-                    alt_orgs = self.queryset.filter(Q(name_metaphone__startswith=location_metaphone[0])
-                                                    | Q(name_metaphone__endswith=location_metaphone[0]),
-                                                    ~Q(pk__in=list([a.id for a in organisations])))
-                    organisations = list(chain(organisations, alt_orgs))
-                    if len(organisations) < 10:
-                        # Try a metaphone __contains to give even more results
-                        more_orgs = self.queryset.filter(Q(name_metaphone__contains=location_metaphone[0]),
-                                                         ~Q(pk__in=list([a.id for a in organisations])))
-                        organisations = list(chain(organisations, more_orgs))
+                organisations = search_organisations(location, self.queryset)
 
                 validation_message = "We couldn't find any matches for '%s'. Please try again. %s" % (location, self.PILOT_SEARCH_CAVEAT)
             if len(organisations) == 0:
@@ -241,6 +256,26 @@ class OrganisationFilterForm(FilterForm):
                                                                        label="Service/Department"))
 
 
+class ProblemsCSVFilterForm(forms.Form):
+    """Form for processing filters on the problems CSV download, to limit it
+    to one organisation and/or a date range."""
+
+    organisation = forms.ModelChoiceField(
+        required=False,
+        queryset=Organisation.objects.all().order_by("name"),
+        empty_label='All organisations'
+    )
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+
+    def clean(self):
+        start = self.cleaned_data.get('start')
+        end = self.cleaned_data.get('end')
+        if start and end and start > end:
+            raise forms.ValidationError("The start date must be before the end date")
+        return self.cleaned_data
+
+
 class SurveyAdminCSVUploadForm(forms.Form):
     """A Form for the admin site which allows bulk uploading of csv files"""
     csv_file = forms.FileField(
@@ -1,9 +1,12 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time
+from django.utils import timezone
 from django.utils.timezone import utc
-from django.db import connection
+from django.db import connection, transaction
 
 from issues.models import Problem
 
+from .map_tiles import invalidate_map_tiles
+
 
 # Return a clause summing the number of records in a table whose field meets a criteria
 def _sum_clause(table, field, criteria):
@@ -58,10 +61,10 @@ def _create_problem_selects(intervals, data_intervals, boolean_fields, average_f
         select_clauses.append(_average_value_clause('issues_problem', field, "average_" + field))
 
 
-def _apply_problem_filters(problem_filters, problem_filter_clauses, organisation_id, params):
+def _apply_problem_filters(problem_filters, problem_filter_clauses, organisation_id, params, table='issues_problem'):
 
     # Filter out any REJECTED problems.
-    problem_filter_clauses.append("issues_problem.publication_status != %s")
+    problem_filter_clauses.append(table + ".publication_status != %s")
     params.append(Problem.REJECTED)
 
     # Apply problem filters to the issue table
@@ -70,17 +73,17 @@ def _apply_problem_filters(problem_filters, problem_filter_clauses, organisation
         if value is not None:
             if type(value) != tuple:
                 value = (value,)
-            problem_filter_clauses.append("issues_problem." + criteria + " in %s""")
+            problem_filter_clauses.append(table + "." + criteria + " in %s""")
             params.append(value)
 
     breach = problem_filters.get('breach')
     if breach is not None:
-        problem_filter_clauses.append("issues_problem.breach = %s""")
+        problem_filter_clauses.append(table + ".breach = %s""")
         params.append(breach)
 
     formal_complaint = problem_filters.get('formal_complaint')
     if formal_complaint is not None:
-        problem_filter_clauses.append("issues_problem.formal_complaint = %s""")
+        problem_filter_clauses.append(table + ".formal_complaint = %s""")
         params.append(formal_complaint)
 
     service_code = problem_filters.get('service_code')
@@ -90,7 +93,7 @@ def _apply_problem_filters(problem_filters, problem_filter_clauses, organisation
         else:
             if type(service_code) != tuple:
                 service_code = (service_code,)
-            problem_filter_clauses.append("""issues_problem.service_id in (select id from organisations_service where service_code in %s)""")
+            problem_filter_clauses.append(table + """.service_id in (select id from organisations_service where service_code in %s)""")
             params.append(service_code)
 
 
@@ -151,6 +154,446 @@ def _apply_organisation_filters(organisation_filters,
             params.append(ccg)
 
 
+# The problem filters which can be answered from the DailyProblemCount rollup
+# table, anything else has to be counted from the problems table itself.
+ROLLUP_PROBLEM_FILTERS = ['status',
+                          'service_id',
+                          'category',
+                          'publication_status',
+                          'breach',
+                          'formal_complaint',
+                          'service_code']
+
+# Advisory lock namespaces, used to stop two transactions rebuilding the
+# rollup rows for the same organisation at once and double counting
+PROBLEM_COUNTS_LOCK = 7301
+REVIEW_COUNTS_LOCK = 7302
+
+
+# Return the (UTC) day that a datetime falls on, which is what the rollup
+# tables are keyed on
+def utc_day(value):
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_default_timezone())
+    return value.astimezone(utc).date()
+
+
+# Return the start and end of a (UTC) day as datetimes
+def _day_bounds(day):
+    start = datetime.combine(day, time.min).replace(tzinfo=utc)
+    return start, start + timedelta(days=1)
+
+
+# Return a clause restricting a datetime field to any of the given days
+def _days_clause(table, field, days, params):
+    day_clauses = []
+    for day in days:
+        day_clauses.append("(" + table + "." + field + " >= %s AND " + table + "." + field + " < %s)")
+        params.extend(_day_bounds(day))
+    return "(" + " OR ".join(day_clauses) + ")"
+
+
+# Lock and clear out the rows in a rollup table that are about to be rebuilt,
+# returning the clauses and params to select the source rows to rebuild them
+# from.
+def _prepare_rollup_refresh(cursor, rollup_table, lock, organisation_field, table, date_field, organisation_ids, days):
+    delete_clauses = []
+    delete_params = []
+    source_clauses = []
+    source_params = []
+
+    if organisation_ids is None:
+        cursor.execute("LOCK TABLE " + rollup_table + " IN EXCLUSIVE MODE")
+    else:
+        for organisation_id in organisation_ids:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [lock, organisation_id])
+        delete_clauses.append("organisation_id IN %s")
+        delete_params.append(tuple(organisation_ids))
+        source_clauses.append(organisation_field + " IN %s")
+        source_params.append(tuple(organisation_ids))
+
+    if days is not None:
+        delete_clauses.append("date IN %s")
+        delete_params.append(tuple(days))
+        source_clauses.append(_days_clause(table, date_field, days, source_params))
+
+    delete_sql = "DELETE FROM " + rollup_table
+    if delete_clauses:
+        delete_sql += " WHERE " + " AND ".join(delete_clauses)
+    cursor.execute(delete_sql, delete_params)
+
+    return source_clauses, source_params
+
+
+# Rebuild the DailyProblemCount rollup rows for the given organisations and
+# (UTC) days from the problems table. Passing None for organisation_ids or
+# days rebuilds the rows for all of them.
+def refresh_problem_counts(organisation_ids=None, days=None):
+    if organisation_ids is not None:
+        organisation_ids = sorted(set(organisation_ids))
+        if not organisation_ids:
+            return
+    if days is not None:
+        days = sorted(set(days))
+        if not days:
+            return
+
+    cursor = connection.cursor()
+    clauses, params = _prepare_rollup_refresh(cursor,
+                                              'organisations_dailyproblemcount',
+                                              PROBLEM_COUNTS_LOCK,
+                                              'issues_problem.organisation_id',
+                                              'issues_problem',
+                                              'created',
+                                              organisation_ids,
+                                              days)
+    where_text = ''
+    if clauses:
+        where_text = "WHERE " + " AND ".join(clauses)
+
+    cursor.execute("""INSERT INTO organisations_dailyproblemcount
+                      (organisation_id, date, status, publication_status, category,
+                       service_id, breach, formal_complaint, count,
+                       time_to_acknowledge_total, time_to_acknowledge_count,
+                       time_to_address_total, time_to_address_count,
+                       happy_service_true, happy_service_count,
+                       happy_outcome_true, happy_outcome_count)
+                      SELECT issues_problem.organisation_id,
+                             (issues_problem.created AT TIME ZONE 'UTC')::date,
+                             issues_problem.status,
+                             issues_problem.publication_status,
+                             issues_problem.category,
+                             issues_problem.service_id,
+                             issues_problem.breach,
+                             issues_problem.formal_complaint,
+                             count(issues_problem.id),
+                             COALESCE(SUM(issues_problem.time_to_acknowledge), 0),
+                             count(issues_problem.time_to_acknowledge),
+                             COALESCE(SUM(issues_problem.time_to_address), 0),
+                             count(issues_problem.time_to_address),
+                             SUM(CASE WHEN issues_problem.happy_service THEN 1 ELSE 0 END),
+                             count(issues_problem.happy_service),
+                             SUM(CASE WHEN issues_problem.happy_outcome THEN 1 ELSE 0 END),
+                             count(issues_problem.happy_outcome)
+                      FROM issues_problem
+                      """ + where_text + """
+                      GROUP BY issues_problem.organisation_id,
+                               (issues_problem.created AT TIME ZONE 'UTC')::date,
+                               issues_problem.status,
+                               issues_problem.publication_status,
+                               issues_problem.category,
+                               issues_problem.service_id,
+                               issues_problem.breach,
+                               issues_problem.formal_complaint""", params)
+    # This is usually called from signal handlers, after save() has
+    # committed, so raw SQL has to commit itself when nothing is managing the
+    # transaction (which also releases the advisory locks)
+    transaction.commit_unless_managed()
+
+    # The map tiles show these counts, so the cached ones need rebuilding
+    invalidate_map_tiles(organisation_ids)
+
+
+# Rebuild the DailyReviewCount rollup rows for the given organisations and
+# (UTC) days from the reviews table. Passing None for organisation_ids or
+# days rebuilds the rows for all of them.
+def refresh_review_counts(organisation_ids=None, days=None):
+    if organisation_ids is not None:
+        organisation_ids = sorted(set(organisation_ids))
+        if not organisation_ids:
+            return
+    if days is not None:
+        days = sorted(set(days))
+        if not days:
+            return
+
+    cursor = connection.cursor()
+    clauses, params = _prepare_rollup_refresh(cursor,
+                                              'organisations_dailyreviewcount',
+                                              REVIEW_COUNTS_LOCK,
+                                              'reviews_display_review_organisations.organisation_id',
+                                              'reviews_display_review',
+                                              'api_published',
+                                              organisation_ids,
+                                              days)
+    # We don't want any "replies" to show up in these counts
+    clauses.insert(0, "reviews_display_review.in_reply_to_id IS NULL")
+
+    cursor.execute("""INSERT INTO organisations_dailyreviewcount
+                      (organisation_id, date, count)
+                      SELECT reviews_display_review_organisations.organisation_id,
+                             (reviews_display_review.api_published AT TIME ZONE 'UTC')::date,
+                             count(reviews_display_review.id)
+                      FROM reviews_display_review
+                      INNER JOIN reviews_display_review_organisations
+                      ON reviews_display_review_organisations.review_id = reviews_display_review.id
+                      WHERE """ + " AND ".join(clauses) + """
+                      GROUP BY reviews_display_review_organisations.organisation_id,
+                               (reviews_display_review.api_published AT TIME ZONE 'UTC')::date""", params)
+    transaction.commit_unless_managed()
+
+    invalidate_map_tiles(organisation_ids)
+
+
+# The question on NHS Choices reviews whose scores (between 1 and 5) make up
+# an organisation's average_recommendation_rating
+RECOMMENDATION_RATING_QUESTION = 'Friends and Family'
+
+
+# Recalculate average_recommendation_rating for the given organisations (or
+# all of them if organisation_ids is None) from the ratings of the reviews we
+# have for them, with a single grouped query. Reviews of GPs are about the
+# whole surgery, so GP branches get the average of all the reviews of their
+# parent surgery. Organisations without any rated reviews keep the rating
+# they had, which comes from the NHS Choices API (the
+# get_organisation_ratings_from_choices_api --missing-only cron job keeps
+# those up to date). Returns the ids of the organisations whose rating
+# changed.
+def refresh_recommendation_ratings(organisation_ids=None):
+    if organisation_ids is not None:
+        organisation_ids = tuple(set(organisation_ids))
+        if not organisation_ids:
+            return []
+
+    cursor = connection.cursor()
+    organisations_clause = "TRUE"
+    if organisation_ids is not None:
+        # Include the other branches of any GP surgeries, since they share a
+        # rating
+        cursor.execute("""SELECT id
+                          FROM organisations_organisation
+                          WHERE id IN %s
+                          OR (organisation_type = 'gppractices'
+                              AND parent_id IN (SELECT parent_id
+                                                FROM organisations_organisation
+                                                WHERE id IN %s
+                                                AND organisation_type = 'gppractices'))""",
+                       [organisation_ids, organisation_ids])
+        organisation_ids = tuple(row[0] for row in cursor.fetchall())
+        if not organisation_ids:
+            return []
+        organisations_clause = "organisations_organisation.id IN %s"
+
+    # Organisations are averaged in groups: each GP surgery's branches
+    # together, and everything else on its own
+    group_clause = """(CASE WHEN organisations_organisation.organisation_type = 'gppractices'
+                            THEN 'parent-' || organisations_organisation.parent_id
+                            ELSE 'organisation-' || organisations_organisation.id
+                       END)"""
+
+    params = [RECOMMENDATION_RATING_QUESTION]
+    if organisation_ids is not None:
+        params.extend([organisation_ids, organisation_ids])
+    # A review of a surgery is linked to each of its branches, but should only
+    # be counted once in the surgery's average, hence the DISTINCT
+    cursor.execute("""WITH scores AS (
+                          SELECT DISTINCT """ + group_clause + """ AS rating_group,
+                                 reviews_display_review.id,
+                                 reviews_display_rating.score
+                          FROM reviews_display_review
+                          INNER JOIN reviews_display_rating
+                          ON reviews_display_rating.review_id = reviews_display_review.id
+                          INNER JOIN reviews_display_review_organisations
+                          ON reviews_display_review_organisations.review_id = reviews_display_review.id
+                          INNER JOIN organisations_organisation
+                          ON organisations_organisation.id = reviews_display_review_organisations.organisation_id
+                          WHERE reviews_display_review.in_reply_to_id IS NULL
+                          AND reviews_display_rating.question = %s
+                          AND """ + organisations_clause + """
+                      ),
+                      averages AS (
+                          SELECT rating_group, AVG(score)::double precision AS rating
+                          FROM scores
+                          GROUP BY rating_group
+                      ),
+                      ratings AS (
+                          SELECT organisations_organisation.id, averages.rating
+                          FROM organisations_organisation
+                          INNER JOIN averages
+                          ON averages.rating_group = """ + group_clause + """
+                          WHERE """ + organisations_clause + """
+                      )
+                      UPDATE organisations_organisation
+                      SET average_recommendation_rating = ratings.rating
+                      FROM ratings
+                      WHERE organisations_organisation.id = ratings.id
+                      AND organisations_organisation.average_recommendation_rating IS DISTINCT FROM ratings.rating
+                      RETURNING organisations_organisation.id""", params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+# Return a clause summing the rollup counts for rows meeting a criteria
+def _rollup_sum_clause(criteria):
+    return "SUM(CASE WHEN rollup." + criteria + " THEN rollup.count ELSE 0 END)"
+
+
+# Return a clause counting the records since an interval's cutoff. The rollup
+# only knows about whole days, so we add the whole days after the cutoff to the
+# count of records on the day of the cutoff itself that came after it, which
+# comes from the boundary subquery (see _boundary_join)
+def _rollup_interval_clause(interval):
+    return _rollup_sum_clause("date > %s") + " + COALESCE(MAX(boundary." + interval + "), 0)"
+
+
+# Return a left join to a subquery which counts the records for each
+# organisation that fall after each interval's cutoff but on the same day as
+# it. If group_field is given, the counts are also split by that field, which
+# is joined to the same field in the rollup table.
+def _boundary_join(cutoffs, table, field, organisation_field, from_text, filter_clauses, filter_params, params, group_field=None):
+    select_clauses = []
+    window_clauses = []
+    window_params = []
+    for interval, cutoff in cutoffs.items():
+        day_start, day_end = _day_bounds(utc_day(cutoff))
+        window = table + "." + field + " > %s AND " + table + "." + field + " < %s"
+        select_clauses.append("SUM(CASE WHEN " + window + " THEN 1 ELSE 0 END) AS " + interval)
+        params.extend([cutoff, day_end])
+        window_clauses.append("(" + window + ")")
+        window_params.extend([cutoff, day_end])
+
+    clauses = filter_clauses + ["(" + " OR ".join(window_clauses) + ")"]
+    params.extend(filter_params)
+    params.extend(window_params)
+
+    group_by_clauses = [organisation_field]
+    join_clauses = ["boundary.organisation_id = organisations_organisation.id"]
+    if group_field is not None:
+        select_clauses.insert(0, table + "." + group_field + " AS " + group_field)
+        group_by_clauses.append(table + "." + group_field)
+        join_clauses.append("boundary." + group_field + " = rollup." + group_field)
+
+    return ("LEFT JOIN (SELECT " + organisation_field + " AS organisation_id, " + ", ".join(select_clauses) +
+            " FROM " + from_text +
+            " WHERE " + " AND ".join(clauses) +
+            " GROUP BY " + ", ".join(group_by_clauses) + ") AS boundary" +
+            " ON " + " AND ".join(join_clauses))
+
+
+# Generate the interval counting select values and params for problems from
+# the rollup table
+def _create_rollup_problem_selects(intervals, data_intervals, boolean_fields, average_fields, select_clauses, params):
+    for interval in intervals.keys():
+        if interval in data_intervals:
+            select_clauses.append(_rollup_interval_clause(interval) + " AS " + interval)
+            params.append(utc_day(intervals[interval]))
+
+    if 'all_time' in data_intervals:
+        select_clauses.append("""COALESCE(SUM(rollup.count), 0) AS all_time""")
+
+    if 'all_time_open' in data_intervals:
+        select_clauses.append(_rollup_sum_clause("status in %s") + """ AS all_time_open""")
+        params.append(tuple(Problem.OPEN_STATUSES))
+
+    if 'all_time_closed' in data_intervals:
+        select_clauses.append(_rollup_sum_clause("status in %s") + """ AS all_time_closed""")
+        params.append(tuple(Problem.CLOSED_STATUSES))
+
+    # Get the True/False percentages from the stored counts
+    for field in boolean_fields:
+        select_clauses.append("SUM(rollup." + field + "_true) / NULLIF(SUM(rollup." + field + "_count), 0)::float AS " + field)
+
+    # Get the averages from the stored totals
+    for field in average_fields:
+        select_clauses.append("SUM(rollup." + field + "_total)::numeric / NULLIF(SUM(rollup." + field + "_count), 0) AS average_" + field)
+
+
+# Generate the interval counting select values and params for reviews from the
+# rollup table
+def _create_rollup_review_selects(intervals, data_intervals, select_clauses, params):
+    for interval in intervals.keys():
+        if interval in data_intervals:
+            select_clauses.append(_rollup_interval_clause(interval) + " AS reviews_" + interval)
+            params.append(utc_day(intervals[interval]))
+
+    if 'all_time' in data_intervals:
+        select_clauses.append("""COALESCE(SUM(rollup.count), 0) AS reviews_all_time""")
+
+
+# Return the cutoff datetimes for each interval
+def _interval_cutoffs():
+    now = datetime.utcnow().replace(tzinfo=utc)
+    return {'week': now - timedelta(days=7),
+            'four_weeks': now - timedelta(days=28),
+            'six_months': now - timedelta(days=365/12*6)}
+
+
+# Return the select and group by clauses which identify each organisation
+def _create_organisation_selects(extra_organisation_data):
+    # organisation identifying info
+    select_clauses = ["""organisations_organisation.id AS id""",
+                      """organisations_organisation.ods_code AS ods_code""",
+                      """organisations_organisation.name AS name"""]
+
+    # Group by clauses to go with the non-aggregate selects
+    group_by_clauses = ["organisations_organisation.id",
+                        "organisations_organisation.name",
+                        "organisations_organisation.ods_code"]
+
+    if 'coords' in extra_organisation_data:
+        select_clauses.append("""ST_X(organisations_organisation.point) AS lon""")
+        select_clauses.append("""ST_Y(organisations_organisation.point) AS lat""")
+        group_by_clauses.append('lon')
+        group_by_clauses.append('lat')
+    if 'type' in extra_organisation_data:
+        select_clauses.append("""(CASE WHEN organisations_organisation.organisation_type = 'gppractices'
+                                  THEN 'GP'
+                                  WHEN organisations_organisation.organisation_type = 'hospitals'
+                                  THEN 'Hospital'
+                                  WHEN organisations_organisation.organisation_type = 'clinics'
+                                  THEN 'Clinic'
+                                  ELSE 'Unknown' END) AS type""")
+        group_by_clauses.append('type')
+    if 'average_recommendation_rating' in extra_organisation_data:
+        select_clauses.append("""organisations_organisation.average_recommendation_rating as average_recommendation_rating""")
+        group_by_clauses.append("organisations_organisation.average_recommendation_rating")
+    if 'image' in extra_organisation_data:
+        select_clauses.append("""organisations_organisation.image AS image""")
+        select_clauses.append("""organisations_organisation.map_thumbnail AS map_thumbnail""")
+        group_by_clauses.append("organisations_organisation.image")
+        group_by_clauses.append("organisations_organisation.map_thumbnail")
+
+    return select_clauses, group_by_clauses
+
+
+# Check a threshold can be applied, returning the interval and cutoff value
+def _check_threshold(threshold, organisation_id, intervals):
+    if organisation_id:
+        raise NotImplementedError("Threshold is not implemented for a single organisation")
+    interval, cutoff = threshold
+    allowed_intervals = intervals.keys() + ['all_time']
+    if interval not in allowed_intervals:
+        raise NotImplementedError("Threshold can only be set on the value of one of: %s" % allowed_intervals)
+    return interval, cutoff
+
+
+# Run an interval counts query, returning a list of dictionaries, or a single
+# dictionary for a single organisation (unless the counts are grouped)
+def _fetch_counts(query, params, organisation_id, group_by_status):
+    cursor = connection.cursor()
+    cursor.execute(query, params)
+    desc = cursor.description
+    # Return a list of dictionaries
+    counts = [dict(zip([col[0] for col in desc], row)) for row in cursor.fetchall()]
+    # Or for a single organisation, just one
+    if organisation_id and not group_by_status:
+        counts = counts[0]
+    return counts
+
+
+# Can a call to interval_counts be answered from the rollup tables?
+def _rollup_covers(problem_filters, threshold, data_type):
+    if data_type == 'problems':
+        for criteria, value in problem_filters.items():
+            if value is not None and criteria not in ROLLUP_PROBLEM_FILTERS:
+                return False
+        return True
+    elif data_type == 'reviews':
+        # The live query applies review thresholds to the review's created
+        # date, which the rollup doesn't know about
+        return threshold is None
+    return False
+
+
 # Return problem or review counts for a set of organisations for the last week, four weeks
 # and six months based on created date and problem and organisation filters.
 # The filter_type parameter can be set to 'problems' or 'reviews' to return each type of data.
@@ -162,7 +605,8 @@ def _apply_organisation_filters(organisation_filters,
 # By default, all organisations matching the organisation filters will be returned. To get only
 # organisations that have at least one problem matching the problem filters, apply a threshold
 # like ('all_time', 1).
-# Possible list values for extra_organisation_data are 'coords', 'type' and 'average_recommendation_rating'.
+# Possible list values for extra_organisation_data are 'coords', 'type', 'average_recommendation_rating'
+# and 'image' (which gives 'image' and 'map_thumbnail').
 # Possible data_intervals are 'week', 'four_weeks', 'six_months', 'all_time'. For problems only,
 # there are also 'all_time_open', and 'all_time_closed'.
 # Possible values for average_fields are 'time_to_acknowledge', 'time_to_address' - returned dicts will
@@ -171,6 +615,13 @@ def _apply_organisation_filters(organisation_filters,
 # Possible values for boolean_fields are 'happy_service' and 'happy_outcome' - returned dicts will include
 # a key 'happy_service' or 'happy_outcome' whose value will be the fraction of issues for which the measure
 # is true.
+# Counts come from the per-day DailyProblemCount and DailyReviewCount rollup tables wherever the
+# filters allow, otherwise (or if use_rollup is False) they are counted from the problems and
+# reviews tables directly.
+# For problems only, group_by_status splits the counts for each organisation by problem status:
+# a list of dictionaries is returned (even for a single organisation), each with a 'status' key,
+# and an organisation with no matching problems gets a single dictionary with a status of None.
+# See status_interval_counts for a friendlier way to use this.
 def interval_counts(problem_filters={},
                     organisation_filters={},
                     threshold=None,
@@ -178,46 +629,323 @@ def interval_counts(problem_filters={},
                     data_intervals=['week', 'four_weeks', 'six_months', 'all_time'],
                     average_fields=['time_to_acknowledge', 'time_to_address'],
                     boolean_fields=['happy_service', 'happy_outcome'],
-                    data_type='problems'):
-    cursor = connection.cursor()
+                    data_type='problems',
+                    use_rollup=True,
+                    group_by_status=False):
+    query, params = _interval_counts_query(problem_filters,
+                                           organisation_filters,
+                                           threshold,
+                                           extra_organisation_data,
+                                           data_intervals,
+                                           average_fields,
+                                           boolean_fields,
+                                           data_type,
+                                           use_rollup,
+                                           group_by_status)
+    return _fetch_counts(query, params, organisation_filters.get('organisation_id'), group_by_status)
 
-    now = datetime.utcnow().replace(tzinfo=utc)
-    intervals = {'week': now - timedelta(days=7),
-                 'four_weeks': now - timedelta(days=28),
-                 'six_months': now - timedelta(days=365/12*6)}
 
+# Return the SQL and params for an interval_counts query
+def _interval_counts_query(problem_filters,
+                           organisation_filters,
+                           threshold,
+                           extra_organisation_data,
+                           data_intervals,
+                           average_fields,
+                           boolean_fields,
+                           data_type,
+                           use_rollup,
+                           group_by_status):
+    if group_by_status and data_type != 'problems':
+        raise NotImplementedError("Only problem counts can be grouped by status")
+    if use_rollup and _rollup_covers(problem_filters, threshold, data_type):
+        query_function = _rollup_interval_counts_query
+    else:
+        query_function = _live_interval_counts_query
+    return query_function(problem_filters,
+                          organisation_filters,
+                          threshold,
+                          extra_organisation_data,
+                          data_intervals,
+                          average_fields,
+                          boolean_fields,
+                          data_type,
+                          group_by_status)
+
+
+# Return problem and review counts for a set of organisations together, using a single query.
+# The problem and review counts are each worked out per organisation in their own subquery, as
+# interval_counts would, and then joined together, so the dictionaries returned have the keys
+# that interval_counts returns for problems and for reviews. Arguments are as for
+# interval_counts, except that problem_data_intervals and review_data_intervals give the
+# data_intervals for each type of data, and extra_organisation_data is returned from the
+# problem counts. A threshold here includes an organisation if either its problem count or its
+# review count for the interval equals or exceeds the value, so the interval must be in both
+# problem_data_intervals and review_data_intervals.
+def combined_interval_counts(problem_filters={},
+                             organisation_filters={},
+                             threshold=None,
+                             extra_organisation_data=[],
+                             problem_data_intervals=['week', 'four_weeks', 'six_months', 'all_time'],
+                             review_data_intervals=['week', 'four_weeks', 'six_months', 'all_time'],
+                             average_fields=['time_to_acknowledge', 'time_to_address'],
+                             boolean_fields=['happy_service', 'happy_outcome'],
+                             use_rollup=True):
+    intervals = _interval_cutoffs()
     organisation_id = organisation_filters.get('organisation_id')
 
-    params = []
+    problem_query, problem_params = _interval_counts_query(problem_filters,
+                                                           organisation_filters,
+                                                           None,
+                                                           extra_organisation_data,
+                                                           problem_data_intervals,
+                                                           average_fields,
+                                                           boolean_fields,
+                                                           'problems',
+                                                           use_rollup,
+                                                           False)
+    review_query, review_params = _interval_counts_query({},
+                                                         organisation_filters,
+                                                         None,
+                                                         [],
+                                                         review_data_intervals,
+                                                         [],
+                                                         [],
+                                                         'reviews',
+                                                         use_rollup,
+                                                         False)
+    params = problem_params + review_params
+
+    # The organisation details come from the problem counts
+    review_columns = ["review_counts.reviews_" + interval for interval in review_data_intervals
+                      if interval in intervals or interval == 'all_time']
+
+    # Criteria to implement the threshold
+    criteria_text = ''
+    if threshold is not None:
+        interval, cutoff = _check_threshold(threshold, organisation_id, intervals)
+        if interval not in problem_data_intervals or interval not in review_data_intervals:
+            raise NotImplementedError("Threshold can only be set on an interval in both problem_data_intervals and review_data_intervals")
+        criteria_text = "WHERE problem_counts." + interval + " >= %s OR review_counts.reviews_" + interval + " >= %s"
+        params.extend([cutoff, cutoff])
+
+    query = """WITH problem_counts AS (%s),
+                    review_counts AS (%s)
+               SELECT problem_counts.*, %s
+               FROM problem_counts
+               INNER JOIN review_counts ON review_counts.id = problem_counts.id
+               %s
+               ORDER BY problem_counts.name, problem_counts.ods_code""" % (problem_query,
+                                                                          review_query,
+                                                                          ", ".join(review_columns),
+                                                                          criteria_text)
+    return _fetch_counts(query, params, organisation_id, False)
+
+
+# Return problem counts for a set of organisations split by status, using a single query.
+# The result is a dictionary with an entry for each of the given statuses, whose value is
+# what interval_counts would return with the same arguments and a status filter of just
+# that status, ie: a list of dictionaries, or a single dictionary for a single organisation.
+def status_interval_counts(statuses,
+                           problem_filters={},
+                           organisation_filters={},
+                           extra_organisation_data=[],
+                           data_intervals=['week', 'four_weeks', 'six_months', 'all_time'],
+                           average_fields=['time_to_acknowledge', 'time_to_address'],
+                           boolean_fields=['happy_service', 'happy_outcome'],
+                           use_rollup=True):
+    problem_filters = dict(problem_filters)
+    problem_filters['status'] = tuple(statuses)
+    grouped_counts = interval_counts(problem_filters=problem_filters,
+                                     organisation_filters=organisation_filters,
+                                     extra_organisation_data=extra_organisation_data,
+                                     data_intervals=data_intervals,
+                                     average_fields=average_fields,
+                                     boolean_fields=boolean_fields,
+                                     use_rollup=use_rollup,
+                                     group_by_status=True)
+
+    # What the counts are for an organisation with no problems of a status
+    empty_counts = {}
+    for interval in data_intervals:
+        empty_counts[interval] = 0
+    for field in boolean_fields:
+        empty_counts[field] = None
+    for field in average_fields:
+        empty_counts['average_' + field] = None
+
+    # Every organisation has at least one row, in name order, so we can pick
+    # out the organisations and their counts for each status in one pass
+    organisations = []
+    counts_by_organisation_and_status = {}
+    for counts in grouped_counts:
+        status = counts.pop('status')
+        if counts['id'] not in counts_by_organisation_and_status:
+            organisations.append(counts)
+            counts_by_organisation_and_status[counts['id']] = {}
+        if status is not None:
+            counts_by_organisation_and_status[counts['id']][status] = counts
+
+    status_counts = {}
+    for status in statuses:
+        status_counts[status] = []
+        for organisation in organisations:
+            counts = counts_by_organisation_and_status[organisation['id']].get(status)
+            if counts is None:
+                counts = dict((key, organisation[key]) for key in organisation if key not in empty_counts)
+                counts.update(empty_counts)
+            status_counts[status].append(counts)
+        # For a single organisation, just one
+        if organisation_filters.get('organisation_id'):
+            status_counts[status] = status_counts[status][0]
+    return status_counts
+
+
+# interval_counts query for the rollup tables
+def _rollup_interval_counts_query(problem_filters,
+                            organisation_filters,
+                            threshold,
+                            extra_organisation_data,
+                            data_intervals,
+                            average_fields,
+                            boolean_fields,
+                            data_type,
+                            group_by_status):
+    intervals = _interval_cutoffs()
+
+    organisation_id = organisation_filters.get('organisation_id')
+
+    select_params = []
+    join_params = []
+    where_params = []
+    having_params = []
     tables = []
 
-    # organisation identifying info
-    select_clauses = ["""organisations_organisation.id AS id""",
-                      """organisations_organisation.ods_code AS ods_code""",
-                      """organisations_organisation.name AS name"""]
+    select_clauses, group_by_clauses = _create_organisation_selects(extra_organisation_data)
 
-    # Group by clauses to go with the non-aggregate selects
-    group_by_clauses = ["organisations_organisation.id",
-                        "organisations_organisation.name",
-                        "organisations_organisation.ods_code"]
+    if threshold is not None:
+        threshold_interval, threshold_cutoff = _check_threshold(threshold, organisation_id, intervals)
 
-    if 'coords' in extra_organisation_data:
-        select_clauses.append("""ST_X(organisations_organisation.point) AS lon""")
-        select_clauses.append("""ST_Y(organisations_organisation.point) AS lat""")
-        group_by_clauses.append('lon')
-        group_by_clauses.append('lat')
-    if 'type' in extra_organisation_data:
-        select_clauses.append("""(CASE WHEN organisations_organisation.organisation_type = 'gppractices'
-                                  THEN 'GP'
-                                  WHEN organisations_organisation.organisation_type = 'hospitals'
-                                  THEN 'Hospital'
-                                  WHEN organisations_organisation.organisation_type = 'clinics'
-                                  THEN 'Clinic'
-                                  ELSE 'Unknown' END) AS type""")
-        group_by_clauses.append('type')
-    if 'average_recommendation_rating' in extra_organisation_data:
-        select_clauses.append("""organisations_organisation.average_recommendation_rating as average_recommendation_rating""")
-        group_by_clauses.append("organisations_organisation.average_recommendation_rating")
+    # The intervals we need to count the records on the cutoff day for
+    boundary_cutoffs = dict((interval, cutoff) for interval, cutoff in intervals.items() if interval in data_intervals)
+    if threshold is not None and threshold_interval in intervals:
+        boundary_cutoffs[threshold_interval] = intervals[threshold_interval]
+
+    if data_type == 'problems':
+        _create_rollup_problem_selects(intervals,
+                                       data_intervals,
+                                       boolean_fields,
+                                       average_fields,
+                                       select_clauses,
+                                       select_params)
+
+        if group_by_status:
+            select_clauses.append("""rollup.status AS status""")
+            group_by_clauses.append("rollup.status")
+            boundary_group_field = 'status'
+        else:
+            boundary_group_field = None
+
+        rollup_clauses = ["""organisations_organisation.id = rollup.organisation_id"""]
+        _apply_problem_filters(problem_filters, rollup_clauses, organisation_id, join_params, table='rollup')
+        join_text = "LEFT JOIN organisations_dailyproblemcount AS rollup ON %s" % " AND ".join(rollup_clauses)
+
+        if boundary_cutoffs:
+            boundary_clauses = []
+            boundary_params = []
+            _apply_problem_filters(problem_filters, boundary_clauses, organisation_id, boundary_params)
+            join_text += " " + _boundary_join(boundary_cutoffs,
+                                              'issues_problem',
+                                              'created',
+                                              'issues_problem.organisation_id',
+                                              'issues_problem',
+                                              boundary_clauses,
+                                              boundary_params,
+                                              join_params,
+                                              group_field=boundary_group_field)
+
+    elif data_type == 'reviews':
+        _create_rollup_review_selects(intervals, data_intervals, select_clauses, select_params)
+
+        join_text = "LEFT JOIN organisations_dailyreviewcount AS rollup ON organisations_organisation.id = rollup.organisation_id"
+
+        if boundary_cutoffs:
+            # We don't want any "replies" to show up in these counts
+            boundary_clauses = ["reviews_display_review.in_reply_to_id IS NULL"]
+            join_text += " " + _boundary_join(boundary_cutoffs,
+                                              'reviews_display_review',
+                                              'api_published',
+                                              'reviews_display_review_organisations.organisation_id',
+                                              """reviews_display_review
+                                                 INNER JOIN reviews_display_review_organisations
+                                                 ON reviews_display_review_organisations.review_id = reviews_display_review.id""",
+                                              boundary_clauses,
+                                              [],
+                                              join_params)
+
+    else:
+        raise ValueError("Unknown data_type: %s" % data_type)
+
+    organisation_filter_clauses = []
+
+    _apply_organisation_filters(organisation_filters,
+                                organisation_filter_clauses,
+                                organisation_id,
+                                tables,
+                                where_params)
+
+    # Having clauses to implement the threshold
+    having_text = ''
+    if threshold is not None:
+        if threshold_interval == 'all_time':
+            having_clause = "COALESCE(SUM(rollup.count), 0)"
+        else:
+            having_clause = _rollup_interval_clause(threshold_interval)
+            having_params.append(utc_day(intervals[threshold_interval]))
+        having_text = "HAVING " + having_clause + " >= %s"
+        having_params.append(threshold_cutoff)
+
+    # Assemble the SQL
+    select_text = "SELECT %s" % ', '.join(select_clauses)
+
+    tables.append("organisations_organisation")
+    from_text = "FROM %s %s" % (", ".join(tables), join_text)
+
+    criteria_text = ''
+    if organisation_filter_clauses:
+        criteria_text = "WHERE %s" % " AND ".join(organisation_filter_clauses)
+
+    group_text = "GROUP BY %s" % ', '.join(group_by_clauses)
+    sort_text = "ORDER BY name, ods_code"
+    query = "%s %s %s %s %s %s" % (select_text,
+                                   from_text,
+                                   criteria_text,
+                                   group_text,
+                                   having_text,
+                                   sort_text)
+
+    params = select_params + join_params + where_params + having_params
+    return query, params
+
+
+# interval_counts query for the problems and reviews tables
+def _live_interval_counts_query(problem_filters,
+                          organisation_filters,
+                          threshold,
+                          extra_organisation_data,
+                          data_intervals,
+                          average_fields,
+                          boolean_fields,
+                          data_type,
+                          group_by_status):
+    intervals = _interval_cutoffs()
+
+    organisation_id = organisation_filters.get('organisation_id')
+
+    params = []
+    tables = []
+
+    select_clauses, group_by_clauses = _create_organisation_selects(extra_organisation_data)
 
     if data_type == 'problems':
         _create_problem_selects(intervals,
@@ -227,6 +955,10 @@ def interval_counts(problem_filters={},
                                 select_clauses,
                                 params)
 
+        if group_by_status:
+            select_clauses.append("""issues_problem.status AS status""")
+            group_by_clauses.append("issues_problem.status")
+
         problem_filter_clauses = ["""organisations_organisation.id = issues_problem.organisation_id"""]
         _apply_problem_filters(problem_filters, problem_filter_clauses, organisation_id, params)
 
@@ -238,7 +970,7 @@ def interval_counts(problem_filters={},
         review_filter_clauses.append("""reviews_display_review.in_reply_to_id IS NULL""")
 
     else:
-        raise "Unknown data_type: %s" % data_type
+        raise ValueError("Unknown data_type: %s" % data_type)
 
     organisation_filter_clauses = []
 
@@ -256,12 +988,7 @@ def interval_counts(problem_filters={},
         else:
             table = 'reviews_display_review'
 
-        if organisation_id:
-            raise NotImplementedError("Threshold is not implemented for a single organisation")
-        interval, cutoff = threshold
-        allowed_intervals = intervals.keys() + ['all_time']
-        if interval not in allowed_intervals:
-            raise NotImplementedError("Threshold can only be set on the value of one of: %s" % allowed_intervals)
+        interval, cutoff = _check_threshold(threshold, organisation_id, intervals)
 
         if interval == 'all_time':
             having_clause = "count(" + table + ".id)"
@@ -300,11 +1027,4 @@ def interval_counts(problem_filters={},
                                    having_text,
                                    sort_text)
 
-    cursor.execute(query, params)
-    desc = cursor.description
-    # Return a list of dictionaries
-    counts = [dict(zip([col[0] for col in desc], row)) for row in cursor.fetchall()]
-    # Or for a single organisation, just one
-    if organisation_id:
-        counts = counts[0]
-    return counts
+    return query, params
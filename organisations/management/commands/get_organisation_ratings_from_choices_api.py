@@ -1,19 +1,42 @@
+from optparse import make_option
+
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
 from ...choices_api import ChoicesAPI
+from ...lib import RECOMMENDATION_RATING_QUESTION
 from ...models import Organisation
 
 
 class Command(BaseCommand):
     help = 'Load organisations from the Choices API'
 
+    # Ratings are normally calculated from the reviews we already have, by
+    # refresh_recommendation_ratings, so this is only needed to keep the
+    # ratings of the organisations that don't have any rated reviews up to
+    # date, or to check the two agree.
+    option_list = BaseCommand.option_list + (
+        make_option('--missing-only',
+            action='store_true',
+            dest='missing_only',
+            default=False,
+            help='Only get ratings for organisations which have no rated reviews to calculate one from'),
+        )
+
     @transaction.commit_manually
     def handle(self, *args, **options):
         verbosity = int(options.get('verbosity'))
 
         api = ChoicesAPI()
-        for organisation in Organisation.objects.all():
+        organisations = Organisation.objects.all()
+        if options.get('missing_only'):
+            # Everything with a rated review has its rating calculated from
+            # them, but the others' ratings have to come from the API, and
+            # would go stale if we only filled in the missing ones
+            rated = Organisation.objects.filter(reviews__in_reply_to__isnull=True,
+                                                reviews__ratings__question=RECOMMENDATION_RATING_QUESTION)
+            organisations = organisations.exclude(id__in=rated.values('id'))
+        for organisation in organisations:
             try:
                 rating = api.get_organisation_recommendation_rating(organisation_type=organisation.organisation_type,
                                                                     choices_id=organisation.choices_id)
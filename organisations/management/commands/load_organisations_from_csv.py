@@ -1,14 +1,23 @@
 import csv
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
 from optparse import make_option
+import time
 import urllib
 import os
 
-from django.db import transaction
-from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand, CommandError
 from django.core.files import File
 from django.contrib.gis.geos import Point
 
-from ...models import Organisation, Service, OrganisationParent
+from ...map_tiles import invalidate_map_tiles
+from ...metaphone import dm
+from ...models import (Organisation,
+                       Service,
+                       OrganisationParent,
+                       OrganisationSearchToken,
+                       name_search_metaphones)
 
 
 class Command(BaseCommand):
@@ -27,16 +36,53 @@ class Command(BaseCommand):
             dest='update',
             default=False,
             help='Update existing organisation and service attributes'),
+        ) + (
+        make_option('--bulk',
+            action='store_true',
+            dest='bulk',
+            default=False,
+            help='Load the whole file with a few set-based queries instead of row by row, in a single transaction'),
+        ) + (
+        make_option('--image-threads',
+            action='store',
+            dest='image_threads',
+            type='int',
+            default=4,
+            help='How many images to download at once in bulk mode'),
         )
 
+    type_mappings = {
+        'HOS': 'hospitals',
+        'GPB': 'gppractices',
+        'CLI': 'clinics',
+    }
+
+    # The columns of the temporary tables the bulk mode loads the file into
+    organisation_load_columns = ('rownum', 'ods_code', 'choices_id', 'name',
+                                 'name_metaphone', 'organisation_type',
+                                 'point', 'address_line1', 'address_line2',
+                                 'address_line3', 'city', 'county',
+                                 'postcode', 'parent_id')
+    service_load_columns = ('rownum', 'ods_code', 'service_code', 'name')
+
+    # How many rows to send to the database at once in bulk mode
+    batch_size = 10000
+
     def clean_value(self, value):
         if value == 'NULL':
             return ''
         else:
             return value
 
-    @transaction.commit_manually
     def handle(self, *args, **options):
+        if options.get('bulk'):
+            self.handle_bulk(*args, **options)
+        else:
+            self.handle_rows(*args, **options)
+
+    @transaction.commit_manually
+    def handle_rows(self, *args, **options):
+        started = time.time()
         filename = args[0]
         reader = csv.DictReader(open(filename), delimiter=',', quotechar='"')
         rownum = 0
@@ -54,11 +100,7 @@ class Command(BaseCommand):
             processed = 0
             skipped = 0
 
-        type_mappings = {
-            'HOS': 'hospitals',
-            'GPB': 'gppractices',
-            'CLI': 'clinics',
-        }
+        type_mappings = self.type_mappings
 
         for row in reader:
             rownum += 1
@@ -189,3 +231,311 @@ class Command(BaseCommand):
             self.stdout.write("Total records in file: {0}\n".format(rownum))
             self.stdout.write("Processed {0} records\n".format(processed))
             self.stdout.write("Skipped {0} records\n".format(skipped))
+            self.write_throughput("Read", "records", rownum, started)
+
+    def write_throughput(self, action, things, count, started):
+        elapsed = time.time() - started
+        rate = count / elapsed if elapsed else 0
+        self.stdout.write("{0} {1} {2} in {3:.1f}s ({4:.1f} {2}/s)\n".format(action, count, things, elapsed, rate))
+
+    def copy_value(self, value):
+        """Escape a value for COPY's text format"""
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def copy_batch(self, cursor, batch, table, columns):
+        batch.seek(0)
+        cursor.copy_from(batch, table, columns=columns)
+
+    def handle_bulk(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Please give the path to an organisations CSV file")
+        filename = args[0]
+        verbosity = int(options.get('verbosity'))
+        started = time.time()
+
+        rownum, images = self.bulk_load(filename, options)
+        if verbosity >= 1:
+            self.write_throughput("Loaded", "records", rownum, started)
+
+        # Images are downloaded after the data has been committed, so that a
+        # slow or broken image host doesn't hold up (or roll back) the load
+        if images:
+            started = time.time()
+            fetched = self.fetch_images(images, max(int(options.get('image_threads') or 1), 1))
+            if verbosity >= 1:
+                self.write_throughput("Fetched", "images", fetched, started)
+
+    @transaction.commit_on_success
+    def bulk_load(self, filename, options):
+        """Load the whole file into temporary tables with COPY, and merge
+        those into the organisations and services with a handful of queries.
+        Returns how many rows were read, and a dict of the image url to fetch
+        for each ods code."""
+        reader = csv.DictReader(open(filename), delimiter=',', quotechar='"')
+        verbosity = int(options.get('verbosity'))
+
+        if options['clean']:
+            if verbosity >= 2:
+                self.stdout.write("Deleting existing organisations and services\n")
+            Service.objects.all().delete()
+            Organisation.objects.all().delete()
+
+        # Look up every parent once, rather than once per row
+        parent_ids = dict(OrganisationParent.objects.values_list('code', 'id'))
+
+        cursor = connection.cursor()
+        cursor.execute("""CREATE TEMPORARY TABLE organisation_load (
+                              rownum integer,
+                              ods_code varchar(12),
+                              choices_id integer,
+                              name text,
+                              name_metaphone text,
+                              organisation_type varchar(100),
+                              point geometry,
+                              address_line1 varchar(255),
+                              address_line2 varchar(255),
+                              address_line3 varchar(255),
+                              city varchar(50),
+                              county varchar(50),
+                              postcode varchar(10),
+                              parent_id integer
+                          ) ON COMMIT DROP""")
+        cursor.execute("""CREATE TEMPORARY TABLE service_load (
+                              rownum integer,
+                              ods_code varchar(12),
+                              service_code text,
+                              name text
+                          ) ON COMMIT DROP""")
+
+        rownum = 0
+        skipped = 0
+        images = {}
+        organisations = StringIO()
+        services = StringIO()
+        batch_rows = 0
+        for row in reader:
+            rownum += 1
+
+            for key, val in row.items():
+                row[key] = self.clean_value(val)
+
+            try:
+                # Remember to update the docs in documentation/csv_formats.md if you make changes here
+                choices_id = row['ChoicesID']
+                ods_code = row['OrganisationCode']
+                name = row['OrganisationName']
+                organisation_type_text = row['OrganisationTypeID']
+                trust_code = row['ParentCode']
+                address_line1 = row['Address1']
+                address_line2 = row['Address2']
+                address_line3 = row['Address3']
+                city = row['City']
+                county = row['County']
+                postcode = row['Postcode']
+                lat = row['Latitude']
+                lon = row['Longitude']
+                service_code = row['ServiceCode']
+                service_name = row['ServiceName']
+                image = row['Image']
+            except KeyError as message:
+                raise CommandError("Missing column with the heading '{0}'".format(message))
+
+            # Skip blank lines
+            if not choices_id:
+                continue
+
+            if trust_code not in parent_ids:
+                raise CommandError(
+                    "Could not find Organisation Parent with code '{0}' on line {1}".format(
+                        trust_code, rownum
+                    )
+                )
+
+            if organisation_type_text not in self.type_mappings:
+                if verbosity >= 2:
+                    self.stdout.write("Unknown organisation type {0}, skipping\n".format(organisation_type_text))
+                continue
+            organisation_type = self.type_mappings[organisation_type_text]
+
+            try:
+                point = "SRID=4326;POINT({0} {1})".format(float(lon), float(lat))
+                int(choices_id)
+            except ValueError as e:
+                skipped += 1
+                self.stderr.write("Skipping %s %s (%s): %s\n" % (name, organisation_type, ods_code, e))
+                continue
+
+            if isinstance(name, unicode):
+                unicode_name = name
+            else:
+                unicode_name = unicode(name, encoding='utf-8', errors='ignore')
+            name_metaphone = dm(unicode_name)[0]
+
+            values = (str(rownum), ods_code, choices_id, name,
+                      name_metaphone.encode('utf-8'), organisation_type,
+                      point, address_line1, address_line2, address_line3,
+                      city, county, postcode, str(parent_ids[trust_code]))
+            organisations.write("\t".join(self.copy_value(value) for value in values) + "\n")
+
+            if service_name:
+                values = (str(rownum), ods_code, service_code, service_name)
+                services.write("\t".join(self.copy_value(value) for value in values) + "\n")
+
+            if image:
+                images[ods_code] = image
+
+            batch_rows += 1
+            if batch_rows >= self.batch_size:
+                self.copy_batch(cursor, organisations, 'organisation_load', self.organisation_load_columns)
+                self.copy_batch(cursor, services, 'service_load', self.service_load_columns)
+                organisations = StringIO()
+                services = StringIO()
+                batch_rows = 0
+
+        if batch_rows:
+            self.copy_batch(cursor, organisations, 'organisation_load', self.organisation_load_columns)
+            self.copy_batch(cursor, services, 'service_load', self.service_load_columns)
+
+        # Organisations appear once per service in the file. New ones are
+        # created from their first row, existing ones are updated from their
+        # last, as they would be loading the file row by row.
+        updated = 0
+        if options['update']:
+            cursor.execute("""UPDATE organisations_organisation
+                              SET modified = now(),
+                                  choices_id = l.choices_id,
+                                  name = l.name,
+                                  name_metaphone = l.name_metaphone,
+                                  organisation_type = l.organisation_type,
+                                  point = l.point,
+                                  address_line1 = l.address_line1,
+                                  address_line2 = l.address_line2,
+                                  address_line3 = l.address_line3,
+                                  city = l.city,
+                                  county = l.county,
+                                  postcode = l.postcode,
+                                  parent_id = l.parent_id
+                              FROM (SELECT DISTINCT ON (ods_code) *
+                                    FROM organisation_load
+                                    ORDER BY ods_code, rownum DESC) l
+                              WHERE organisations_organisation.ods_code = l.ods_code""")
+            updated = cursor.rowcount
+        cursor.execute("""INSERT INTO organisations_organisation (
+                              created, modified, choices_id, ods_code, name,
+                              name_metaphone, organisation_type, point,
+                              address_line1, address_line2, address_line3,
+                              city, county, postcode, parent_id, image,
+                              map_thumbnail
+                          )
+                          SELECT DISTINCT ON (l.ods_code)
+                              now(), now(), l.choices_id, l.ods_code, l.name,
+                              l.name_metaphone, l.organisation_type, l.point,
+                              l.address_line1, l.address_line2, l.address_line3,
+                              l.city, l.county, l.postcode, l.parent_id, '', ''
+                          FROM organisation_load l
+                          WHERE NOT EXISTS (SELECT 1
+                                            FROM organisations_organisation
+                                            WHERE organisations_organisation.ods_code = l.ods_code)
+                          ORDER BY l.ods_code, l.rownum""")
+        created = cursor.rowcount
+
+        # Only hospitals and clinics have services
+        services_updated = 0
+        if options['update']:
+            cursor.execute("""UPDATE organisations_service
+                              SET modified = now(), name = s.name
+                              FROM (SELECT DISTINCT ON (ods_code, service_code) *
+                                    FROM service_load
+                                    ORDER BY ods_code, service_code, rownum DESC) s,
+                                   organisations_organisation o
+                              WHERE o.ods_code = s.ods_code
+                              AND organisations_service.organisation_id = o.id
+                              AND organisations_service.service_code = s.service_code
+                              AND o.organisation_type IN ('hospitals', 'clinics')""")
+            services_updated = cursor.rowcount
+        cursor.execute("""INSERT INTO organisations_service (created, modified, name, service_code, organisation_id)
+                          SELECT DISTINCT ON (o.id, s.service_code)
+                              now(), now(), s.name, s.service_code, o.id
+                          FROM service_load s
+                          JOIN organisations_organisation o ON o.ods_code = s.ods_code
+                          WHERE o.organisation_type IN ('hospitals', 'clinics')
+                          AND NOT EXISTS (SELECT 1
+                                          FROM organisations_service
+                                          WHERE organisations_service.organisation_id = o.id
+                                          AND organisations_service.service_code = s.service_code)
+                          ORDER BY o.id, s.service_code, s.rownum""")
+        services_created = cursor.rowcount
+
+        # Organisation.save() would normally keep these up to date
+        cursor.execute("""SELECT id, name
+                          FROM organisations_organisation
+                          WHERE ods_code IN (SELECT ods_code FROM organisation_load)""")
+        loaded_organisations = cursor.fetchall()
+        cursor.execute("""DELETE FROM organisations_organisationsearchtoken
+                          WHERE organisation_id IN (SELECT o.id
+                                                    FROM organisations_organisation o
+                                                    JOIN organisation_load l ON l.ods_code = o.ods_code)""")
+        tokens = []
+        for organisation_id, name in loaded_organisations:
+            for metaphone in name_search_metaphones(name):
+                tokens.append(OrganisationSearchToken(organisation_id=organisation_id, metaphone=metaphone))
+        for start in range(0, len(tokens), 1000):
+            OrganisationSearchToken.objects.bulk_create(tokens[start:start + 1000])
+        invalidate_map_tiles()
+
+        if verbosity >= 1:
+            self.stdout.write("Created {0} organisations and {1} services\n".format(created, services_created))
+            if options['update']:
+                self.stdout.write("Updated {0} organisations and {1} services\n".format(updated, services_updated))
+        if skipped:
+            self.stderr.write("Skipped {0} records\n".format(skipped))
+
+        return rownum, images
+
+    def download_image(self, image):
+        """Download an image, returning the url and the path of the
+        downloaded file, or the exception if it couldn't be fetched. This runs
+        in fetch_images' pool, so it mustn't touch the database."""
+        try:
+            (temp_image_file, headers) = urllib.urlretrieve(image)
+            return image, temp_image_file, None
+        except Exception as e:
+            return image, None, e
+
+    def fetch_images(self, images, threads):
+        """Download images, a dict of ods code to image url, several at a
+        time, and save each one to its organisation as it arrives. Returns how
+        many were saved."""
+        ods_codes_by_image = {}
+        for ods_code, image in images.items():
+            ods_codes_by_image.setdefault(image, []).append(ods_code)
+
+        fetched = 0
+        pool = ThreadPool(threads)
+        try:
+            for image, temp_image_file, error in pool.imap_unordered(self.download_image, ods_codes_by_image.keys()):
+                for ods_code in ods_codes_by_image[image]:
+                    if error is None:
+                        try:
+                            self.save_image(ods_code, image, temp_image_file)
+                            fetched += 1
+                            continue
+                        except Exception as e:
+                            error = e
+                    # On any exception, just ignore the image
+                    self.stderr.write("Skipping image for %s: %s\n" % (ods_code, error))
+                if temp_image_file and os.path.exists(temp_image_file):
+                    os.remove(temp_image_file)
+        finally:
+            pool.terminate()
+        return fetched
+
+    @transaction.commit_on_success
+    def save_image(self, ods_code, image, temp_image_file):
+        organisation = Organisation.objects.get(ods_code=ods_code)
+        # Saving the image saves the organisation, which makes its map
+        # thumbnail
+        organisation.image.save(
+            os.path.basename(image),
+            File(open(temp_image_file))
+        )
@@ -0,0 +1,103 @@
+import csv
+from cStringIO import StringIO
+
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Postcode
+
+
+class Command(BaseCommand):
+    args = '<csv_file>'
+    help = 'Load postcode locations from the ONS Postcode Directory'
+
+    # How many rows to send to the database at once
+    batch_size = 50000
+
+    # The ONSPD uses this latitude for postcodes it has no location for
+    NO_LOCATION_LATITUDE = 99.999999
+
+    @transaction.commit_on_success
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Please give the path to an ONS Postcode Directory CSV file")
+        filename = args[0]
+        reader = csv.DictReader(open(filename), delimiter=',', quotechar='"')
+        verbosity = int(options.get('verbosity'))
+
+        cursor = connection.cursor()
+        # Load everything into a temporary table with COPY first, which is
+        # much quicker than inserting postcodes one at a time, and then
+        # merge that into the real table with a couple of queries
+        cursor.execute("""CREATE TEMPORARY TABLE postcode_load (
+                              postcode varchar(8),
+                              point geometry
+                          ) ON COMMIT DROP""")
+
+        loaded = 0
+        skipped = 0
+        batch = StringIO()
+        batch_rows = 0
+        for row in reader:
+            try:
+                # Remember to update the docs in documentation/csv_formats.md if you make changes here
+                postcode = Postcode.normalise(row['pcd'])
+                terminated = row['doterm'].strip()
+                lat = row['lat'].strip()
+                lon = row['long'].strip()
+            except KeyError as message:
+                raise CommandError("Missing column with the heading '{0}'".format(message))
+
+            # Skip postcodes which aren't used any more
+            if terminated or not postcode:
+                skipped += 1
+                continue
+
+            if lat and lon and float(lat) != self.NO_LOCATION_LATITUDE:
+                point = "SRID=4326;POINT({0} {1})".format(float(lon), float(lat))
+            else:
+                point = "\\N"
+            batch.write("{0}\t{1}\n".format(postcode, point))
+            batch_rows += 1
+            loaded += 1
+
+            if batch_rows >= self.batch_size:
+                self.copy_batch(cursor, batch)
+                batch = StringIO()
+                batch_rows = 0
+
+        if batch_rows:
+            self.copy_batch(cursor, batch)
+
+        # Postcodes in the file replace any we already have
+        cursor.execute("""UPDATE organisations_postcode
+                          SET point = postcode_load.point, partial = false
+                          FROM postcode_load
+                          WHERE organisations_postcode.postcode = postcode_load.postcode""")
+        cursor.execute("""INSERT INTO organisations_postcode (postcode, point, partial)
+                          SELECT DISTINCT ON (postcode_load.postcode) postcode_load.postcode, postcode_load.point, false
+                          FROM postcode_load
+                          WHERE NOT EXISTS (SELECT 1
+                                            FROM organisations_postcode
+                                            WHERE organisations_postcode.postcode = postcode_load.postcode)""")
+
+        # Work out the centre of every postcode district (the outward code,
+        # which is everything but the last three characters of a postcode)
+        # for partial postcode searches
+        cursor.execute("DELETE FROM organisations_postcode WHERE partial")
+        cursor.execute("""INSERT INTO organisations_postcode (postcode, point, partial)
+                          SELECT left(postcode, length(postcode) - 3), ST_Centroid(ST_Collect(point)), true
+                          FROM organisations_postcode
+                          WHERE NOT partial
+                          AND point IS NOT NULL
+                          GROUP BY left(postcode, length(postcode) - 3)""")
+        districts = cursor.rowcount
+
+        if verbosity >= 1:
+            self.stdout.write("Loaded {0} postcodes and {1} postcode districts\n".format(loaded, districts))
+        if verbosity >= 2:
+            self.stdout.write("Skipped {0} terminated postcodes\n".format(skipped))
+
+    def copy_batch(self, cursor, batch):
+        batch.seek(0)
+        cursor.copy_from(batch, 'postcode_load', columns=('postcode', 'point'))
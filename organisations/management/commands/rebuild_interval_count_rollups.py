@@ -0,0 +1,20 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from ...lib import refresh_problem_counts, refresh_review_counts
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuild the daily problem and review counts that interval_counts uses from scratch'
+
+    @transaction.commit_on_success
+    def handle_noargs(self, *args, **options):
+        verbosity = int(options.get('verbosity'))
+
+        refresh_problem_counts()
+        if verbosity >= 1:
+            self.stdout.write("Rebuilt daily problem counts\n")
+
+        refresh_review_counts()
+        if verbosity >= 1:
+            self.stdout.write("Rebuilt daily review counts\n")
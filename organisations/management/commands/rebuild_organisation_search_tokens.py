@@ -0,0 +1,23 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from ...models import Organisation, OrganisationSearchToken, name_search_metaphones
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuild the search tokens that organisation name searches use from scratch'
+
+    @transaction.commit_on_success
+    def handle_noargs(self, *args, **options):
+        verbosity = int(options.get('verbosity'))
+
+        OrganisationSearchToken.objects.all().delete()
+        tokens = []
+        for organisation_id, name in Organisation.objects.values_list('id', 'name'):
+            for metaphone in name_search_metaphones(name):
+                tokens.append(OrganisationSearchToken(organisation_id=organisation_id, metaphone=metaphone))
+        for start in range(0, len(tokens), 1000):
+            OrganisationSearchToken.objects.bulk_create(tokens[start:start + 1000])
+
+        if verbosity >= 1:
+            self.stdout.write("Rebuilt {0} organisation search tokens\n".format(len(tokens)))
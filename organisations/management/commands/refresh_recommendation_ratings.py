@@ -0,0 +1,20 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from ...lib import refresh_recommendation_ratings
+from ...map_tiles import invalidate_map_tiles
+
+
+class Command(NoArgsCommand):
+    help = "Recalculate every organisation's average recommendation rating from the reviews we have"
+
+    @transaction.commit_on_success
+    def handle_noargs(self, *args, **options):
+        verbosity = int(options.get('verbosity'))
+
+        changed = refresh_recommendation_ratings()
+        # The map shows the ratings
+        invalidate_map_tiles()
+
+        if verbosity >= 1:
+            self.stdout.write("Updated the rating of {0} organisations\n".format(len(changed)))
@@ -0,0 +1,154 @@
+import hashlib
+import math
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.contrib.gis.geos import Polygon
+
+from citizenconnect.transaction_hooks import on_commit
+
+# The map tiles we serve use the same z/x/y "slippy map" scheme as the
+# OpenStreetMap tiles the map is drawn on, so that the map javascript can ask
+# for the data for each tile it shows.
+MIN_ZOOM = 0
+MAX_ZOOM = 18
+
+# The furthest north or south a web mercator map goes
+MAX_LATITUDE = 85.0511287798
+
+# At zoom levels below settings.MAP_TILE_CLUSTER_ZOOM, organisations are grouped into
+# clusters on the server. Each tile is split into a grid of
+# 2 ** CLUSTER_GRID_LEVELS cells on each side, and the organisations in each
+# cell are clustered together.
+CLUSTER_GRID_LEVELS = 2
+
+# Keys in the cache
+TILE_GENERATION_KEY = 'map-tile-generation'
+TILE_VERSION_KEY = 'map-tile-version:{0}:{1}:{2}'
+TILE_KEY = 'map-tile:{0}:{1}:{2}:{3}:{4}:{5}'
+
+
+def tile_for_point(lon, lat, zoom):
+    """Return the (x, y) of the tile containing a point at the given zoom"""
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    lat_radians = math.radians(lat)
+    y = int((1.0 - math.log(math.tan(lat_radians) + 1.0 / math.cos(lat_radians)) / math.pi) / 2.0 * n)
+    # Points on the far east or south edges belong to the last tile
+    return (max(min(x, n - 1), 0), max(min(y, n - 1), 0))
+
+
+def tile_bounds(zoom, x, y):
+    """Return the (west, south, east, north) bounds of a tile"""
+    n = 2.0 ** zoom
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return (west, south, east, north)
+
+
+def tile_polygon(zoom, x, y):
+    """Return a Polygon covering a tile, for use in geo queries"""
+    return Polygon.from_bbox(tile_bounds(zoom, x, y))
+
+
+def is_valid_tile(zoom, x, y):
+    return MIN_ZOOM <= zoom <= MAX_ZOOM and 0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom
+
+
+def tile_cache_key(zoom, x, y, filters):
+    """Return the key that the data for a tile, with the given dictionary of
+    filters applied, is cached under.
+
+    The key includes the current version of the tile, which changes whenever
+    the data of an organisation inside it does, so stale tiles are never
+    looked up again and just fall out of the cache."""
+    version_key = TILE_VERSION_KEY.format(zoom, x, y)
+    versions = cache.get_many([TILE_GENERATION_KEY, version_key])
+    filters_hash = hashlib.md5(repr(sorted(filters.items()))).hexdigest()
+    return TILE_KEY.format(versions.get(TILE_GENERATION_KEY, 0),
+                           zoom,
+                           x,
+                           y,
+                           versions.get(version_key, 0),
+                           filters_hash)
+
+
+def invalidate_map_tiles_at(points):
+    """Invalidate the cached tiles containing any of the given (lon, lat)
+    points, at every zoom level, once the current transaction commits.
+
+    It has to wait until then, otherwise a tile requested in the meantime
+    would be built from the old data and cached under the new version."""
+    version_keys = set()
+    for lon, lat in points:
+        for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+            x, y = tile_for_point(lon, lat, zoom)
+            version_keys.add(TILE_VERSION_KEY.format(zoom, x, y))
+    if not version_keys:
+        return
+
+    def bump_versions():
+        # Versions (and generations) only need to last as long as a tile can
+        # be cached for, because any tile cached under an older version will
+        # have expired by the time they do.
+        version = uuid.uuid4().hex
+        cache.set_many(dict((key, version) for key in version_keys), settings.MAP_TILE_CACHE_SECONDS)
+    on_commit(bump_versions)
+
+
+def invalidate_map_tiles(organisation_ids=None):
+    """Invalidate the cached tiles containing the given organisations, once
+    the current transaction commits. Passing None for organisation_ids
+    invalidates every tile."""
+    if organisation_ids is None:
+        on_commit(lambda: cache.set(TILE_GENERATION_KEY, uuid.uuid4().hex, settings.MAP_TILE_CACHE_SECONDS))
+        return
+    organisation_ids = tuple(set(organisation_ids))
+    if not organisation_ids:
+        return
+    cursor = connection.cursor()
+    cursor.execute("""SELECT ST_X(point), ST_Y(point)
+                      FROM organisations_organisation
+                      WHERE id IN %s""", [organisation_ids])
+    invalidate_map_tiles_at(cursor.fetchall())
+
+
+def cluster_organisations(organisations_data, zoom):
+    """Group a list of organisation data dictionaries (as returned by
+    combined_interval_counts with 'coords' in its extra_organisation_data)
+    that are close to each other at the given zoom level.
+
+    Returns a tuple of (organisations, clusters), where organisations is a
+    list of the organisations that are on their own, and clusters is a list
+    of dictionaries summarising each group of organisations."""
+    cells = {}
+    for org_data in organisations_data:
+        cell = tile_for_point(org_data['lon'], org_data['lat'], zoom + CLUSTER_GRID_LEVELS)
+        cells.setdefault(cell, []).append(org_data)
+
+    organisations = []
+    clusters = []
+    for cell in sorted(cells.keys()):
+        members = cells[cell]
+        if len(members) == 1:
+            organisations.append(members[0])
+            continue
+        count = len(members)
+        clusters.append({
+            'count': count,
+            'lon': sum(member['lon'] for member in members) / count,
+            'lat': sum(member['lat'] for member in members) / count,
+            'bounds': [min(member['lon'] for member in members),
+                       min(member['lat'] for member in members),
+                       max(member['lon'] for member in members),
+                       max(member['lat'] for member in members)],
+            'all_time_open': sum(member['all_time_open'] for member in members),
+            'all_time_closed': sum(member['all_time_closed'] for member in members),
+            'reviews_all_time': sum(member['reviews_all_time'] for member in members),
+        })
+    return organisations, clusters
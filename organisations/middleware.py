@@ -1,13 +1,100 @@
+import atexit
+import logging
+logger = logging.getLogger(__name__)
+import threading
+from datetime import datetime
+from itertools import chain
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import utc
+
 import auth
 from .auth import user_in_group
 from .models import SuperuserLogEntry
 
 
+class SuperuserLogBuffer(object):
+    """
+    Collects the pages NHS Superusers access, and writes them to the database
+    as :model:`organisations.SuperuserLogEntry`s in bulk from a background
+    thread, so that logging them doesn't slow down the pages themselves.
+
+    Entries are written every settings.SUPERUSER_LOG_FLUSH_SECONDS, or as soon
+    as settings.SUPERUSER_LOG_FLUSH_SIZE of them have been collected, and
+    whatever's left is written when the process exits.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def add(self, user, path):
+        # Remember when the page was accessed, rather than when it's written
+        now = datetime.utcnow().replace(tzinfo=utc)
+        with self.lock:
+            self.entries.append((now, now, user.id, path))
+            full = len(self.entries) >= settings.SUPERUSER_LOG_FLUSH_SIZE
+        self.ensure_running()
+        if full:
+            self.wakeup.set()
+
+    def ensure_running(self):
+        """Start the background thread, if it isn't already going (or we've
+        been forked since it was)"""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='superuser-log-writer')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(settings.SUPERUSER_LOG_FLUSH_SECONDS)
+            self.wakeup.clear()
+            self.flush()
+            # Don't hold on to a database connection between flushes
+            connection.close()
+
+    def flush(self):
+        """Write out all the entries collected so far"""
+        with self.lock:
+            entries, self.entries = self.entries, []
+        if not entries:
+            return
+        try:
+            self.write(entries)
+        except Exception:
+            logger.exception("Error writing {0} superuser log entries, will try again".format(len(entries)))
+            with self.lock:
+                self.entries[:0] = entries
+
+    @transaction.commit_on_success
+    def write(self, entries):
+        """Insert entries, a list of (created, modified, user_id, path)
+        tuples, with a single query"""
+        values = ", ".join(["(%s, %s, %s, %s)"] * len(entries))
+        cursor = connection.cursor()
+        cursor.execute("""INSERT INTO organisations_superuserlogentry (created, modified, user_id, path)
+                          VALUES {0}""".format(values),
+                       list(chain.from_iterable(entries)))
+
+
+superuser_log_buffer = SuperuserLogBuffer()
+atexit.register(superuser_log_buffer.flush)
+
+
 class SuperuserLogEntryMiddleware(object):
     def process_response(self, request, response):
         # Log accesses to pages by NHS Superusers
         if getattr(request, 'user', False):
             if user_in_group(request.user, auth.NHS_SUPERUSERS):
-                log_entry = SuperuserLogEntry(user=request.user, path=request.path)
-                log_entry.save()
+                if settings.SUPERUSER_LOG_FLUSH_SECONDS:
+                    superuser_log_buffer.add(request.user, request.path)
+                else:
+                    # Buffering is turned off, so write it straight away
+                    log_entry = SuperuserLogEntry(user=request.user, path=request.path)
+                    log_entry.save()
         return response
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'DailyProblemCount'
+        db.create_table('organisations_dailyproblemcount', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('organisation', self.gf('django.db.models.fields.related.ForeignKey')(related_name='daily_problem_counts', to=orm['organisations.Organisation'])),
+            ('date', self.gf('django.db.models.fields.DateField')(db_index=True)),
+            ('status', self.gf('django.db.models.fields.IntegerField')()),
+            ('publication_status', self.gf('django.db.models.fields.IntegerField')()),
+            ('category', self.gf('django.db.models.fields.CharField')(max_length=100)),
+            ('service', self.gf('django.db.models.fields.related.ForeignKey')(related_name='daily_problem_counts', null=True, to=orm['organisations.Service'])),
+            ('breach', self.gf('django.db.models.fields.BooleanField')(default=False)),
+            ('formal_complaint', self.gf('django.db.models.fields.BooleanField')(default=False)),
+            ('count', self.gf('django.db.models.fields.IntegerField')()),
+            ('time_to_acknowledge_total', self.gf('django.db.models.fields.IntegerField')()),
+            ('time_to_acknowledge_count', self.gf('django.db.models.fields.IntegerField')()),
+            ('time_to_address_total', self.gf('django.db.models.fields.IntegerField')()),
+            ('time_to_address_count', self.gf('django.db.models.fields.IntegerField')()),
+            ('happy_service_true', self.gf('django.db.models.fields.IntegerField')()),
+            ('happy_service_count', self.gf('django.db.models.fields.IntegerField')()),
+            ('happy_outcome_true', self.gf('django.db.models.fields.IntegerField')()),
+            ('happy_outcome_count', self.gf('django.db.models.fields.IntegerField')()),
+        ))
+        db.send_create_signal('organisations', ['DailyProblemCount'])
+
+        # Adding model 'DailyReviewCount'
+        db.create_table('organisations_dailyreviewcount', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('organisation', self.gf('django.db.models.fields.related.ForeignKey')(related_name='daily_review_counts', to=orm['organisations.Organisation'])),
+            ('date', self.gf('django.db.models.fields.DateField')(db_index=True)),
+            ('count', self.gf('django.db.models.fields.IntegerField')()),
+        ))
+        db.send_create_signal('organisations', ['DailyReviewCount'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'DailyReviewCount'
+        db.delete_table('organisations_dailyreviewcount')
+
+        # Deleting model 'DailyProblemCount'
+        db.delete_table('organisations_dailyproblemcount')
+
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'organisations.ccg': {
+            'Meta': {'object_name': 'CCG'},
+            'code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '8', 'db_index': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '254'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'intro_email_sent': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {}),
+            'users': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'ccgs'", 'symmetrical': 'False', 'to': "orm['auth.User']"})
+        },
+        'organisations.dailyproblemcount': {
+            'Meta': {'object_name': 'DailyProblemCount'},
+            'breach': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'category': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'count': ('django.db.models.fields.IntegerField', [], {}),
+            'date': ('django.db.models.fields.DateField', [], {'db_index': 'True'}),
+            'formal_complaint': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'happy_outcome_count': ('django.db.models.fields.IntegerField', [], {}),
+            'happy_outcome_true': ('django.db.models.fields.IntegerField', [], {}),
+            'happy_service_count': ('django.db.models.fields.IntegerField', [], {}),
+            'happy_service_true': ('django.db.models.fields.IntegerField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'organisation': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'daily_problem_counts'", 'to': "orm['organisations.Organisation']"}),
+            'publication_status': ('django.db.models.fields.IntegerField', [], {}),
+            'service': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'daily_problem_counts'", 'null': 'True', 'to': "orm['organisations.Service']"}),
+            'status': ('django.db.models.fields.IntegerField', [], {}),
+            'time_to_acknowledge_count': ('django.db.models.fields.IntegerField', [], {}),
+            'time_to_acknowledge_total': ('django.db.models.fields.IntegerField', [], {}),
+            'time_to_address_count': ('django.db.models.fields.IntegerField', [], {}),
+            'time_to_address_total': ('django.db.models.fields.IntegerField', [], {})
+        },
+        'organisations.dailyreviewcount': {
+            'Meta': {'object_name': 'DailyReviewCount'},
+            'count': ('django.db.models.fields.IntegerField', [], {}),
+            'date': ('django.db.models.fields.DateField', [], {'db_index': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'organisation': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'daily_review_counts'", 'to': "orm['organisations.Organisation']"})
+        },
+        'organisations.friendsandfamilysurvey': {
+            'Meta': {'ordering': "['-date']", 'unique_together': "(('content_type', 'object_id', 'date', 'location'),)", 'object_name': 'FriendsAndFamilySurvey'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date': ('django.db.models.fields.DateField', [], {'db_index': 'True'}),
+            'dont_know': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'extremely_likely': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'extremely_unlikely': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'likely': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'location': ('django.db.models.fields.CharField', [], {'max_length': '100', 'db_index': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'neither': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'overall_score': ('django.db.models.fields.IntegerField', [], {}),
+            'unlikely': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        'organisations.organisation': {
+            'Meta': {'object_name': 'Organisation'},
+            'address_line1': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'address_line2': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'address_line3': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'average_recommendation_rating': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'choices_id': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'city': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'county': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('sorl.thumbnail.fields.ImageField', [], {'max_length': '100', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {'db_index': 'True'}),
+            'name_metaphone': ('django.db.models.fields.TextField', [], {}),
+            'ods_code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '12', 'db_index': 'True'}),
+            'organisation_type': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'parent': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'organisations'", 'to': "orm['organisations.OrganisationParent']"}),
+            'point': ('django.contrib.gis.db.models.fields.PointField', [], {}),
+            'postcode': ('django.db.models.fields.CharField', [], {'max_length': '10', 'blank': 'True'})
+        },
+        'organisations.organisationparent': {
+            'Meta': {'object_name': 'OrganisationParent'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'db_index': 'True'}),
+            'ccgs': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'organisation_parents'", 'symmetrical': 'False', 'to': "orm['organisations.CCG']"}),
+            'choices_id': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'code': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '8', 'db_index': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '254'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'intro_email_sent': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {}),
+            'primary_ccg': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'primary_organisation_parents'", 'to': "orm['organisations.CCG']"}),
+            'secondary_email': ('django.db.models.fields.EmailField', [], {'max_length': '254', 'blank': 'True'}),
+            'users': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'organisation_parents'", 'symmetrical': 'False', 'to': "orm['auth.User']"})
+        },
+        'organisations.service': {
+            'Meta': {'unique_together': "(('service_code', 'organisation'),)", 'object_name': 'Service'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.TextField', [], {'db_index': 'True'}),
+            'organisation': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'services'", 'to': "orm['organisations.Organisation']"}),
+            'service_code': ('django.db.models.fields.TextField', [], {'db_index': 'True'})
+        },
+        'organisations.superuserlogentry': {
+            'Meta': {'object_name': 'SuperuserLogEntry'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'path': ('django.db.models.fields.TextField', [], {}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'superuser_access_logs'", 'to': "orm['auth.User']"})
+        }
+    }
+
+    complete_apps = ['organisations']
@@ -22,13 +22,17 @@ class MailSendMixin(models.Model):
     # not.
     intro_email_sent = models.DateTimeField(blank=True, null=True, editable=False)
 
-    def send_mail(self, subject, message, fail_silently=False):
+    def send_mail(self, subject, message, fail_silently=False, connection=None):
         """
         This is very similar to the built in Django function `send_mail` (https://docs.djangoproject.com/en/dev/topics/email/#send-mail)
 
         It takes the following arguments which are passed through to mail.send_mail:
 
-            subject, message, fail_silently=False
+            subject, message, fail_silently=False, connection=None
+
+        Passing in an open mail connection (from django.core.mail.get_connection)
+        lets you send lots of emails without connecting to the mail server
+        for each one.
 
         It will auto fill the following arguments:
 
@@ -55,6 +59,7 @@ class MailSendMixin(models.Model):
             fail_silently=fail_silently,
             from_email=settings.DEFAULT_FROM_EMAIL,
             recipient_list=filter(bool, recipient_list),
+            connection=connection,
         )
 
         if not len(kwargs['recipient_list']):
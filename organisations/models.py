@@ -1,12 +1,13 @@
 import logging
 logger = logging.getLogger(__name__)
 import csv
+import re
 
 from django.contrib.gis.db import models as geomodels
 from django.contrib.gis.db.models.query import GeoQuerySet
 from django.conf import settings
 from django.db import models, connection, IntegrityError, transaction
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_init, post_delete, m2m_changed
 from django.contrib.auth.models import User, Group
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
@@ -26,10 +27,12 @@ from .mixins import MailSendMixin
 from issues.models import Problem
 
 import auth
-from .auth import user_in_groups
 from .metaphone import dm
+from .lib import refresh_problem_counts, utc_day
+from .map_tiles import invalidate_map_tiles, invalidate_map_tiles_at
 
-from sorl.thumbnail import ImageField as sorlImageField
+from sorl.thumbnail import ImageField as sorlImageField, get_thumbnail
+from sorl.thumbnail import default as thumbnail_default
 
 
 class CCG(MailSendMixin, AuditedModel):
@@ -65,25 +68,7 @@ class CCG(MailSendMixin, AuditedModel):
 
     def can_be_accessed_by(self, user):
         """Check whether a given user can access this ccg?"""
-
-        # Deactivated users - NO
-        if not user.is_active:
-            return False
-
-        # Django superusers - YES
-        if user.is_superuser:
-            return True
-
-        # NHS Superusers, Case Handlers - YES
-        if user_in_groups(user, [auth.NHS_SUPERUSERS, auth.CASE_HANDLERS]):
-            return True
-
-        # Users in this ccg - YES
-        if user in self.users.all():
-            return True
-
-        # Everyone else - NO
-        return False
+        return auth.user_can_access_ccg(user, self.id)
 
     @property
     def problem_set(self):
@@ -193,34 +178,52 @@ class FriendsAndFamilySurvey(AuditedModel):
         """Process a csv file of multiple surveys for either a Site (hospital)
         or a Trust and create objects for them.
 
-        Returns an array of the created models."""
-
-        if not content_type == 'site' and not content_type == 'trust':
+        All the codes in the file are looked up with one query, and every row
+        is checked before any surveys are created, so that a large file
+        doesn't need a few queries per row.
+
+        Returns an array of the created models, and an array of the codes
+        which were skipped because we don't know them."""
+
+        if content_type == 'site':
+            model = Organisation
+            code_field = 'ods_code'
+            code_column = 'Site Code'
+        elif content_type == 'trust':
+            model = OrganisationParent
+            code_field = 'code'
+            code_column = 'Code'
+        else:
             raise ValueError("Unknown content_type")
 
+        rows = list(csv.DictReader(csv_file, delimiter=',', quotechar='"'))
+
+        # Work out the content_objects the surveys are for
+        codes = set(row[code_column] for row in rows)
+        content_objects = dict(
+            (getattr(content_object, code_field), content_object)
+            for content_object in model.objects.filter(**{code_field + '__in': codes})
+        )
+
+        # We can only have one survey per content_object for this month and
+        # location, so find the ones that already have one
+        survey_object_ids = set(cls.objects.filter(
+            content_type=ContentType.objects.get_for_model(model),
+            object_id__in=[content_object.id for content_object in content_objects.values()],
+            date=month,
+            location=location
+        ).values_list('object_id', flat=True))
+
         created = []
         skipped = []
 
-        csv_reader = csv.DictReader(csv_file, delimiter=',', quotechar='"')
-        for row in csv_reader:
-
-            # Work out the content_object the survey is for
-            content_object = None
-            if content_type == "site":
-                site_code = row['Site Code']
-                try:
-                    content_object = Organisation.objects.get(ods_code=site_code)
-                except Organisation.DoesNotExist:
-                    # Skip this row
-                    skipped.append("{0}".format(site_code))
-                    continue
-            else:
-                code = row['Code']
-                try:
-                    content_object = OrganisationParent.objects.get(code=code)
-                except OrganisationParent.DoesNotExist:
-                    skipped.append("{0}".format(code))
-                    continue
+        for row in rows:
+            code = row[code_column]
+            content_object = content_objects.get(code)
+            if content_object is None:
+                # Skip this row
+                skipped.append("{0}".format(code))
+                continue
 
             try:
                 overall_score = int(row['Friends and Family Test Score'])
@@ -235,28 +238,33 @@ class FriendsAndFamilySurvey(AuditedModel):
             except (KeyError, ValueError):
                 raise ValueError("Could not retrieve one of the score fields from the csv for: {0}, or the data is not a valid score.".format(content_object.name))
 
-            try:
-                survey = FriendsAndFamilySurvey(
-                    content_object=content_object,
-                    overall_score=overall_score,
-                    extremely_likely=extremely_likely,
-                    likely=likely,
-                    neither=neither,
-                    unlikely=unlikely,
-                    extremely_unlikely=extremely_unlikely,
-                    dont_know=dont_know,
-                    date=month,
-                    location=location
-                )
-
-                survey.save()
-
-                created.append(survey)
-            except IntegrityError:
-                transaction.rollback()
+            # Either already in the database, or earlier in the file
+            if content_object.id in survey_object_ids:
                 date_string = month.strftime("%B, %Y")
-                location = cls.location_display(location)
-                raise IntegrityError("There is already a survey for {0} for the month {1} and location {2}. Please delete the existing survey first if you're trying to replace it.".format(content_object.name, date_string, location))
+                raise IntegrityError("There is already a survey for {0} for the month {1} and location {2}. Please delete the existing survey first if you're trying to replace it.".format(content_object.name, date_string, cls.location_display(location)))
+            survey_object_ids.add(content_object.id)
+
+            created.append(FriendsAndFamilySurvey(
+                content_object=content_object,
+                overall_score=overall_score,
+                extremely_likely=extremely_likely,
+                likely=likely,
+                neither=neither,
+                unlikely=unlikely,
+                extremely_unlikely=extremely_unlikely,
+                dont_know=dont_know,
+                date=month,
+                location=location
+            ))
+
+        try:
+            for start in range(0, len(created), 1000):
+                cls.objects.bulk_create(created[start:start + 1000])
+        except IntegrityError:
+            # Someone else uploaded some of the same surveys at the same time
+            transaction.rollback()
+            date_string = month.strftime("%B, %Y")
+            raise IntegrityError("There is already a survey for one of these organisations for the month {0} and location {1}. Please delete the existing survey first if you're trying to replace it.".format(date_string, cls.location_display(location)))
 
         return (created, skipped)
 
@@ -326,29 +334,7 @@ class OrganisationParent(MailSendMixin, AuditedModel):
 
     def can_be_accessed_by(self, user):
         """Can a user access this Organisation Parent?"""
-
-        # Deactivated users - NO
-        if not user.is_active:
-            return False
-
-        # Django superusers - YES
-        if user.is_superuser:
-            return True
-
-        # NHS Superusers, Moderators - YES
-        if user_in_groups(user, [auth.NHS_SUPERUSERS, auth.CASE_HANDLERS]):
-            return True
-
-        # Users in this Parent - YES
-        if user in self.users.all():
-            return True
-
-        # CCG users for a CCG associated with this Parent - YES
-        if user in User.objects.filter(ccgs__organisation_parents=self).all():
-            return True
-
-        # Everyone else - NO
-        return False
+        return auth.user_can_access_organisation_parent(user, self.id)
 
     def default_user_group(self):
         """Group to ensure that users are members of"""
@@ -405,6 +391,9 @@ class PassThroughGeoManager(PassThroughManagerMixin, geomodels.GeoManager):
 class Organisation(AuditedModel, geomodels.Model):
     """Stores an Organisation - a Hospital, GP, Clinic, etc"""
 
+    # The size of the thumbnails of images shown on the map
+    MAP_THUMBNAIL_GEOMETRY = '60x60'
+
     # Organisation name
     name = models.TextField(db_index=True)
     # What type of organisation this is - hospital, GP, clinic, etc
@@ -445,6 +434,10 @@ class Organisation(AuditedModel, geomodels.Model):
 
     # Image of the organisation
     image = sorlImageField(upload_to=organisation_image_upload_path, validators=[validate_file_extension], blank=True)
+    # Path to a thumbnail of the image for the map, so that the map doesn't
+    # have to ask sorl-thumbnail about every organisation it shows. This is
+    # kept up to date in save()
+    map_thumbnail = models.CharField(max_length=255, blank=True)
 
     # Reverse relation to Surveys - this helps us get the surveys for an
     # Organisation easily, because querying them directly with an Organisation
@@ -490,8 +483,9 @@ class Organisation(AuditedModel, geomodels.Model):
 
     def can_be_accessed_by(self, user):
         """Can a given user access this Organisation?"""
-        # Access is controlled by the Parent
-        return self.parent.can_be_accessed_by(user)
+        # Access is controlled by the Parent, we don't need to load it to
+        # check that though
+        return auth.user_can_access_organisation_parent(user, self.parent_id)
 
     def save(self, *args, **kwargs):
         """Overriden save to calculate double metaphones for name"""
@@ -502,7 +496,49 @@ class Organisation(AuditedModel, geomodels.Model):
             unicode_name = unicode(self.name, encoding='utf-8', errors='ignore')
         name_metaphones = dm(unicode_name)
         self.name_metaphone = name_metaphones[0]  # Ignoring the alternative for now
+        # Clear the cached map tiles where the organisation was, and where it
+        # is now, in case it has moved
+        if self.pk:
+            invalidate_map_tiles([self.pk])
         super(Organisation, self).save(*args, **kwargs)
+        # This has to happen after saving, because that's when a newly
+        # uploaded image gets saved to storage
+        self.update_map_thumbnail()
+        self.update_search_tokens()
+        invalidate_map_tiles_at([(self.point.x, self.point.y)])
+
+    def update_map_thumbnail(self):
+        """Make sure map_thumbnail is a thumbnail of the current image"""
+        if self.image:
+            map_thumbnail = get_thumbnail(self.image, self.MAP_THUMBNAIL_GEOMETRY).name
+        else:
+            map_thumbnail = ''
+        if map_thumbnail != self.map_thumbnail:
+            self.map_thumbnail = map_thumbnail
+            Organisation.objects.filter(pk=self.pk).update(map_thumbnail=map_thumbnail)
+
+    def update_search_tokens(self):
+        """Make sure search_tokens has the metaphones of the words in the
+        current name"""
+        metaphones = name_search_metaphones(self.name)
+        if metaphones != set(self.search_tokens.values_list('metaphone', flat=True)):
+            self.search_tokens.all().delete()
+            OrganisationSearchToken.objects.bulk_create([
+                OrganisationSearchToken(organisation=self, metaphone=metaphone)
+                for metaphone in metaphones
+            ])
+
+    @classmethod
+    def map_thumbnail_url(cls, organisation_id, image, map_thumbnail):
+        """Return the url of the map thumbnail for an Organisation, given its
+        id and its image and map_thumbnail values, without loading it.
+
+        If an organisation's thumbnail hasn't been stored yet, it is made and
+        stored now, so that it's there next time."""
+        if not map_thumbnail:
+            map_thumbnail = get_thumbnail(image, cls.MAP_THUMBNAIL_GEOMETRY).name
+            cls.objects.filter(pk=organisation_id).update(map_thumbnail=map_thumbnail)
+        return thumbnail_default.storage.url(map_thumbnail)
 
     def __unicode__(self):
         """String representation of this Organisation"""
@@ -538,6 +574,221 @@ class Service(AuditedModel):
         unique_together = (("service_code", "organisation"),)
 
 
+class DailyProblemCount(models.Model):
+    """Stores a rollup of the :model:`issues.Problem`s reported to an
+    :model:`organisations.Organisation` on a particular (UTC) day, broken
+    down by the fields that summary pages filter on.
+
+    This is what interval_counts in organisations.lib reads from, so that it
+    doesn't have to go through every problem on every request. Rows are
+    rebuilt from the problems table by refresh_problem_counts whenever a
+    problem is saved or deleted, and can be rebuilt from scratch with the
+    rebuild_interval_count_rollups management command.
+    """
+    organisation = models.ForeignKey(Organisation, related_name='daily_problem_counts')
+    date = models.DateField(db_index=True)
+
+    # The fields we break the counts down by
+    status = models.IntegerField()
+    publication_status = models.IntegerField()
+    category = models.CharField(max_length=100)
+    service = models.ForeignKey(Service, null=True, related_name='daily_problem_counts')
+    breach = models.BooleanField()
+    formal_complaint = models.BooleanField()
+
+    # How many problems there were
+    count = models.IntegerField()
+    # Totals and counts of the non-null values, so that averages can be
+    # calculated over any number of rows
+    time_to_acknowledge_total = models.IntegerField()
+    time_to_acknowledge_count = models.IntegerField()
+    time_to_address_total = models.IntegerField()
+    time_to_address_count = models.IntegerField()
+    # Counts of the true and the non-null values, so that fractions can be
+    # calculated over any number of rows
+    happy_service_true = models.IntegerField()
+    happy_service_count = models.IntegerField()
+    happy_outcome_true = models.IntegerField()
+    happy_outcome_count = models.IntegerField()
+
+
+class DailyReviewCount(models.Model):
+    """Stores the number of :model:`reviews_display.Review`s (not including
+    replies) published about an :model:`organisations.Organisation` on a
+    particular (UTC) day.
+
+    See :model:`organisations.DailyProblemCount` for how this is used and
+    kept up to date.
+    """
+    organisation = models.ForeignKey(Organisation, related_name='daily_review_counts')
+    date = models.DateField(db_index=True)
+    count = models.IntegerField()
+
+
+def name_search_metaphones(name):
+    """Return the set of double metaphone codes, primary and alternate, for
+    each word in an organisation's name (or a search for one)."""
+    # dm() expects unicode data, and gets upset with byte strings
+    if not isinstance(name, unicode):
+        name = unicode(name, encoding='utf-8', errors='ignore')
+    metaphones = set()
+    for word in re.findall(r'\w+', name, re.UNICODE):
+        metaphones.update(dm(word))
+    metaphones.discard('')
+    return metaphones
+
+
+class OrganisationSearchToken(models.Model):
+    """Stores one of the double metaphone codes of the words in an
+    :model:`organisations.Organisation`'s name, so that organisations.search
+    can find organisations with a word that sounds like a word in a search,
+    using an index.
+
+    These are kept up to date by Organisation.save(), and can be rebuilt with
+    the rebuild_organisation_search_tokens management command.
+    """
+    organisation = models.ForeignKey(Organisation, related_name='search_tokens')
+    metaphone = models.TextField(db_index=True)
+
+
+class Postcode(geomodels.Model):
+    """Stores the location of a UK postcode, or the centre of a postcode
+    district (a partial postcode, eg: SW1A), so that postcode searches don't
+    have to ask MapIt every time.
+
+    These are loaded in bulk from the ONS Postcode Directory by the
+    load_postcodes_from_csv management command, and any postcodes which
+    aren't in there are added when MapIt is asked about them.
+    """
+    # Stored upper case and without spaces, see normalise()
+    postcode = models.CharField(max_length=8, unique=True)
+    # Null for postcodes which are valid but can't be geocoded (eg: those on
+    # the Isle of Man)
+    point = geomodels.PointField(null=True, blank=True)
+    partial = models.BooleanField(default=False)
+
+    objects = geomodels.GeoManager()
+
+    @classmethod
+    def normalise(cls, postcode):
+        """Return a postcode in the form it's stored in"""
+        return re.sub(r'\s+', '', postcode.upper())
+
+    @classmethod
+    def remember(cls, postcode, point, partial=False):
+        """Store the location of a postcode we've looked up elsewhere, unless
+        something else has stored it first"""
+        sid = transaction.savepoint()
+        try:
+            cls.objects.create(postcode=cls.normalise(postcode), point=point, partial=partial)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+
+    def __unicode__(self):
+        return self.postcode
+
+
+# The Problem fields that DailyProblemCount rows are built from, in the order
+# that problem_count_values returns them
+PROBLEM_COUNT_FIELDS = ('organisation_id',
+                        'created',
+                        'status',
+                        'publication_status',
+                        'category',
+                        'service_id',
+                        'breach',
+                        'formal_complaint',
+                        'time_to_acknowledge',
+                        'time_to_address',
+                        'happy_service',
+                        'happy_outcome')
+
+
+def problem_count_values(problem):
+    """Return the values of a Problem which DailyProblemCount depends on"""
+    return tuple(getattr(problem, field) for field in PROBLEM_COUNT_FIELDS)
+
+
+def problem_count_bucket(values):
+    """Return the (organisation id, day) of the DailyProblemCount rows that a
+    Problem with the given problem_count_values is counted in, or None if it
+    isn't counted yet."""
+    organisation_id, created = values[0], values[1]
+    if organisation_id is None or created is None:
+        return None
+    return (organisation_id, utc_day(created))
+
+
+@receiver(post_init, sender=Problem)
+def remember_problem_count_values(sender, **kwargs):
+    """post_init signal handler to remember what a Problem was counted as, so
+    that we can tell which DailyProblemCount rows need updating when it is
+    saved."""
+    problem = kwargs['instance']
+    problem._problem_count_values = problem_count_values(problem)
+
+
+@receiver(post_save, sender=Problem)
+def update_problem_counts_on_save(sender, **kwargs):
+    """post_save signal handler to update the DailyProblemCount rows that a
+    Problem was and is now counted in."""
+    problem = kwargs['instance']
+    values = problem_count_values(problem)
+    # Deferred instances don't get post_init sent for Problem, so we might
+    # not know what they were counted as
+    previous_values = getattr(problem, '_problem_count_values', None)
+    if kwargs['created'] or values != previous_values:
+        buckets = set([problem_count_bucket(values)])
+        if previous_values is not None:
+            buckets.add(problem_count_bucket(previous_values))
+        buckets.discard(None)
+        for organisation_id, day in buckets:
+            refresh_problem_counts([organisation_id], [day])
+    problem._problem_count_values = values
+
+
+@receiver(post_delete, sender=Problem)
+def update_problem_counts_on_delete(sender, **kwargs):
+    """post_delete signal handler to remove a deleted Problem from the
+    DailyProblemCount rows."""
+    bucket = problem_count_bucket(problem_count_values(kwargs['instance']))
+    if bucket is not None:
+        organisation_id, day = bucket
+        refresh_problem_counts([organisation_id], [day])
+
+
+@receiver(post_delete, sender=Organisation)
+def invalidate_map_tiles_on_delete(sender, **kwargs):
+    """post_delete signal handler to take a deleted Organisation off the
+    cached map tiles."""
+    organisation = kwargs['instance']
+    invalidate_map_tiles_at([(organisation.point.x, organisation.point.y)])
+
+
+def invalidate_user_access_on_m2m_change(sender, **kwargs):
+    """m2m_changed signal handler to forget the access users had to CCGs and
+    Organisation Parents when their groups or memberships change."""
+    if kwargs['action'] not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    instance = kwargs['instance']
+    auth.invalidate_user_access(instance if isinstance(instance, User) else None)
+
+for through in (User.groups.through,
+                CCG.users.through,
+                OrganisationParent.users.through,
+                OrganisationParent.ccgs.through):
+    m2m_changed.connect(invalidate_user_access_on_m2m_change, sender=through)
+
+
+@receiver(post_delete, sender=CCG)
+@receiver(post_delete, sender=OrganisationParent)
+def invalidate_user_access_on_delete(sender, **kwargs):
+    """post_delete signal handler to forget the access users had to a deleted
+    CCG or Organisation Parent."""
+    auth.invalidate_user_access()
+
+
 class SuperuserLogEntry(AuditedModel):
     """Stores logs of when an NHS Superuser accesses a page"""
     # The user in question
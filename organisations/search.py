@@ -0,0 +1,72 @@
+from django.utils.datastructures import SortedDict
+
+from .models import Organisation, name_search_metaphones
+
+
+def _like_pattern(term):
+    """Return an ILIKE pattern matching names containing term"""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + escaped + '%'
+
+
+def search_organisations(term, queryset=None):
+    """Search for organisations by name, returning a queryset of the matches,
+    best first.
+
+    An organisation matches if its name contains the search term, if its name
+    is similar to the term (using trigrams), or if a word in its name sounds
+    like a word in the term (using double metaphone codes, see
+    :model:`organisations.OrganisationSearchToken`). All three of these are
+    indexed, and are combined into a single ranked query. Names which contain
+    the term come first, then those with the most words sounding like it, then
+    the most similar.
+
+    Pass queryset to only search some organisations."""
+    if queryset is None:
+        queryset = Organisation.objects.all()
+
+    term = term.strip()
+    if not term:
+        return queryset.none()
+
+    metaphones = tuple(name_search_metaphones(term))
+    if metaphones:
+        token_matches_sql = """(SELECT COUNT(DISTINCT organisations_organisationsearchtoken.metaphone)
+                                FROM organisations_organisationsearchtoken
+                                WHERE organisations_organisationsearchtoken.organisation_id = organisations_organisation.id
+                                AND organisations_organisationsearchtoken.metaphone IN %s)"""
+        token_matches_params = [metaphones]
+    else:
+        token_matches_sql = "0"
+        token_matches_params = []
+
+    like_pattern = _like_pattern(term)
+
+    # The params have to be in the same order as the selects
+    select = SortedDict([
+        ('search_contains', "organisations_organisation.name ILIKE %s"),
+        ('search_token_matches', token_matches_sql),
+        ('search_similarity', "similarity(organisations_organisation.name, %s)"),
+    ])
+    select_params = [like_pattern] + token_matches_params + [term]
+
+    # % is pg_trgm's "is similar to" operator, which can use the trigram
+    # index on name, as can the ILIKE
+    where_clauses = ["organisations_organisation.name ILIKE %s",
+                     "organisations_organisation.name %% %s"]
+    where_params = [like_pattern, term]
+    if metaphones:
+        where_clauses.append("""organisations_organisation.id IN (
+                                    SELECT organisations_organisationsearchtoken.organisation_id
+                                    FROM organisations_organisationsearchtoken
+                                    WHERE organisations_organisationsearchtoken.metaphone IN %s)""")
+        where_params.append(metaphones)
+    where = ["(" + " OR ".join(where_clauses) + ")"]
+
+    return queryset.extra(
+        select=select,
+        select_params=select_params,
+        where=where,
+        params=where_params,
+        order_by=['-search_contains', '-search_token_matches', '-search_similarity', 'name']
+    )
@@ -1,9 +1,9 @@
 import django_tables2 as tables
 
 from django.utils.safestring import mark_safe
-from django.core.urlresolvers import reverse
 
 from issues.tables import BaseProblemTable
+from issues.table_columns import TimeIntervalColumn, PercentColumn, RatingColumn, ReversedURL
 
 
 class NationalSummaryTable(tables.Table):
@@ -22,19 +22,15 @@ class NationalSummaryTable(tables.Table):
                              attrs={'th': {'class': 'problems-received'}})
 
     # We split these into sub-columns
-    average_time_to_acknowledge = tables.TemplateColumn(verbose_name='Acknowledge',
-                                                        template_name='organisations/includes/tables/columns/time_interval_column.html')
-    average_time_to_address = tables.TemplateColumn(verbose_name='Close',
-                                                    template_name='organisations/includes/tables/columns/time_interval_column.html',
-                                                    attrs={'th': {'class': 'summary-table__cell-no-border'}})
+    average_time_to_acknowledge = TimeIntervalColumn(verbose_name='Acknowledge')
+    average_time_to_address = TimeIntervalColumn(verbose_name='Close',
+                                                 attrs={'th': {'class': 'summary-table__cell-no-border'}})
 
     # We split these into sub-columns
-    happy_service = tables.TemplateColumn(verbose_name='Manner',
-                                          template_name="organisations/includes/tables/columns/percent_column.html")
+    happy_service = PercentColumn(verbose_name='Manner')
 
-    happy_outcome = tables.TemplateColumn(verbose_name='Resolution',
-                                          template_name="organisations/includes/tables/columns/percent_column.html",
-                                          attrs={'th': {'class': 'summary-table__cell-no-border'}})
+    happy_outcome = PercentColumn(verbose_name='Resolution',
+                                  attrs={'th': {'class': 'summary-table__cell-no-border'}})
 
     # We put all these columns in, and then js hides all but one
     reviews_week = tables.Column(verbose_name='Last 7 days',
@@ -46,12 +42,12 @@ class NationalSummaryTable(tables.Table):
     reviews_all_time = tables.Column(verbose_name='All time',
                                      attrs={'th': {'class': 'reviews-received'}})
 
-    average_recommendation_rating = tables.TemplateColumn(verbose_name='Average Review:',
-                                                          template_name='organisations/includes/tables/columns/rating_column.html',
-                                                          attrs={'th': {'class': 'two-twelfths'}})
+    average_recommendation_rating = RatingColumn(verbose_name='Average Review:',
+                                                 attrs={'th': {'class': 'two-twelfths'}})
 
     def __init__(self, *args, **kwargs):
         self.cobrand = kwargs.pop('cobrand')
+        self._org_summary_url = None
         super(NationalSummaryTable, self).__init__(*args, **kwargs)
 
     def render_name(self, record):
@@ -59,10 +55,16 @@ class NationalSummaryTable(tables.Table):
         return mark_safe('''<a href="%s">%s</a>''' % (url, record['name']))
 
     def reverse_to_org_summary(self, ods_code):
-        return reverse(
-            'public-org-summary',
-            kwargs={'ods_code': ods_code, 'cobrand': self.cobrand}
-        )
+        # There's a row for every organisation, so only reverse the URL once
+        if self._org_summary_url is None:
+            self._org_summary_url = self.org_summary_url()
+        return self._org_summary_url(ods_code)
+
+    def org_summary_url(self):
+        return ReversedURL('public-org-summary',
+                           'ods_code',
+                           ReversedURL.ODS_CODE_PLACEHOLDER,
+                           {'cobrand': self.cobrand})
 
     class Meta:
         # Show organisations with the most problems first. This is so that when
@@ -73,11 +75,8 @@ class NationalSummaryTable(tables.Table):
 
 class CCGSummaryTable(NationalSummaryTable):
 
-    def reverse_to_org_summary(self, ods_code):
-        return reverse(
-            'private-org-summary',
-            kwargs={'ods_code': ods_code}
-        )
+    def org_summary_url(self):
+        return ReversedURL('private-org-summary', 'ods_code', ReversedURL.ODS_CODE_PLACEHOLDER)
 
 
 class ProblemDashboardTable(BaseProblemTable):
@@ -56,16 +56,24 @@ def formatted_boolean(boolean):
 
 @register.filter(is_safe=True)
 def row_classes(table, record):
+    # Look before we leap, rather than raising an AttributeError for every
+    # row of a table which doesn't have the method
+    method = getattr(table, 'row_classes', None)
+    if method is None:
+        return ""
     try:
-        return table.row_classes(record)
+        return method(record)
     except AttributeError:
         return ""
 
 
 @register.filter(is_safe=True)
 def row_href(table, record):
+    method = getattr(table, 'row_href', None)
+    if method is None:
+        return ""
     try:
-        return table.row_href(record)
+        return method(record)
     except AttributeError:
         return ""
 
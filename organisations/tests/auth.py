@@ -1,7 +1,9 @@
 import string
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
 
 from organisations import auth
 from organisations.auth import (user_is_superuser,
@@ -32,6 +34,38 @@ class AuthTests(AuthorizationTestCase):
         self.assertTrue(user_in_groups(self.nhs_superuser, example_group_list))
         self.assertFalse(user_in_groups(self.ccg_user, example_group_list))
 
+    def test_access_is_only_loaded_once_per_user(self):
+        user = User.objects.get(pk=self.ccg_user.pk)
+        # Groups, Organisation Parents, CCGs and the CCGs' Organisation Parents
+        with self.assertNumQueries(4):
+            self.assertTrue(self.test_trust.can_be_accessed_by(user))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.test_hospital.can_be_accessed_by(user))
+            self.assertFalse(self.test_gp_branch.can_be_accessed_by(user))
+            self.assertTrue(self.test_ccg.can_be_accessed_by(user))
+            self.assertFalse(self.other_test_ccg.can_be_accessed_by(user))
+            self.assertTrue(user_in_group(user, auth.CCG))
+
+    def test_access_changes_when_membership_changes(self):
+        self.assertFalse(self.other_test_ccg.can_be_accessed_by(self.ccg_user))
+        self.ccg_user.ccgs.add(self.other_test_ccg)
+        self.assertTrue(self.other_test_ccg.can_be_accessed_by(self.ccg_user))
+        self.assertTrue(self.test_gp_branch.can_be_accessed_by(self.ccg_user))
+
+    @override_settings(USER_ACCESS_CACHE_SECONDS=60)
+    def test_access_is_shared_between_requests_when_cached(self):
+        cache.clear()
+        self.assertFalse(self.other_test_ccg.can_be_accessed_by(User.objects.get(pk=self.ccg_user.pk)))
+
+        # A new user object, as in the next request, doesn't need to load it
+        user = User.objects.get(pk=self.ccg_user.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(self.other_test_ccg.can_be_accessed_by(user))
+
+        # But it's forgotten when the CCG's users change
+        self.other_test_ccg.users.add(self.ccg_user)
+        self.assertTrue(self.other_test_ccg.can_be_accessed_by(User.objects.get(pk=self.ccg_user.pk)))
+
     def test_is_valid_username_char(self):
         for char in string.whitespace:
             self.assertFalse(is_valid_username_char(char))
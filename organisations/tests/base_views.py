@@ -2,7 +2,7 @@
 import os
 from mock import MagicMock, patch
 import json
-import urllib
+import urllib2
 import logging
 from datetime import datetime
 from selenium.webdriver.support.ui import WebDriverWait
@@ -11,6 +11,8 @@ from selenium.webdriver.common.keys import Keys
 # Django imports
 from django.test import TestCase
 from django.test.utils import override_settings
+from django.db import connection
+from django.core.cache import cache
 from django.contrib.gis.geos import Point
 from django.core.urlresolvers import reverse
 from django.utils.timezone import utc
@@ -21,6 +23,8 @@ from citizenconnect.browser_testing import SeleniumTestCase
 from issues.models import Problem
 
 import organisations
+from .. import map_tiles
+from ..models import Organisation, Postcode
 from ..forms import MapitPostCodeLookup, MapitPostcodeNotFoundError
 from ..views.base import Summary
 from . import (create_test_problem,
@@ -41,14 +45,25 @@ class OrganisationMapTests(AuthorizationTestCase):
         self.other_gp = self.test_gp_branch
         self.map_url = reverse('org-map', kwargs={'cobrand': 'choices'})
 
+    def get_map_json(self, url):
+        separator = '&' if '?' in url else '?'
+        resp = self.client.get("{0}{1}format=json".format(url, separator))
+        return json.loads(resp.content)
+
     def test_map_page_exists(self):
         resp = self.client.get(self.map_url)
         self.assertEqual(resp.status_code, 200)
 
+    def test_map_page_doesnt_count_problems(self):
+        # The page gets its organisations from the map tiles
+        with patch('organisations.views.base.combined_interval_counts') as mock_counts:
+            resp = self.client.get(self.map_url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(mock_counts.called)
+
     def test_organisations_json_displayed(self):
         # Set some dummy data
-        resp = self.client.get(self.map_url)
-        response_json = json.loads(resp.context['organisations'])
+        response_json = self.get_map_json(self.map_url)
         self.assertEqual(len(response_json), 2)
         self.assertEqual(response_json[0]['ods_code'], self.other_gp.ods_code)
         self.assertEqual(response_json[0]['all_time_open'], 0)
@@ -73,8 +88,7 @@ class OrganisationMapTests(AuthorizationTestCase):
                              'publication_status': Problem.PUBLISHED,
                              'status': Problem.ABUSIVE})
 
-        resp = self.client.get(self.map_url)
-        response_json = json.loads(resp.context['organisations'])
+        response_json = self.get_map_json(self.map_url)
         self.assertEqual(response_json[0]['all_time_open'], 1)
         self.assertEqual(response_json[1]['all_time_open'], 1)
 
@@ -84,8 +98,7 @@ class OrganisationMapTests(AuthorizationTestCase):
         expected_gp_url = reverse('public-org-summary', kwargs={'ods_code': self.other_gp.ods_code,
                                                                 'cobrand': 'choices'})
 
-        resp = self.client.get(self.map_url)
-        response_json = json.loads(resp.context['organisations'])
+        response_json = self.get_map_json(self.map_url)
 
         self.assertEqual(response_json[0]['url'], expected_gp_url)
         self.assertEqual(response_json[1]['url'], expected_hospital_url)
@@ -93,8 +106,7 @@ class OrganisationMapTests(AuthorizationTestCase):
     def test_map_filters_by_organisation_type(self):
         org_type_filtered_url = "{0}?organisation_type=hospitals".format(self.map_url)
 
-        resp = self.client.get(org_type_filtered_url)
-        response_json = json.loads(resp.context['organisations'])
+        response_json = self.get_map_json(org_type_filtered_url)
         self.assertEqual(len(response_json), 1)
         self.assertEqual(response_json[0]['ods_code'], self.hospital.ods_code)
         self.assertEqual(response_json[0]['all_time_open'], 0)
@@ -110,8 +122,7 @@ class OrganisationMapTests(AuthorizationTestCase):
 
         service_filtered_url = "{0}?service_code={1}".format(self.map_url, service.service_code)
 
-        resp = self.client.get(service_filtered_url)
-        response_json = json.loads(resp.context['organisations'])
+        response_json = self.get_map_json(service_filtered_url)
         self.assertEqual(len(response_json), 2)
         self.assertEqual(response_json[0]['ods_code'], self.other_gp.ods_code)
         self.assertEqual(response_json[0]['all_time_open'], 0)
@@ -129,8 +140,7 @@ class OrganisationMapTests(AuthorizationTestCase):
 
         category_filtered_url = "{0}?category=staff".format(self.map_url)
 
-        resp = self.client.get(category_filtered_url)
-        response_json = json.loads(resp.context['organisations'])
+        response_json = self.get_map_json(category_filtered_url)
         self.assertEqual(len(response_json), 2)
         self.assertEqual(response_json[0]['ods_code'], self.other_gp.ods_code)
         self.assertEqual(response_json[0]['all_time_open'], 1)
@@ -148,8 +158,7 @@ class OrganisationMapTests(AuthorizationTestCase):
 
         status_filtered_url = "{0}?status={1}".format(self.map_url, Problem.ACKNOWLEDGED)
 
-        resp = self.client.get(status_filtered_url)
-        response_json = json.loads(resp.context['organisations'])
+        response_json = self.get_map_json(status_filtered_url)
         self.assertEqual(len(response_json), 2)
         self.assertEqual(response_json[0]['ods_code'], self.other_gp.ods_code)
         self.assertEqual(response_json[0]['all_time_open'], 0)
@@ -179,6 +188,113 @@ class OrganisationMapTests(AuthorizationTestCase):
         self.assertEqual(len(response_json), 1)
 
 
+    def count_queries(self, url):
+        connection.use_debug_cursor = True
+        queries_before = len(connection.queries)
+        self.client.get(url)
+        query_count = len(connection.queries) - queries_before
+        connection.use_debug_cursor = False
+        return query_count
+
+    def test_map_json_query_count_doesnt_depend_on_organisations(self):
+        json_url = "{0}?format=json".format(self.map_url)
+        query_count = self.count_queries(json_url)
+        for ods_code in ['XYZ981', 'XYZ982', 'XYZ983']:
+            create_test_organisation({'ods_code': ods_code,
+                                      'parent': self.hospital.parent})
+        self.assertEqual(query_count, self.count_queries(json_url))
+
+    def test_map_json_includes_stored_thumbnail_urls(self):
+        Organisation.objects.filter(pk=self.hospital.pk).update(image='organisation_images/ab/cd/hospital.jpg',
+                                                                map_thumbnail='cache/ab/cd/hospital.jpg')
+        resp = self.client.get("{0}?format=json".format(self.map_url))
+        response_json = json.loads(resp.content)
+        self.assertEqual(response_json[1]['ods_code'], self.hospital.ods_code)
+        self.assertTrue(response_json[1]['thumbnail_url'].endswith('cache/ab/cd/hospital.jpg'))
+        self.assertFalse('thumbnail_url' in response_json[0])
+        self.assertFalse('image' in response_json[0])
+
+
+@override_settings(MAP_TILE_CLUSTER_ZOOM=12)
+class MapTileTests(AuthorizationTestCase):
+
+    def setUp(self):
+        super(MapTileTests, self).setUp()
+        cache.clear()
+        self.near_org = create_test_organisation({'point': Point(-0.1, 51.5),
+                                                  'ods_code': 'XYZ991'})
+        self.nearby_org = create_test_organisation({'point': Point(-0.11, 51.51),
+                                                    'ods_code': 'XYZ992'})
+        self.far_org = create_test_organisation({'point': Point(-2.5, 53.5),
+                                                 'ods_code': 'XYZ993'})
+
+    def tile_url(self, lon, lat, zoom):
+        x, y = map_tiles.tile_for_point(lon, lat, zoom)
+        return reverse('org-map-tile', kwargs={'cobrand': 'choices', 'z': zoom, 'x': x, 'y': y})
+
+    def get_tile(self, url):
+        resp = self.client.get(url)
+        self.assertEqual(resp['Content-Type'], 'application/json')
+        return json.loads(resp.content)
+
+    def test_tile_returns_orgs_within_tile(self):
+        tile = self.get_tile(self.tile_url(-0.1, 51.5, 13))
+        ods_codes = [org['ods_code'] for org in tile['organisations']]
+        self.assertTrue(self.near_org.ods_code in ods_codes)
+        self.assertFalse(self.far_org.ods_code in ods_codes)
+        self.assertEqual(tile['clusters'], [])
+
+    def test_tile_clusters_orgs_at_low_zoom(self):
+        tile = self.get_tile(self.tile_url(-0.1, 51.5, 6))
+        ods_codes = [org['ods_code'] for org in tile['organisations']]
+        self.assertFalse(self.near_org.ods_code in ods_codes)
+        self.assertFalse(self.nearby_org.ods_code in ods_codes)
+        clusters = [cluster for cluster in tile['clusters'] if cluster['count'] == 2]
+        self.assertEqual(len(clusters), 1)
+        self.assertTrue(51.5 <= clusters[0]['lat'] <= 51.51)
+
+    def test_tile_is_cached(self):
+        url = self.tile_url(-0.1, 51.5, 13)
+        self.get_tile(url)
+        connection.use_debug_cursor = True
+        queries_before = len(connection.queries)
+        self.get_tile(url)
+        query_count = len(connection.queries) - queries_before
+        connection.use_debug_cursor = False
+        self.assertEqual(query_count, 0)
+
+    def test_tile_is_invalidated_when_counts_change(self):
+        url = self.tile_url(-0.1, 51.5, 13)
+        tile = self.get_tile(url)
+        org_data = [org for org in tile['organisations'] if org['ods_code'] == self.near_org.ods_code][0]
+        self.assertEqual(org_data['all_time_open'], 0)
+
+        create_test_problem({'organisation': self.near_org})
+
+        tile = self.get_tile(url)
+        org_data = [org for org in tile['organisations'] if org['ods_code'] == self.near_org.ods_code][0]
+        self.assertEqual(org_data['all_time_open'], 1)
+
+    def test_tile_is_invalidated_when_org_moves(self):
+        url = self.tile_url(-2.5, 53.5, 13)
+        self.assertEqual(len(self.get_tile(url)['organisations']), 1)
+        self.near_org.point = Point(-2.5001, 53.5001)
+        self.near_org.save()
+        self.assertEqual(len(self.get_tile(url)['organisations']), 2)
+
+    def test_invalid_tile_is_404(self):
+        url = reverse('org-map-tile', kwargs={'cobrand': 'choices', 'z': 2, 'x': 4, 'y': 0})
+        # disable logging of "Not Found"
+        logger = logging.getLogger('django.request')
+        previous_level = logger.getEffectiveLevel()
+        logger.setLevel(logging.ERROR)
+
+        resp = self.client.get(url)
+
+        logger.setLevel(previous_level)
+        self.assertEqual(resp.status_code, 404)
+
+
 class MapOrganisationCoordsTests(TestCase):
     def setUp(self):
         self.test_org = create_test_organisation()
@@ -693,7 +809,7 @@ class ProviderPickerTests(TestCase):
 
     def mock_api_response(self, data, response_code):
         mock_response = MagicMock()
-        urllib.urlopen = mock_response
+        urllib2.urlopen = mock_response
         instance = mock_response.return_value
         instance.read.return_value = data
         instance.getcode.return_value = response_code
@@ -707,6 +823,7 @@ class ProviderPickerTests(TestCase):
         self.mapit_example = open(os.path.join(self.fixtures_path, 'SW1A1AA.json')).read()
         self.mapit_not_geocoded_example = open(os.path.join(self.fixtures_path, 'IM44RJ.json')).read()
 
+        self._original_urlopen = urllib2.urlopen
         self.mock_api_response(self.mapit_example, 200)
         self.nearby_gp = create_test_organisation({
             'name': 'Nearby GP',
@@ -730,6 +847,9 @@ class ProviderPickerTests(TestCase):
         self.base_url = reverse('org-pick-provider', kwargs={'cobrand': 'choices'})
         self.results_url = "%s?location=SW1A+1AA" % self.base_url
 
+    def tearDown(self):
+        urllib2.urlopen = self._original_urlopen
+
     def test_results_page_exists(self):
         resp = self.client.get(self.results_url)
         self.assertEqual(resp.status_code, 200)
@@ -782,7 +902,7 @@ class ProviderPickerTests(TestCase):
         self.assertContains(resp, OrganisationFinderForm.PILOT_SEARCH_CAVEAT)
 
     def test_handles_the_case_where_the_mapit_api_cannot_be_connected_to(self):
-        urllib.urlopen = MagicMock(side_effect=IOError('foo'))
+        urllib2.urlopen = MagicMock(side_effect=IOError('foo'))
         resp = self.client.get(self.results_url)
         expected_message = 'Sorry, our postcode lookup service is temporarily unavailable. Please try later or search by provider name'
         self.assertContains(resp, expected_message, count=1, status_code=200)
@@ -815,6 +935,31 @@ class ProviderPickerTests(TestCase):
         self.assertContains(resp, expected_message, count=1, status_code=200)
         self.assertContains(resp, OrganisationFinderForm.PILOT_SEARCH_CAVEAT)
 
+    def test_looks_up_stored_postcodes_without_mapit(self):
+        Postcode.remember('SW1A 1AA', Point(-0.13, 51.5))
+        urllib2.urlopen = MagicMock(side_effect=IOError('foo'))
+        resp = self.client.get(self.results_url)
+        self.assertContains(resp, self.nearby_gp.name, count=1, status_code=200)
+        self.assertFalse(urllib2.urlopen.called)
+
+    def test_stores_postcodes_looked_up_on_mapit(self):
+        self.client.get(self.results_url)
+        postcode = Postcode.objects.get(postcode='SW1A1AA')
+        self.assertFalse(postcode.partial)
+        self.assertAlmostEqual(postcode.point.x, -0.13297729277443412)
+        self.assertAlmostEqual(postcode.point.y, 51.501408367647635)
+
+        # So the next search doesn't need MapIt
+        urllib2.urlopen = MagicMock(side_effect=IOError('foo'))
+        resp = self.client.get(self.results_url)
+        self.assertContains(resp, self.nearby_gp.name, count=1, status_code=200)
+
+    @override_settings(POSTCODE_MAPIT_FALLBACK=False)
+    def test_does_not_use_mapit_when_fallback_is_off(self):
+        resp = self.client.get(self.results_url)
+        self.assertContains(resp, "Sorry, no postcode matches that query.", count=1, status_code=200)
+        self.assertFalse(urllib2.urlopen.called)
+
     def test_shows_message_when_no_results_for_postcode(self):
         mock_results = MagicMock()
         ordered_results = mock_results.distance().order_by('distance')
@@ -858,3 +1003,15 @@ class OrganisationSearchTests(TestCase):
         org = create_test_organisation({'name': "Test Organisation"})
         resp = self.client.get(self.search_url + '?term=Tes')
         self.assertContains(resp, org.name)
+
+    def test_search_returns_organisations_that_sound_alike(self):
+        org = create_test_organisation({'name': "St Katherine's Hospital"})
+        resp = self.client.get(self.search_url + '?term=Catherine')
+        self.assertContains(resp, org.name)
+
+    def test_search_puts_names_containing_the_term_first(self):
+        sounds_alike = create_test_organisation({'name': "St Katherine's Hospital", 'ods_code': 'KAT123'})
+        contains = create_test_organisation({'name': "St Catherine's Hospital", 'ods_code': 'CAT123'})
+        resp = self.client.get(self.search_url + '?term=Catherine')
+        results = json.loads(resp.content)
+        self.assertEqual([result['id'] for result in results], [contains.ods_code, sounds_alike.ods_code])
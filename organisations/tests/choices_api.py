@@ -1,7 +1,11 @@
 # Standard imports
 import os.path
+import shutil
+import tempfile
 import urllib2
-from mock import Mock, MagicMock
+from mock import Mock, MagicMock, patch
+
+import requests
 
 # Django imports
 from django.test import TestCase
@@ -10,7 +14,7 @@ from django.test.utils import override_settings
 
 # App imports
 import organisations
-from organisations.choices_api import ChoicesAPI
+from organisations.choices_api import ChoicesAPI, ChoicesAPITransport
 
 
 # A test case that uses a fixture file to mock the contents of the API urlopen call
@@ -218,3 +222,89 @@ class ChoicesAPIErrorTests(TestCase):
                 'hospitals',
                 '12345'
             )
+
+
+@override_settings(NHS_CHOICES_API_RETRIES=2,
+                   NHS_CHOICES_API_RETRY_BACKOFF_SECONDS=0,
+                   NHS_CHOICES_API_CACHE_DIR='')
+class ChoicesAPITransportTests(TestCase):
+    """Tests for how requests to the choices API are sent"""
+
+    url = 'http://example.com/organisations/hospitals/12345.xml'
+
+    def setUp(self):
+        self.transport = ChoicesAPITransport()
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def mock_response(self, status_code, content='', headers={}):
+        response = MagicMock()
+        response.status_code = status_code
+        response.reason = 'Reason'
+        response.content = content
+        response.iter_content.return_value = iter([content[:2], content[2:]])
+        response.headers = headers
+        return response
+
+    def test_retries_server_errors(self):
+        responses = [self.mock_response(503), self.mock_response(200, 'data')]
+        with patch.object(self.transport.session, 'request', side_effect=responses) as mock_request:
+            self.assertEqual(self.transport.get(self.url).read(), 'data')
+            self.assertEqual(mock_request.call_count, 2)
+
+    def test_gives_up_after_retries(self):
+        with patch.object(self.transport.session, 'request', return_value=self.mock_response(500)) as mock_request:
+            with self.assertRaises(urllib2.HTTPError) as cm:
+                self.transport.get(self.url)
+            self.assertEqual(cm.exception.code, 500)
+            self.assertEqual(mock_request.call_count, 3)
+
+        with patch.object(self.transport.session, 'request', side_effect=requests.ConnectionError()) as mock_request:
+            self.assertRaises(urllib2.URLError, self.transport.get, self.url)
+            self.assertEqual(mock_request.call_count, 3)
+
+    def test_client_errors_are_not_retried(self):
+        with patch.object(self.transport.session, 'request', return_value=self.mock_response(404)) as mock_request:
+            with self.assertRaises(urllib2.HTTPError) as cm:
+                self.transport.get(self.url)
+            self.assertEqual(cm.exception.code, 404)
+            self.assertEqual(mock_request.call_count, 1)
+
+    def test_posts_are_not_retried(self):
+        with patch.object(self.transport.session, 'request', return_value=self.mock_response(500)) as mock_request:
+            response = self.transport.post(self.url, 'data', {'content-type': 'application/xml'})
+            self.assertEqual(response.status_code, 500)
+            self.assertEqual(mock_request.call_count, 1)
+
+    def test_streams_responses(self):
+        response = self.mock_response(200, 'data')
+        with patch.object(self.transport.session, 'request', return_value=response) as mock_request:
+            body = self.transport.get(self.url)
+            self.assertTrue(mock_request.call_args[1]['stream'])
+            self.assertEqual(body.read(1), 'd')
+            self.assertEqual(body.read(), 'ata')
+            body.close()
+            response.raw.release_conn.assert_called_once_with()
+
+    def test_conditional_get_from_cache(self):
+        with self.settings(NHS_CHOICES_API_CACHE_DIR=self.cache_dir):
+            first = self.mock_response(200, 'data', {'ETag': '"abc"', 'Last-Modified': 'Wed, 01 May 2013 12:00:00 GMT'})
+            with patch.object(self.transport.session, 'request', return_value=first) as mock_request:
+                self.assertEqual(self.transport.get(self.url).read(), 'data')
+                self.assertEqual(mock_request.call_args[1]['headers'], {})
+
+            with patch.object(self.transport.session, 'request', return_value=self.mock_response(304)) as mock_request:
+                self.assertEqual(self.transport.get(self.url).read(), 'data')
+                self.assertEqual(mock_request.call_args[1]['headers'],
+                                 {'If-None-Match': '"abc"',
+                                  'If-Modified-Since': 'Wed, 01 May 2013 12:00:00 GMT'})
+
+            # A changed response replaces the cached one
+            changed = self.mock_response(200, 'new data', {'ETag': '"def"'})
+            with patch.object(self.transport.session, 'request', return_value=changed):
+                self.assertEqual(self.transport.get(self.url).read(), 'new data')
+            with patch.object(self.transport.session, 'request', return_value=self.mock_response(304)) as mock_request:
+                self.assertEqual(self.transport.get(self.url).read(), 'new data')
+                self.assertEqual(mock_request.call_args[1]['headers'], {'If-None-Match': '"def"'})
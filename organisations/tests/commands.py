@@ -9,7 +9,7 @@ from django.core.management import call_command
 from django.conf import settings
 from django.contrib.auth.models import User
 
-from .lib import create_test_organisation, create_test_ccg, create_test_service, create_test_problem, create_test_organisation_parent
+from .lib import create_test_organisation, create_test_ccg, create_test_service, create_test_problem, create_test_organisation_parent, create_review_with_age
 from .choices_api import ExampleFileAPITest
 from ..models import Organisation
 
@@ -50,3 +50,46 @@ class GetOrganisationRatingsFromChoicesAPITests(ExampleFileAPITest):
         # sufficient - I just didn't want to be explicit so that we keep the
         # data they give us as it is.
         self.assertAlmostEqual(organisation.average_recommendation_rating, 4.2857142857142856, places=3)
+
+    def test_missing_only(self):
+        organisation = create_test_organisation({'organisation_type': 'hospitals',
+                                                 'choices_id': 41265,
+                                                 'average_recommendation_rating': 3.0})
+        review = create_review_with_age(organisation, 1)
+        review.ratings.create(question='Friends and Family', answer='Neither', score=3)
+
+        stdout = StringIO()
+        self._call_command(missing_only=True, stdout=stdout)
+        self.assertEquals(stdout.getvalue(), '')
+
+        organisation = Organisation.objects.get(pk=organisation.id)
+        self.assertEqual(organisation.average_recommendation_rating, 3.0)
+
+    def test_missing_only_updates_organisations_without_rated_reviews(self):
+        # A rating from the API earlier, which has to be kept up to date
+        # because there are no reviews to calculate it from
+        organisation = create_test_organisation({'organisation_type': 'hospitals',
+                                                 'choices_id': 41265,
+                                                 'average_recommendation_rating': 3.0})
+
+        stdout = StringIO()
+        self._call_command(missing_only=True, stdout=stdout)
+        self.assertEquals(stdout.getvalue(), 'Updated rating for organisation Test Organisation\n')
+
+        organisation = Organisation.objects.get(pk=organisation.id)
+        self.assertAlmostEqual(organisation.average_recommendation_rating, 4.2857142857142856, places=3)
+
+
+class RefreshRecommendationRatingsTests(TestCase):
+
+    def test_refreshes_ratings(self):
+        organisation = create_test_organisation()
+        review = create_review_with_age(organisation, 1)
+        review.ratings.create(question='Friends and Family', answer='Likely', score=4)
+
+        stdout = StringIO()
+        call_command('refresh_recommendation_ratings', stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'Updated the rating of 1 organisations\n')
+
+        organisation = Organisation.objects.get(pk=organisation.id)
+        self.assertAlmostEqual(organisation.average_recommendation_rating, 4)
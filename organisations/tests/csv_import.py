@@ -13,7 +13,7 @@ from django.core.management import call_command
 from django.contrib.auth.models import User
 from django.forms.models import model_to_dict
 
-from ..models import Organisation, OrganisationParent, CCG
+from ..models import Organisation, OrganisationParent, CCG, Postcode
 
 import organisations
 from organisations import auth
@@ -41,6 +41,7 @@ class CsvImportTests(TestCase):
         self.other_users_csv   = csv_dir + 'other_users.csv'
         self.ccg_users_csv     = csv_dir + 'ccg_users.csv'
         self.trust_users_csv   = csv_dir + 'organisation_parent_users.csv'
+        self.postcodes_csv     = csv_dir + 'postcodes.csv'
 
         # Sample image file
         sample_hospital_image = os.path.join(
@@ -130,6 +131,10 @@ class CsvImportTests(TestCase):
         self.assertRegexpMatches(image_filename, image_filename_regex)
         del org_dict['image']
 
+        # And that a thumbnail was made for the map
+        self.assertNotEqual(org_dict.get('map_thumbnail'), '')
+        del org_dict['map_thumbnail']
+
         self.assertEqual(
             org_dict,
             {
@@ -149,6 +154,46 @@ class CsvImportTests(TestCase):
             }
         )
 
+    def test_organisations_bulk(self):
+        call_command('load_ccgs_from_csv', self.ccgs_csv)
+        call_command('load_organisation_parents_from_csv', self.trusts_csv)
+        call_command('load_organisations_from_csv', self.organisations_csv, bulk=True)
+
+        self.assertEqual(Organisation.objects.count(), 3)
+        self.assertEqual(OrganisationParent.objects.get(name="Ascot North Trust").organisations.count(), 2)
+        self.assertEqual(OrganisationParent.objects.get(name="Ascot South Trust").organisations.count(), 1)
+
+        organisation = Organisation.objects.get(ods_code="ANH1")
+        self.assertEqual(organisation.name, "Ascot North Hospital 1")
+        self.assertEqual(organisation.organisation_type, "hospitals")
+        self.assertEqual(organisation.choices_id, 11111)
+        self.assertEqual(organisation.address_line2, "")
+        self.assertEqual(organisation.postcode, "NW8 7BT ")
+        self.assertAlmostEqual(organisation.point.x, -0.167692)
+        self.assertAlmostEqual(organisation.point.y, 51.534324)
+        self.assertNotEqual(organisation.name_metaphone, "")
+        self.assertTrue(organisation.search_tokens.exists())
+        self.assertEqual([service.service_code for service in organisation.services.all()], ['84'])
+
+        # The image was fetched after the data was loaded
+        self.assertTrue(bool(organisation.image))
+        self.assertNotEqual(organisation.map_thumbnail, '')
+
+    def test_organisations_bulk_update(self):
+        call_command('load_ccgs_from_csv', self.ccgs_csv)
+        call_command('load_organisation_parents_from_csv', self.trusts_csv)
+        call_command('load_organisations_from_csv', self.organisations_csv, bulk=True)
+        Organisation.objects.filter(ods_code="ANH2").update(name="Old name")
+
+        # Loading again without --update leaves things alone
+        call_command('load_organisations_from_csv', self.organisations_csv, bulk=True)
+        self.assertEqual(Organisation.objects.count(), 3)
+        self.assertEqual(Organisation.objects.get(ods_code="ANH2").name, "Old name")
+
+        call_command('load_organisations_from_csv', self.organisations_csv, bulk=True, update=True)
+        self.assertEqual(Organisation.objects.count(), 3)
+        self.assertEqual(Organisation.objects.get(ods_code="ANH2").name, "Ascot North Hospital 2")
+
     def test_user_imports(self):
         # Load up some test CCGs and organisation parents
         call_command('load_ccgs_from_csv', self.ccgs_csv)
@@ -227,3 +272,32 @@ class CsvImportTests(TestCase):
         self.assertFalse(bool(org.image))
 
         urllib.urlretrieve.side_effect = None
+
+    def test_postcodes(self):
+        # A postcode that MapIt told us about before, which the file has
+        # a different location for
+        Postcode.remember('SW1A 1AA', None)
+
+        call_command('load_postcodes_from_csv', self.postcodes_csv)
+
+        # Four postcodes and one district, the terminated one is skipped
+        self.assertEqual(Postcode.objects.filter(partial=False).count(), 4)
+        self.assertFalse(Postcode.objects.filter(postcode='SW1A9ZZ').exists())
+
+        postcode = Postcode.objects.get(postcode='SW1A1AA')
+        self.assertAlmostEqual(postcode.point.x, -0.141588)
+        self.assertAlmostEqual(postcode.point.y, 51.501009)
+
+        # Postcodes without a location have no point
+        self.assertEqual(Postcode.objects.get(postcode='IM44RJ').point, None)
+
+        # Districts are in the middle of their postcodes
+        district = Postcode.objects.get(postcode='SW1A')
+        self.assertTrue(district.partial)
+        self.assertAlmostEqual(district.point.x, (-0.141588 - 0.127670 - 0.124663) / 3)
+        self.assertAlmostEqual(district.point.y, (51.501009 + 51.503541 + 51.499840) / 3)
+        self.assertFalse(Postcode.objects.filter(postcode='IM4').exists())
+
+        # Loading the file again doesn't make duplicates
+        call_command('load_postcodes_from_csv', self.postcodes_csv)
+        self.assertEqual(Postcode.objects.count(), 5)
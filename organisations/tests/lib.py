@@ -14,8 +14,8 @@ from django.core.urlresolvers import reverse
 from issues.models import Problem
 from reviews_display.models import Review
 
-from ..lib import interval_counts
-from ..models import Organisation, Service, CCG, OrganisationParent
+from ..lib import interval_counts, status_interval_counts, combined_interval_counts, refresh_problem_counts, refresh_review_counts, refresh_recommendation_ratings
+from ..models import Organisation, Service, CCG, OrganisationParent, DailyProblemCount, DailyReviewCount
 
 api_posting_id_counter = 328409234
 
@@ -542,6 +542,172 @@ class IntervalCountsTest(TestCase):
         self.assertEqual(counts[1]['ods_code'], duplicate_name_hospital.ods_code)
         self.assertEqual(counts[2]['ods_code'], self.test_hospital.ods_code)
 
+    def assert_rollup_matches_live_counts(self, **kwargs):
+        self.assertEqual(interval_counts(use_rollup=False, **kwargs),
+                         interval_counts(use_rollup=True, **kwargs))
+
+    def test_rollup_matches_live_counts(self):
+        self.assert_rollup_matches_live_counts()
+        self.assert_rollup_matches_live_counts(data_intervals=['all_time', 'all_time_open', 'all_time_closed'])
+        self.assert_rollup_matches_live_counts(data_type='reviews')
+        self.assert_rollup_matches_live_counts(organisation_filters={'organisation_id': self.test_hospital.id})
+        self.assert_rollup_matches_live_counts(organisation_filters={'ccg': self.test_ccg.id})
+        self.assert_rollup_matches_live_counts(problem_filters={'status': Problem.ABUSIVE})
+        self.assert_rollup_matches_live_counts(problem_filters={'service_code': 'ABC123'})
+        self.assert_rollup_matches_live_counts(problem_filters={'category': 'staff', 'breach': False})
+        self.assert_rollup_matches_live_counts(threshold=('four_weeks', 4))
+
+    def test_rollup_counts_problems_on_the_cutoff_day(self):
+        # The rollup only knows about whole days, so these check that the
+        # parts of days either side of the cutoff are counted correctly
+        now = datetime.utcnow().replace(tzinfo=utc)
+        create_test_problem({'organisation': self.test_gp_branch,
+                             'created': now - timedelta(days=7, minutes=-5)})
+        create_test_problem({'organisation': self.test_gp_branch,
+                             'created': now - timedelta(days=7, minutes=5)})
+        counts = interval_counts(organisation_filters={'organisation_id': self.test_gp_branch.id})
+        self.assertEqual(counts['week'], 3)
+        self.assertEqual(counts['four_weeks'], 5)
+        self.assert_rollup_matches_live_counts(organisation_filters={'organisation_id': self.test_gp_branch.id})
+
+    def test_rollup_updated_when_problems_change(self):
+        problem = Problem.objects.filter(organisation=self.test_hospital, status=Problem.ABUSIVE)[0]
+        problem.status = Problem.RESOLVED
+        problem.organisation = self.test_gp_branch
+        problem.save()
+        self.assert_rollup_matches_live_counts(data_intervals=['all_time', 'all_time_open', 'all_time_closed'])
+
+        problem.delete()
+        self.assert_rollup_matches_live_counts()
+
+    def test_rollup_updated_when_reviews_change(self):
+        review = Review.objects.filter(organisations=self.test_hospital, in_reply_to=None)[0]
+        review.organisations.add(self.test_gp_branch)
+        self.assert_rollup_matches_live_counts(data_type='reviews')
+
+        review.api_published = review.api_published - timedelta(days=30)
+        review.save()
+        self.assert_rollup_matches_live_counts(data_type='reviews')
+
+        review.delete()
+        self.assert_rollup_matches_live_counts(data_type='reviews')
+
+    def test_status_interval_counts(self):
+        statuses = [status for status, description in Problem.STATUS_CHOICES]
+        problem_filters = {'category': 'staff'}
+        for organisation_filters in [{'organisation_id': self.test_hospital.id},
+                                     {'organisation_ids': (self.test_hospital.id, self.test_gp_branch.id)}]:
+            for use_rollup in [True, False]:
+                counts_by_status = status_interval_counts(statuses=statuses,
+                                                          problem_filters=problem_filters,
+                                                          organisation_filters=organisation_filters,
+                                                          use_rollup=use_rollup)
+                self.assertEqual(sorted(counts_by_status.keys()), sorted(statuses))
+                for status in statuses:
+                    expected_counts = interval_counts(problem_filters={'category': 'staff', 'status': (status,)},
+                                                      organisation_filters=organisation_filters,
+                                                      use_rollup=use_rollup)
+                    self.assertEqual(expected_counts, counts_by_status[status])
+
+    def test_status_interval_counts_for_organisation_with_no_problems(self):
+        organisation = create_test_organisation({'ods_code': 'XXX777'})
+        counts_by_status = status_interval_counts(statuses=[Problem.NEW, Problem.ABUSIVE],
+                                                  organisation_filters={'organisation_id': organisation.id})
+        self.assertEqual(counts_by_status[Problem.NEW]['all_time'], 0)
+        self.assertEqual(counts_by_status[Problem.NEW]['happy_service'], None)
+        self.assertEqual(counts_by_status[Problem.ABUSIVE]['id'], organisation.id)
+
+    def test_combined_interval_counts(self):
+        problem_counts = interval_counts(extra_organisation_data=['average_recommendation_rating'])
+        review_counts = interval_counts(data_type='reviews')
+        expected_counts = [dict(problem_data.items() + review_data.items())
+                           for problem_data, review_data in zip(problem_counts, review_counts)]
+        self.assertEqual(expected_counts, combined_interval_counts(extra_organisation_data=['average_recommendation_rating']))
+
+        organisation_filters = {'organisation_id': self.test_hospital.id}
+        expected_counts = dict(interval_counts(organisation_filters=organisation_filters).items() +
+                               interval_counts(organisation_filters=organisation_filters, data_type='reviews').items())
+        self.assertEqual(expected_counts, combined_interval_counts(organisation_filters=organisation_filters))
+
+    def test_combined_interval_counts_threshold(self):
+        # The GP branch has no reviews but 5 problems in six months, and the
+        # hospital has 6 problems and 5 reviews
+        create_review_with_age(self.test_hospital, 15)
+        counts = combined_interval_counts(threshold=('six_months', 6))
+        self.assertEqual([self.test_hospital.id], [row['id'] for row in counts])
+
+        counts = combined_interval_counts(problem_filters={'status': Problem.ABUSIVE}, threshold=('six_months', 6))
+        self.assertEqual([self.test_hospital.id], [row['id'] for row in counts])
+        self.assertEqual(counts[0]['six_months'], 1)
+        self.assertEqual(counts[0]['reviews_six_months'], 6)
+
+        counts = combined_interval_counts(threshold=('six_months', 5))
+        self.assertEqual([self.test_gp_branch.id, self.test_hospital.id], [row['id'] for row in counts])
+
+    def test_rollup_can_be_rebuilt(self):
+        expected_counts = interval_counts()
+        DailyProblemCount.objects.all().delete()
+        DailyReviewCount.objects.all().delete()
+        refresh_problem_counts()
+        refresh_review_counts()
+        self.assertEqual(expected_counts, interval_counts())
+        self.assert_rollup_matches_live_counts(data_type='reviews')
+
+
+class RecommendationRatingsTest(TestCase):
+
+    def setUp(self):
+        self.hospital = create_test_organisation({'ods_code': 'HOS1', 'organisation_type': 'hospitals'})
+        self.surgery = create_test_organisation_parent({'code': 'GP1', 'choices_id': 5678})
+        self.gp_branch1 = create_test_organisation({'ods_code': 'GP1B1',
+                                                    'organisation_type': 'gppractices',
+                                                    'parent': self.surgery})
+        self.gp_branch2 = create_test_organisation({'ods_code': 'GP1B2',
+                                                    'organisation_type': 'gppractices',
+                                                    'parent': self.surgery})
+
+    def create_rated_review(self, organisations, score, attributes={}):
+        review = create_review_with_age(organisations[0], 1, attributes)
+        for organisation in organisations[1:]:
+            review.organisations.add(organisation)
+        review.ratings.create(question='Friends and Family', answer='Likely', score=score)
+        review.ratings.create(question='Clean', answer='Very clean', score=1)
+        return review
+
+    def fetch_rating(self, organisation):
+        return Organisation.objects.get(pk=organisation.id).average_recommendation_rating
+
+    def test_averages_friends_and_family_ratings(self):
+        review = self.create_rated_review([self.hospital], 5)
+        self.create_rated_review([self.hospital], 2)
+        # Replies aren't counted
+        self.create_rated_review([self.hospital], 1, {'api_category': 'reply', 'in_reply_to': review})
+
+        self.assertEqual(refresh_recommendation_ratings(), [self.hospital.id])
+        self.assertAlmostEqual(self.fetch_rating(self.hospital), 3.5)
+
+        # Nothing changes the second time
+        self.assertEqual(refresh_recommendation_ratings(), [])
+
+    def test_gp_branches_share_their_surgerys_rating(self):
+        # Reviews of a surgery are linked to all of its branches
+        self.create_rated_review([self.gp_branch1, self.gp_branch2], 5)
+        self.create_rated_review([self.gp_branch1, self.gp_branch2], 4)
+        # Even if one of them only made it to one branch
+        self.create_rated_review([self.gp_branch1], 3)
+
+        # Refreshing one branch refreshes the others too
+        changed = refresh_recommendation_ratings([self.gp_branch1.id])
+        self.assertEqual(sorted(changed), sorted([self.gp_branch1.id, self.gp_branch2.id]))
+        self.assertAlmostEqual(self.fetch_rating(self.gp_branch1), 4)
+        self.assertAlmostEqual(self.fetch_rating(self.gp_branch2), 4)
+
+    def test_organisations_without_reviews_keep_their_rating(self):
+        Organisation.objects.filter(pk=self.hospital.id).update(average_recommendation_rating=4.5)
+        refresh_recommendation_ratings()
+        self.assertAlmostEqual(self.fetch_rating(self.hospital), 4.5)
+        self.assertEqual(self.fetch_rating(self.gp_branch1), None)
+
 
 class AuthorizationTestCase(TestCase):
     """
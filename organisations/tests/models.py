@@ -1,5 +1,6 @@
 import datetime
 import os
+from cStringIO import StringIO
 
 from django.test import TestCase, TransactionTestCase
 from django.core import mail
@@ -208,6 +209,18 @@ class OrganisationMetaphoneTests(TestCase):
         self.organisation.save()
         self.assertEqual(self.organisation.name_metaphone, 'TSTRKNSXN')
 
+    def test_search_tokens_created_on_save(self):
+        self.organisation.save()
+        tokens = set(self.organisation.search_tokens.values_list('metaphone', flat=True))
+        self.assertEqual(tokens, set(['TST', 'ARKNSXN']))
+
+    def test_search_tokens_updated_when_name_changes(self):
+        self.organisation.save()
+        self.organisation.name = u'Renamed Organisation'
+        self.organisation.save()
+        tokens = set(self.organisation.search_tokens.values_list('metaphone', flat=True))
+        self.assertEqual(tokens, set(['RNMT', 'ARKNSXN']))
+
 
 class CreateTestOrganisationParentMixin(object):
     ods_counter = 0
@@ -589,6 +602,29 @@ class FriendsAndFamilySurveyModelTests(TransactionTestCase):
             FriendsAndFamilySurvey.process_csv(self.trust_fixture_file, today, 'trust', 'aande')
             self.assertEqual(cm.exception.message, "There is already a survey for Test Trust for the month January, 2013 and location A&E. Please delete the existing survey first if you're trying to replace it.")
 
+    def test_duplicate_site_in_csv(self):
+        today = datetime.date.today()
+
+        duplicate_site_csv = StringIO(self.site_fixture_file.read() +
+                                      "Q44,TRUST1,Test Trust,F84021,Test Organisation,498,\"1,303\",38.20%,79,,346,79,6,0,0,67\n")
+        with self.assertRaises(IntegrityError):
+            FriendsAndFamilySurvey.process_csv(duplicate_site_csv, today, 'site', 'aande')
+        # Nothing should have been created
+        self.assertEqual(FriendsAndFamilySurvey.objects.all().count(), 0)
+
+    def test_process_csv_queries(self):
+        today = datetime.date.today()
+        # Make sure the ContentTypes are cached, so that we can count the
+        # queries
+        ContentType.objects.get_for_model(Organisation)
+
+        # One to look up the organisations, one for existing surveys, one to
+        # create them all
+        with self.assertNumQueries(3):
+            created, skipped = FriendsAndFamilySurvey.process_csv(self.site_fixture_file, today, 'site', 'aande')
+        self.assertEqual(len(created), 2)
+        self.assertEqual(skipped, [])
+
     def test_total_responses(self):
         now = datetime.date.today()
 
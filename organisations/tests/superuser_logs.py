@@ -1,8 +1,12 @@
+from mock import patch
+
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
 
 from issues.models import Problem
 
 from ..models import SuperuserLogEntry
+from ..middleware import SuperuserLogBuffer, superuser_log_buffer
 from .lib import AuthorizationTestCase, create_test_problem
 
 
@@ -44,6 +48,20 @@ class SuperuserLogTests(AuthorizationTestCase):
             self.client.get(path)
             self.assertIsNotNone(SuperuserLogEntry.objects.get(user=self.nhs_superuser, path=path))
 
+    @override_settings(SUPERUSER_LOG_FLUSH_SECONDS=5)
+    def test_superuser_access_logged_when_buffer_flushed(self):
+        # Don't start the background thread, we want to flush it ourselves
+        with patch.object(SuperuserLogBuffer, 'ensure_running'):
+            self.login_as(self.nhs_superuser)
+            for path in self.test_urls:
+                self.client.get(path)
+            self.assertEqual(SuperuserLogEntry.objects.filter(user=self.nhs_superuser).count(), 0)
+
+            superuser_log_buffer.flush()
+
+        for path in self.test_urls:
+            self.assertIsNotNone(SuperuserLogEntry.objects.get(user=self.nhs_superuser, path=path))
+
     def test_other_user_access_not_logged(self):
         for user in self.users_who_should_not_be_logged:
 
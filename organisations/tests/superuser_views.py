@@ -1,6 +1,8 @@
 # encoding: utf-8
 import unicodecsv
 from StringIO import StringIO
+from datetime import timedelta
+from mock import patch
 
 # Django imports
 from django.core.urlresolvers import reverse
@@ -10,7 +12,8 @@ from django.test.utils import override_settings
 # App imports
 from issues.models import Problem
 
-from .lib import create_test_problem, AuthorizationTestCase
+from ..views.superusers import ProblemsCSV
+from .lib import create_test_problem, create_problem_with_age, AuthorizationTestCase
 
 
 @override_settings(SUMMARY_THRESHOLD=None)
@@ -240,3 +243,50 @@ class ProblemsCSVTests(AuthorizationTestCase):
         ]
         for row, expected_row in zip(reader, expected_rows):
             self.assertEqual(row, expected_row)
+
+    def csv_problem_ids(self, url):
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        reader = unicodecsv.reader(StringIO(resp.content))
+        # Skip the header row
+        reader.next()
+        return [int(row[0]) for row in reader]
+
+    def test_csv_is_streamed_in_chunks(self):
+        self.login_as(self.superuser)
+        resp = self.client.get(self.download_url)
+        self.assertEqual(resp['Content-Type'], 'text/csv')
+        expected_ids = [self.test_problem.id, self.test_closed_problem.id, self.test_utf8_problem.id]
+        with patch.object(ProblemsCSV, 'chunk_size', 2):
+            self.assertEqual(self.csv_problem_ids(self.download_url), expected_ids)
+        with patch.object(ProblemsCSV, 'chunk_size', 1):
+            self.assertEqual(self.csv_problem_ids(self.download_url), expected_ids)
+
+    def test_csv_with_no_problems_has_header(self):
+        Problem.objects.all().delete()
+        self.login_as(self.superuser)
+        self.assertEqual(self.csv_problem_ids(self.download_url), [])
+
+    def test_csv_filters_by_organisation(self):
+        other_problem = create_test_problem({'organisation': self.test_gp_branch})
+        self.login_as(self.superuser)
+        url = "{0}?organisation={1}".format(self.download_url, self.test_gp_branch.id)
+        self.assertEqual(self.csv_problem_ids(url), [other_problem.id])
+
+    def test_csv_filters_by_date_range(self):
+        old_problem = create_problem_with_age(self.test_hospital, 30)
+        older_problem = create_problem_with_age(self.test_hospital, 60)
+        self.login_as(self.superuser)
+        start = (timezone.now() - timedelta(days=45)).strftime('%Y-%m-%d')
+        end = (timezone.now() - timedelta(days=15)).strftime('%Y-%m-%d')
+        url = "{0}?start={1}&end={2}".format(self.download_url, start, end)
+        self.assertEqual(self.csv_problem_ids(url), [old_problem.id])
+        url = "{0}?end={1}".format(self.download_url, end)
+        self.assertEqual(self.csv_problem_ids(url), [older_problem.id, old_problem.id])
+
+    def test_csv_rejects_invalid_filters(self):
+        self.login_as(self.superuser)
+        resp = self.client.get("{0}?start=not-a-date".format(self.download_url))
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get("{0}?start=2013-02-01&end=2013-01-01".format(self.download_url))
+        self.assertEqual(resp.status_code, 400)
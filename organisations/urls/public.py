@@ -10,6 +10,7 @@ urlpatterns = patterns(
     '',
     url(r'^map$', Map.as_view(), name='org-map'),
     url(r'^map/search$', MapSearch.as_view(), name='org-map-search'),
+    url(r'^map/tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)$', MapTile.as_view(), name='org-map-tile'),
     url(r'^map/(?P<ods_code>\w+)$', MapOrganisationCoords.as_view(), name='org-coords-map'),
     url(r'^pick-provider$', OrganisationPickProvider.as_view(), name='org-pick-provider'),
     url(r'^summary$', Summary.as_view(), name='org-all-summary'),
@@ -11,21 +11,21 @@ from django_tables2 import RequestConfig
 from django.conf import settings
 from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.contrib.gis.geos import Polygon
+from django.core.cache import cache
 
 # App imports
 from citizenconnect.shortcuts import render
 from issues.models import Problem
 from geocoder.models import Place
 
-from .. import auth
+from .. import auth, map_tiles
 from ..models import Organisation
 from ..forms import OrganisationFinderForm, FilterForm, MapitPostCodeLookup, MapitError
-from ..lib import interval_counts
+from ..lib import combined_interval_counts
+from ..search import search_organisations
 from ..tables import NationalSummaryTable
 from ..templatetags.organisation_extras import formatted_time_interval, percent
 
-from sorl.thumbnail import get_thumbnail
-
 
 class PrivateViewMixin(object):
     """
@@ -164,7 +164,7 @@ class OrganisationSearch(TemplateView):
         if not len(term):
             return context
 
-        organisations = Organisation.objects.filter(name__icontains=term)
+        organisations = search_organisations(term)
 
         for obj in organisations[:8]:
             to_serialize.append({
@@ -202,26 +202,34 @@ class Map(FilterFormMixin,
     def get_context_data(self, **kwargs):
         context = super(Map, self).get_context_data(**kwargs)
 
-        problem_filters, organisation_filters = self.interval_count_filters(context['selected_filters'])
+        # Load all the organisations to use for the name select
+        context['name_search_organisations'] = Organisation.objects.all().only('id', 'name').order_by('name')
+        context['ods_code'] = self.request.GET.get('ods_code', '')
+        context['lon'] = self.request.GET.get('lon', '')
+        context['lat'] = self.request.GET.get('lat', '')
+
+        return context
 
-        organisations_within_map_bounds_ids = [col.id for col in self.organisations_within_map_bounds()]
+    def organisations_data(self, selected_filters):
+        """
+        Get a list of dictionaries of the data to show on the map for each
+        organisation within the map bounds.
+        """
+        problem_filters, organisation_filters = self.interval_count_filters(selected_filters)
+
+        organisations_within_map_bounds_ids = list(self.organisations_within_map_bounds().values_list('id', flat=True))
         organisations_list = []
 
         if len(organisations_within_map_bounds_ids):
             # Query for summary counts for the organisations within the map bounds.
             organisation_filters['organisation_ids'] = tuple(organisations_within_map_bounds_ids)
 
-            organisations_problem_data = interval_counts(problem_filters=problem_filters,
-                                                 organisation_filters=organisation_filters,
-                                                 extra_organisation_data=['coords', 'type', 'average_recommendation_rating'],
-                                                 data_intervals=['all_time_open', 'all_time_closed'],
-                                                 average_fields=['time_to_address'],
-                                                 boolean_fields=['happy_outcome'])
-            organisations_review_data = interval_counts(organisation_filters=organisation_filters,
-                                                        data_type='reviews')
-
-            for problem_data, review_data in zip(organisations_problem_data, organisations_review_data):
-                organisations_list.append(dict(problem_data.items() + review_data.items()))
+            organisations_list = combined_interval_counts(problem_filters=problem_filters,
+                                                          organisation_filters=organisation_filters,
+                                                          extra_organisation_data=['coords', 'type', 'average_recommendation_rating', 'image'],
+                                                          problem_data_intervals=['all_time_open', 'all_time_closed'],
+                                                          average_fields=['time_to_address'],
+                                                          boolean_fields=['happy_outcome'])
 
         for org_data in organisations_list:
             org_data['url'] = reverse('public-org-summary',
@@ -229,20 +237,12 @@ class Map(FilterFormMixin,
                                               'cobrand': self.kwargs['cobrand']})
             org_data['average_time_to_address'] = formatted_time_interval(org_data['average_time_to_address'])
             org_data['happy_outcome'] = percent(org_data['happy_outcome'])
-            org = Organisation.objects.get(ods_code=org_data['ods_code'])
-            if org.image:
-                org_data['thumbnail_url'] = get_thumbnail(org.image, '60x60').url
-
-        # Make it into a JSON string
-        context['organisations'] = json.dumps(organisations_list)
-
-        # Load all the organisations to use for the name select
-        context['name_search_organisations'] = Organisation.objects.all().only('id', 'name').order_by('name')
-        context['ods_code'] = self.request.GET.get('ods_code', '')
-        context['lon'] = self.request.GET.get('lon', '')
-        context['lat'] = self.request.GET.get('lat', '')
+            image = org_data.pop('image')
+            map_thumbnail = org_data.pop('map_thumbnail')
+            if image:
+                org_data['thumbnail_url'] = Organisation.map_thumbnail_url(org_data['id'], image, map_thumbnail)
 
-        return context
+        return organisations_list
 
     def render_to_response(self, context, **response_kwargs):
         """
@@ -250,7 +250,10 @@ class Map(FilterFormMixin,
         and use the standard TemplateView method otherwise.
         """
         if self.request.GET.get('format') == 'json':
-            return HttpResponse(context['organisations'],
+            # The page itself loads its organisations from the map tiles, so
+            # they're only worked out here
+            organisations = json.dumps(self.organisations_data(context['selected_filters']))
+            return HttpResponse(organisations,
                                 content_type='application/json',
                                 **response_kwargs)
         else:
@@ -271,6 +274,57 @@ class Map(FilterFormMixin,
         return Organisation.objects.filter(point__within=map_bounds)
 
 
+class MapTile(Map):
+    """
+    The data for the organisations within one z/x/y tile of the map, as JSON.
+
+    Tiles are cached until the data for one of the organisations within them
+    changes (see map_tiles.invalidate_map_tiles). Below
+    settings.MAP_TILE_CLUSTER_ZOOM, organisations which are close together
+    are returned as clusters rather than individually.
+    """
+
+    def get_context_data(self, **kwargs):
+        # Skip Map's context, it's only needed for the html page
+        context = super(Map, self).get_context_data(**kwargs)
+
+        zoom, x, y = int(self.kwargs['z']), int(self.kwargs['x']), int(self.kwargs['y'])
+        if not map_tiles.is_valid_tile(zoom, x, y):
+            raise Http404
+
+        # The organisation urls depend on the cobrand, so that's part of the
+        # cache key too
+        cache_filters = dict(context['selected_filters'], cobrand=self.kwargs['cobrand'])
+        cache_key = map_tiles.tile_cache_key(zoom, x, y, cache_filters)
+        tile_json = cache.get(cache_key)
+
+        if tile_json is None:
+            organisations_list = self.organisations_data(context['selected_filters'])
+            if zoom < settings.MAP_TILE_CLUSTER_ZOOM:
+                organisations_list, clusters = map_tiles.cluster_organisations(organisations_list, zoom)
+            else:
+                clusters = []
+            tile_json = json.dumps({'z': zoom,
+                                    'x': x,
+                                    'y': y,
+                                    'organisations': organisations_list,
+                                    'clusters': clusters})
+            cache.set(cache_key, tile_json, settings.MAP_TILE_CACHE_SECONDS)
+
+        context['tile'] = tile_json
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        return HttpResponse(context['tile'], content_type='application/json', **response_kwargs)
+
+    def organisations_within_map_bounds(self):
+        """
+        Get a QuerySet of all the organisations within the tile.
+        """
+        tile_polygon = map_tiles.tile_polygon(int(self.kwargs['z']), int(self.kwargs['x']), int(self.kwargs['y']))
+        return Organisation.objects.filter(point__within=tile_polygon)
+
+
 class MapOrganisationCoords(TemplateView):
 
     def get_context_data(self, **kwargs):
@@ -433,29 +487,12 @@ class Summary(FilterFormMixin, PrivateViewMixin, TemplateView):
         return context
 
     def get_interval_counts(self, problem_filters, organisation_filters, threshold):
-        organisation_problem_data = interval_counts(problem_filters=problem_filters,
-                                                    organisation_filters=organisation_filters)
-        organisation_review_data = interval_counts(organisation_filters=organisation_filters,
-                                                   data_type='reviews',
-                                                   extra_organisation_data=['average_recommendation_rating'])
-        organisation_data = []
-        if threshold:
-            interval, cutoff = threshold
-
-        for problem_data, review_data in zip(organisation_problem_data, organisation_review_data):
-            if (not threshold) or (problem_data[interval] >= cutoff or
-                review_data['reviews_' + interval] >= cutoff):
-                # This assumes that the lists are in the same order, so it's
-                # safe to iterate over them in lockstep like this
-                assert problem_data['ods_code'] == review_data['ods_code'], \
-                    "Problem ods_code {0} != Review ods_code {1} (Check the ORDER BY in interval_counts)".format(
-                            problem_data['ods_code'],
-                            review_data['ods_code']
-                        )
-
-                organisation_data.append(dict(problem_data.items() + review_data.items()))
-
-        return organisation_data
+        # Organisations are shown if either their problem or their review
+        # count for the threshold interval is high enough
+        return combined_interval_counts(problem_filters=problem_filters,
+                                        organisation_filters=organisation_filters,
+                                        threshold=threshold,
+                                        extra_organisation_data=['average_recommendation_rating'])
 
 
 class PrivateHome(TemplateView):
@@ -9,7 +9,7 @@ from issues.models import Problem
 
 from ..auth import enforce_organisation_parent_access_check
 from ..models import OrganisationParent, FriendsAndFamilySurvey
-from ..lib import interval_counts
+from ..lib import interval_counts, status_interval_counts
 from ..tables import ProblemDashboardTable
 from ..forms import SurveyLocationForm
 
@@ -74,12 +74,15 @@ class OrganisationParentSummary(OrganisationParentAwareViewMixin, FilterFormMixi
 
             context['problems_summary_stats'] = self.get_interval_counts(problem_filters=count_filters,
                                                                          organisation_filters=organisation_filters)
+            # Get the counts for every status in one go, rather than asking
+            # for each status separately
+            del count_filters['status']
+            counts_by_status = status_interval_counts(statuses=[status for status, description in status_rows],
+                                                      problem_filters=count_filters,
+                                                      organisation_filters=organisation_filters)
             status_list = []
             for status, description in status_rows:
-                count_filters['status'] = (status,)
-                status_counts = self.get_interval_counts(problem_filters=count_filters,
-                                                         organisation_filters=organisation_filters)
-                del count_filters['status']
+                status_counts = self.aggregate_interval_counts(counts_by_status[status])
                 status_counts['description'] = description
                 status_counts['status'] = status
                 if status in Problem.VISIBLE_STATUSES:
@@ -105,7 +108,11 @@ class OrganisationParentSummary(OrganisationParentAwareViewMixin, FilterFormMixi
     def get_interval_counts(self, problem_filters, organisation_filters):
         organisation_problem_data = interval_counts(problem_filters=problem_filters,
                                                     organisation_filters=organisation_filters)
+        return self.aggregate_interval_counts(organisation_problem_data)
 
+    def aggregate_interval_counts(self, organisation_problem_data):
+        """Combine the interval counts for each organisation into one set of
+        counts for the whole organisation parent"""
         count_attributes = ['all_time',
                             'week',
                             'four_weeks',
@@ -11,7 +11,7 @@ from .. import auth
 from ..auth import enforce_organisation_access_check, user_in_group
 from ..models import Organisation, FriendsAndFamilySurvey
 from ..forms import OrganisationFilterForm, SurveyLocationForm
-from ..lib import interval_counts
+from ..lib import interval_counts, status_interval_counts
 
 from .base import PrivateViewMixin, PickProviderBase, FilterFormMixin
 
@@ -104,12 +104,15 @@ class OrganisationSummary(OrganisationAwareViewMixin,
 
         context['problems_summary_stats'] = interval_counts(problem_filters=count_filters,
                                                             organisation_filters=organisation_filters)
+        # Get the counts for every status in one go, rather than asking for
+        # each status separately
+        del count_filters['status']
+        counts_by_status = status_interval_counts(statuses=[status for status, description in status_rows],
+                                                  problem_filters=count_filters,
+                                                  organisation_filters=organisation_filters)
         status_list = []
         for status, description in status_rows:
-            count_filters['status'] = (status,)
-            status_counts = interval_counts(problem_filters=count_filters,
-                                            organisation_filters=organisation_filters)
-            del count_filters['status']
+            status_counts = counts_by_status[status]
             status_counts['description'] = description
             status_counts['status'] = status
             if status in Problem.VISIBLE_STATUSES:
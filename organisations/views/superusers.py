@@ -1,10 +1,12 @@
 import unicodecsv
-from datetime import datetime, timedelta
+from cStringIO import StringIO
+from datetime import datetime, timedelta, time
 
 # Django imports
 from django.views.generic import View, TemplateView
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.db.models import Q
 from django.utils import timezone
 from django.template.defaultfilters import pluralize
 
@@ -12,6 +14,7 @@ from issues.models import Problem
 
 from ..auth import user_is_superuser
 from ..models import SuperuserLogEntry, CCG, OrganisationParent
+from ..forms import ProblemsCSVFilterForm
 
 
 class SuperuserOnlyMixin(object):
@@ -63,101 +66,166 @@ class ProblemsCSV(SuperuserOnlyMixin, View):
         else:
             return "%d minute%s" % (d.minute, pluralize(d.minute))
 
+    # How many problems to load from the database at a time
+    chunk_size = 1000
+
+    date_format = '%d/%m/%Y %H:%M'
+
+    # Define the field names
+    field_names = [
+        # This has to lowercase because otherwise Excel thinks this is a
+        # SYLK file - no, really: http://support.microsoft.com/kb/323626
+        'id',
+        'Organisation',
+        'Service',
+        'Created',
+        'Status',
+        'Privacy', # Public and Public Reporter name in one field
+        'Category',
+        'Original Description',
+        'Moderated Description',
+        'Reporter Name',
+        'Reporter Email',
+        'Reporter Phone',
+        'Preferred Contact Method',
+        'Source',
+        'Website', # cobrand in the model
+        'Published', # publication_status in the model
+        'Priority',
+        'Under 16',
+        'Breach',
+        'Commissioned',
+        'Formal Complaint',
+        'Time to Acknowledge',
+        'Time to Address',
+        'Last Modified',
+        'Resolved',
+        'Survey Sent',
+        'Happy with Service',
+        'Happy with Outcome',
+    ]
+
     def get(self, request, *args, **kwargs):
         """Custom Admin view which allows the user to download a CSV of all
-        the problems in the database."""
+        the problems in the database, optionally filtered to an organisation
+        and/or a date range with the organisation, start and end GET params.
+
+        The CSV is streamed out as it's generated, rather than built up in
+        memory, so that very large downloads don't use up all the memory or
+        time out waiting for the first byte."""
 
-        date_format = '%d/%m/%Y %H:%M'
+        form = ProblemsCSVFilterForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text(), content_type='text/plain')
+
+        problems = self.filter_problems(Problem.objects.all(), form.cleaned_data)
 
         # Create the HttpResponse object with the appropriate CSV header.
-        response = HttpResponse(content_type='text/csv')
+        # Giving it an iterator means the rows are sent as they're made.
+        response = HttpResponse(self.csv_chunks(problems), content_type='text/csv')
         filename = 'careconnect-problems-{0}.csv'.format(timezone.now().strftime('%d-%m-%Y'))
         response['Content-Disposition'] = 'attachment; filename="{0}"'.format(filename)
+        return response
 
-        # Define the field names
-        field_names = [
-            # This has to lowercase because otherwise Excel thinks this is a
-            # SYLK file - no, really: http://support.microsoft.com/kb/323626
-            'id',
-            'Organisation',
-            'Service',
-            'Created',
-            'Status',
-            'Privacy', # Public and Public Reporter name in one field
-            'Category',
-            'Original Description',
-            'Moderated Description',
-            'Reporter Name',
-            'Reporter Email',
-            'Reporter Phone',
-            'Preferred Contact Method',
-            'Source',
-            'Website', # cobrand in the model
-            'Published', # publication_status in the model
-            'Priority',
-            'Under 16',
-            'Breach',
-            'Commissioned',
-            'Formal Complaint',
-            'Time to Acknowledge',
-            'Time to Address',
-            'Last Modified',
-            'Resolved',
-            'Survey Sent',
-            'Happy with Service',
-            'Happy with Outcome',
-        ]
+    def filter_problems(self, problems, filters):
+        """Filter a queryset of problems by the cleaned data from a
+        ProblemsCSVFilterForm"""
+        if filters.get('organisation'):
+            problems = problems.filter(organisation=filters['organisation'])
+        if filters.get('start'):
+            # We have to make this a timezone-aware datetime to keep the ORM happy
+            problems = problems.filter(created__gte=datetime.combine(filters['start'], time.min).replace(tzinfo=timezone.utc))
+        if filters.get('end'):
+            problems = problems.filter(created__lte=datetime.combine(filters['end'], time.max).replace(tzinfo=timezone.utc))
+        return problems
+
+    def problem_chunks(self, problems):
+        """Generate lists of up to chunk_size problems from a queryset, in the
+        order they were created, with their organisation and service loaded.
+
+        Each chunk is a separate query which seeks from the end of the
+        previous one, so only one chunk is ever held in memory and later
+        chunks don't get any slower to fetch (as they would with an OFFSET)."""
+        problems = problems.select_related('organisation', 'service').order_by('created', 'id')
+        last_problem = None
+        while True:
+            chunk = problems
+            if last_problem is not None:
+                chunk = chunk.filter(Q(created__gt=last_problem.created) |
+                                     Q(created=last_problem.created, id__gt=last_problem.id))
+            chunk = list(chunk[:self.chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_problem = chunk[-1]
+
+    def csv_chunks(self, problems):
+        """Generate the CSV for a queryset of problems, a chunk of rows at a
+        time"""
+        buffer = StringIO()
 
         # Make a csv writer
         # Write a BOM (Excel needs it to open UTF-8 file properly)
-        response.write(u'\ufeff'.encode('utf8'))
-        writer = unicodecsv.DictWriter(response, field_names)
+        buffer.write(u'\ufeff'.encode('utf8'))
+        writer = unicodecsv.DictWriter(buffer, self.field_names)
 
         # Write out a heading row
         # Note: If we only had to support Python 2.7 we could use:
         # http://docs.python.org/2/library/csv.html#csv.DictWriter.writeheader
-        writer.writerow(dict([(f,f) for f in field_names]))
+        writer.writerow(dict([(f,f) for f in self.field_names]))
 
         # Write out the problems
-        for problem in Problem.objects.all().order_by("created"):
-            if not problem.public:
-                problem_privacy = "Private"
+        for chunk in self.problem_chunks(problems):
+            for problem in chunk:
+                writer.writerow(self.problem_row(problem))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        # Make sure the header gets sent even if there are no problems
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def problem_row(self, problem):
+        """Return the CSV row for a problem, as a dictionary keyed by field
+        name"""
+        date_format = self.date_format
+
+        if not problem.public:
+            problem_privacy = "Private"
+        else:
+            if problem.public_reporter_name:
+                problem_privacy = "Public with reporter name"
             else:
-                if problem.public_reporter_name:
-                    problem_privacy = "Public with reporter name"
-                else:
-                    problem_privacy = "Public, anonymous"
-
-            problem_row = {
-                'id': problem.id,
-                'Organisation': problem.organisation.name,
-                'Service': problem.service.name if problem.service else "",
-                'Created': problem.created.strftime(date_format),
-                'Status': problem.get_status_display(),
-                'Privacy': problem_privacy,
-                'Category': problem.get_category_display(),
-                'Original Description': problem.description,
-                'Moderated Description': problem.moderated_description,
-                'Reporter Name': problem.reporter_name,
-                'Reporter Email': problem.reporter_email,
-                'Reporter Phone': problem.reporter_phone,
-                'Preferred Contact Method': problem.preferred_contact_method,
-                'Source': problem.source,
-                'Website': problem.cobrand,
-                'Published': problem.get_publication_status_display(),
-                'Priority': "High" if (problem.priority == 50) else 'Normal',
-                'Under 16': str(problem.reporter_under_16),
-                'Breach': str(problem.breach),
-                'Commissioned': problem.get_commissioned_display(),
-                'Formal Complaint': str(problem.formal_complaint),
-                'Time to Acknowledge': self.minutes_as_days_hours_mins(problem.time_to_acknowledge),
-                'Time to Address': self.minutes_as_days_hours_mins(problem.time_to_address),
-                'Last Modified': problem.modified.strftime(date_format) if problem.modified else "",
-                'Resolved': problem.resolved.strftime(date_format) if problem.resolved else "",
-                'Survey Sent': problem.survey_sent.strftime(date_format) if problem.survey_sent else "",
-                'Happy with Service': problem.happy_service,
-                'Happy with Outcome': problem.happy_outcome,
-            }
-            writer.writerow(problem_row)
-
-        return response
+                problem_privacy = "Public, anonymous"
+
+        return {
+            'id': problem.id,
+            'Organisation': problem.organisation.name,
+            'Service': problem.service.name if problem.service else "",
+            'Created': problem.created.strftime(date_format),
+            'Status': problem.get_status_display(),
+            'Privacy': problem_privacy,
+            'Category': problem.get_category_display(),
+            'Original Description': problem.description,
+            'Moderated Description': problem.moderated_description,
+            'Reporter Name': problem.reporter_name,
+            'Reporter Email': problem.reporter_email,
+            'Reporter Phone': problem.reporter_phone,
+            'Preferred Contact Method': problem.preferred_contact_method,
+            'Source': problem.source,
+            'Website': problem.cobrand,
+            'Published': problem.get_publication_status_display(),
+            'Priority': "High" if (problem.priority == 50) else 'Normal',
+            'Under 16': str(problem.reporter_under_16),
+            'Breach': str(problem.breach),
+            'Commissioned': problem.get_commissioned_display(),
+            'Formal Complaint': str(problem.formal_complaint),
+            'Time to Acknowledge': self.minutes_as_days_hours_mins(problem.time_to_acknowledge),
+            'Time to Address': self.minutes_as_days_hours_mins(problem.time_to_address),
+            'Last Modified': problem.modified.strftime(date_format) if problem.modified else "",
+            'Resolved': problem.resolved.strftime(date_format) if problem.resolved else "",
+            'Survey Sent': problem.survey_sent.strftime(date_format) if problem.survey_sent else "",
+            'Happy with Service': problem.happy_service,
+            'Happy with Outcome': problem.happy_outcome,
+        }
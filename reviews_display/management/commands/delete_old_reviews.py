@@ -1,3 +1,5 @@
+from optparse import make_option
+
 from django.core.management.base import NoArgsCommand
 
 from ...models import Review
@@ -6,5 +8,26 @@ from ...models import Review
 class Command(NoArgsCommand):
     help = 'Delete reviews from the database that are older than NHS_CHOICES_API_MAX_REVIEW_AGE_IN_DAYS'
 
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--chunk-size',
+            action='store',
+            dest='chunk_size',
+            type='int',
+            default=1000,
+            help='How many review ids to delete the reviews in before committing.'
+        ),
+    )
+
     def handle_noargs(self, *args, **options):
-        Review.delete_old_reviews()
+        verbosity = int(options.get('verbosity'))
+        chunk_size = max(int(options.get('chunk_size') or 1000), 1)
+
+        def progress(deleted, done_up_to_id, max_id):
+            if verbosity >= 2:
+                self.stdout.write("Deleted {0} reviews, up to id {1} of {2}\n".format(deleted, done_up_to_id, max_id))
+
+        deleted = Review.delete_old_reviews(chunk_size, progress)
+
+        if verbosity >= 2:
+            self.stdout.write("Deleted {0} old reviews\n".format(deleted))
@@ -1,22 +1,35 @@
 import datetime
+import Queue
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 from optparse import make_option
 
 from django.core.management.base import NoArgsCommand
 from django.conf import settings
 
 from ...reviews_api import ReviewsAPI
-from ...models import Review, OrganisationFromApiDoesNotExist, RepliedToReviewDoesNotExist
+from ...models import Review, RepliedToReviewDoesNotExist
 
 
 class Command(NoArgsCommand):
     help = 'Fetch reviews from choices API (by default those changed in the last seven days)'
 
+    # How many reviews to save at once
+    batch_size = 100
+
     option_list = NoArgsCommand.option_list + (
         make_option('--all',
                     action='store_true',
                     dest='fetch_all',
                     default=False,
                     help='Fetch all reviews, not just those changed in last seven days'),
+        make_option('--workers',
+                    action='store',
+                    dest='workers',
+                    type='int',
+                    default=None,
+                    help='Fetch this many pages of reviews of each organisation type from the API at once '
+                         '(default: settings.NHS_CHOICES_API_REVIEW_WORKERS)'),
     )
 
     # @transaction.commit_manually
@@ -32,15 +45,53 @@ class Command(NoArgsCommand):
                 self.stdout.write("Fetching up to 100 reviews from the past week\n")
             one_week_ago = datetime.date.today() - datetime.timedelta(days=7)
             api_args = dict(since=one_week_ago, max_fetch=100)
+        workers = options.get('workers')
+        if workers is None:
+            workers = settings.NHS_CHOICES_API_REVIEW_WORKERS
+        api_args['workers'] = max(int(workers or 1), 1)
+
+        # Each organisation type's reviews are fetched by a thread of its own
+        # (with its own pool of workers fetching pages), and handed back here
+        # a batch at a time to be saved, so that the database is only used
+        # from this thread. The queue is bounded so that the fetching doesn't
+        # get too far ahead of the saving.
+        types = list(settings.ORGANISATION_TYPES)
+        batches = Queue.Queue(maxsize=len(types) * 2)
+
+        def fetch(type):
+            try:
+                reviews = ReviewsAPI(organisation_type=type, **api_args)
+                while True:
+                    batch = list(islice(reviews, self.batch_size))
+                    if not batch:
+                        break
+                    batches.put((type, batch, None))
+                batches.put((type, None, None))
+            except Exception as e:
+                batches.put((type, None, e))
 
-        for type in settings.ORGANISATION_TYPES:
-            reviews = ReviewsAPI(organisation_type=type, **api_args)
+        pool = ThreadPool(len(types))
+        try:
+            for type in types:
+                pool.apply_async(fetch, (type,))
 
-            for review in reviews:
+            finished = 0
+            while finished < len(types):
+                type, batch, error = batches.get()
+                if error is not None:
+                    raise error
+                if batch is None:
+                    finished += 1
+                    continue
+                for result in Review.upsert_or_delete_from_api_data_batch(batch, type):
+                    if isinstance(result, RepliedToReviewDoesNotExist):
+                        if verbosity >= 1:
+                            self.stdout.write('RepliedToReviewDoesNotExist: ' + str(result) + " - skipping\n")
+        finally:
+            # Don't leave anything blocked waiting to hand us a batch
+            while True:
                 try:
-                    Review.upsert_or_delete_from_api_data(review, type)
-                except OrganisationFromApiDoesNotExist:
-                    pass
-                except RepliedToReviewDoesNotExist, e:
-                    if verbosity >= 1:
-                        self.stdout.write('RepliedToReviewDoesNotExist: ' + str(e) + " - skipping\n")
+                    batches.get_nowait()
+                except Queue.Empty:
+                    break
+            pool.terminate()
@@ -3,12 +3,15 @@ from dateutil.parser import parse as dateutil_parse
 import pytz
 
 from django.conf import settings
-from django.db import models
-from django.forms.models import model_to_dict
+from django.db import models, connection, transaction
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.text import Truncator
 
 from organisations.models import Organisation, OrganisationParent
-from citizenconnect.models import AuditedModel
+from organisations.lib import refresh_review_counts, refresh_recommendation_ratings, utc_day
+from citizenconnect.models import AuditedModel, delete_in_chunks
 
 
 class OrganisationFromApiDoesNotExist(Exception):
@@ -116,18 +119,46 @@ class Review(AuditedModel):
             return "See more..."
 
     @classmethod
-    def delete_old_reviews(cls):
+    def delete_old_reviews(cls, chunk_size=1000, progress=None):
         """Delete reviews that are older than NHS_CHOICES_API_MAX_REVIEW_AGE_IN_DAYS.
 
         This is based on the published date, it would be better if it was
         based on the visit date, but we are not supplied this in the API.
+
+        The reviews are deleted along with any replies to them, their
+        ratings and organisation links, chunk_size ids at a time, with the
+        daily review counts and recommendation ratings of the organisations
+        they were on being updated in the same transaction as each chunk.
+        See citizenconnect.models.delete_in_chunks for progress. Returns how
+        many reviews were deleted.
         """
 
         max_age_in_days = settings.NHS_CHOICES_API_MAX_REVIEW_AGE_IN_DAYS
         max_age_timedelta = datetime.timedelta(days=max_age_in_days)
         oldest_permitted = datetime.datetime.now(pytz.utc) - max_age_timedelta
 
-        cls.objects.filter(api_published__lte=oldest_permitted).delete()
+        def delete_chunk(cursor, where_sql, params):
+            doomed_sql = """SELECT reviews_display_review.id
+                            FROM reviews_display_review
+                            WHERE """ + where_sql + """
+                            OR reviews_display_review.in_reply_to_id IN (
+                                SELECT reviews_display_review.id
+                                FROM reviews_display_review
+                                WHERE """ + where_sql + ")"
+            changed_organisation_ids = set()
+            changed_days = set()
+            deleted = cls._delete_reviews(cursor, doomed_sql, params + params,
+                                          changed_organisation_ids, changed_days)
+            refresh_review_counts(changed_organisation_ids, changed_days)
+            refresh_recommendation_ratings(changed_organisation_ids)
+            return deleted
+
+        return delete_in_chunks('reviews_display_review',
+                                'reviews_display_review.api_published <= %s',
+                                [oldest_permitted],
+                                delete_chunk,
+                                chunk_size,
+                                progress)
 
     @classmethod
     def upsert_or_delete_from_api_data(cls, api_review, organisation_type):
@@ -140,96 +171,328 @@ class Review(AuditedModel):
 
         If the  category is deletion, or the published date is more than
         NHS_CHOICES_API_MAX_REVIEW_AGE_IN_DAYS days old, the entry is deleted
-        """
 
-        unique_args = dict(
-            api_posting_id=api_review['api_posting_id'],
-            api_postingorganisationid=api_review['api_postingorganisationid']
-        )
+        This is a wrapper around upsert_or_delete_from_api_data_batch for a
+        single review.
+        """
+        result = cls.upsert_or_delete_from_api_data_batch([api_review], organisation_type)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
 
+    @classmethod
+    def upsert_or_delete_from_api_data_batch(cls, api_reviews, organisation_type):
+        """Create, update or delete the entries in the database for a list of
+        reviews from the API (eg: a page or several of them) at once.
+
+        This does the same as calling upsert_or_delete_from_api_data for each
+        review, but with a handful of queries for the whole list, rather than
+        several for each review. Replies are dealt with after everything
+        else, so a reply can be to a review earlier on in the same list.
+
+        Returns a list with an entry for each of api_reviews, which is True if
+        it was created or updated, None if it was deleted, or the
+        OrganisationFromApiDoesNotExist or RepliedToReviewDoesNotExist
+        exception saying why it was skipped.
+        """
         max_age_in_days = settings.NHS_CHOICES_API_MAX_REVIEW_AGE_IN_DAYS
         oldest_permitted = datetime.datetime.now() - datetime.timedelta(
             days=max_age_in_days)
-        pub_date = dateutil_parse(api_review['api_published'], ignoretz=True)
-
-        # If this is a deletion or published is too old then delete from the db
-        if api_review['api_category'] == 'deletion' or pub_date <= oldest_permitted:
-            try:
-                cls.objects.get(**unique_args).delete()
-            except cls.DoesNotExist:
-                pass  # if it was not in db then no need to delete it
-            return
 
-        # Load the org. If not possible skip this review.
-        try:
-            # For a hospital, this is the org given in the api data,
-            # for the GP, the data given is the id of the surgery, so we
-            # need to get that org and then get all its' branches
-            if organisation_type == "gppractices":
-                gp_surgery = OrganisationParent.objects.get(
-                    choices_id=api_review['organisation_choices_id']
-                )
-                organisations = list(gp_surgery.organisations.all())
+        # If a review is in the list more than once, only the last one counts
+        latest = {}
+        for index, api_review in enumerate(api_reviews):
+            latest[cls._api_unique_key(api_review)] = index
+
+        results = {}
+        deletions = []
+        upserts = []
+        for key, index in latest.items():
+            api_review = api_reviews[index]
+            pub_date = dateutil_parse(api_review['api_published'], ignoretz=True)
+            # If this is a deletion or published is too old then delete from the db
+            if api_review['api_category'] == 'deletion' or pub_date <= oldest_permitted:
+                results[index] = None
+                deletions.append(key)
             else:
-                organisation = Organisation.objects.get(
-                    choices_id=api_review['organisation_choices_id'])
-                organisations = [organisation]
-        except (Organisation.DoesNotExist, OrganisationParent.DoesNotExist):
-            raise OrganisationFromApiDoesNotExist(
-                "Could not find organisation with choices_id = '{0}'".format(
-                    api_review['organisation_choices_id']
-                )
-            )
+                upserts.append(index)
 
-        # For replies try to load the review they relate to. If not found raise
-        # an exception. Because of the order that the API gives us results in
-        # this might be quite common.
-        if api_review['api_category'] == 'reply':
-            try:
-                api_review['in_reply_to'] = cls.objects.get(api_posting_id=api_review['in_reply_to_id'],
-                                                            api_postingorganisationid=api_review['in_reply_to_organisation_id'])
-            except cls.DoesNotExist:
-                raise RepliedToReviewDoesNotExist(
-                    "Could not find review with api_posting_id of {0} for reply {1}".format(
-                        api_review['in_reply_to_id'],
-                        api_review['api_posting_id']
+        # Load the orgs. If not possible skip those reviews.
+        organisation_ids = cls._organisation_ids_by_choices_id(
+            organisation_type,
+            [api_reviews[index]['organisation_choices_id'] for index in upserts]
+        )
+        comments = []
+        replies = []
+        for index in sorted(upserts):
+            api_review = api_reviews[index]
+            if int(api_review['organisation_choices_id']) not in organisation_ids:
+                results[index] = OrganisationFromApiDoesNotExist(
+                    "Could not find organisation with choices_id = '{0}'".format(
+                        api_review['organisation_choices_id']
                     )
                 )
+            elif api_review['api_category'] == 'reply':
+                replies.append(index)
+            else:
+                comments.append(index)
+
+        with transaction.commit_on_success():
+            cursor = connection.cursor()
+            changed_organisation_ids = set()
+            changed_days = set()
+
+            cls._bulk_delete(cursor, deletions, changed_organisation_ids, changed_days)
+
+            cls._bulk_upsert(cursor,
+                             [api_reviews[index] for index in comments],
+                             organisation_ids,
+                             {},
+                             changed_organisation_ids,
+                             changed_days)
+            for index in comments:
+                results[index] = True
+
+            # For replies try to load the review they relate to. If not found
+            # skip it. Because of the order that the API gives us results in
+            # this might be quite common.
+            replied_to_ids = cls._review_ids_by_api_key(
+                cursor,
+                [cls._api_in_reply_to_key(api_reviews[index]) for index in replies]
+            )
+            found_replies = []
+            for index in replies:
+                api_review = api_reviews[index]
+                if cls._api_in_reply_to_key(api_review) in replied_to_ids:
+                    found_replies.append(api_review)
+                    results[index] = True
+                else:
+                    results[index] = RepliedToReviewDoesNotExist(
+                        "Could not find review with api_posting_id of {0} for reply {1}".format(
+                            api_review['in_reply_to_id'],
+                            api_review['api_posting_id']
+                        )
+                    )
+            cls._bulk_upsert(cursor,
+                             found_replies,
+                             organisation_ids,
+                             replied_to_ids,
+                             changed_organisation_ids,
+                             changed_days)
+
+            # None of the signals which keep the daily review counts up to
+            # date get sent by the queries above, so update them here
+            refresh_review_counts(changed_organisation_ids, changed_days)
+            # Or the organisations' average recommendation ratings
+            refresh_recommendation_ratings(changed_organisation_ids)
+
+        return [results[latest[cls._api_unique_key(item)]] for item in api_reviews]
 
-        defaults = api_review.copy()
-        del defaults['ratings']
-        del defaults['organisation_choices_id']
-        del defaults['in_reply_to_id']
-        del defaults['in_reply_to_organisation_id']
+    @classmethod
+    def _api_unique_key(cls, api_review):
+        """Return the (api_posting_id, api_postingorganisationid) which
+        identify a review from the API"""
+        return (unicode(api_review['api_posting_id']), unicode(api_review['api_postingorganisationid']))
 
-        review, created = cls.objects.get_or_create(
-            defaults=defaults, **unique_args)
+    @classmethod
+    def _api_in_reply_to_key(cls, api_review):
+        """Return the (api_posting_id, api_postingorganisationid) of the
+        review that a reply from the API is replying to"""
+        return (unicode(api_review['in_reply_to_id']), unicode(api_review['in_reply_to_organisation_id']))
 
-        # Assign organisations
-        # Assigning like this clears any existing relationships so it doesn't
-        # matter if it was newly created or existed already
-        review.organisations = organisations
+    @classmethod
+    def _organisation_ids_by_choices_id(cls, organisation_type, choices_ids):
+        """Return a dictionary mapping each of the given choices_ids which we
+        know about to a list of the ids of the organisations it refers to.
+
+        For a hospital, this is the org given in the api data, for the GP,
+        the data given is the id of the surgery, so we need all its
+        branches."""
+        choices_ids = set(int(choices_id) for choices_id in choices_ids)
+        organisation_ids = {}
+        if not choices_ids:
+            return organisation_ids
+        if organisation_type == "gppractices":
+            rows = OrganisationParent.objects.filter(choices_id__in=choices_ids).values_list('choices_id', 'organisations__id')
+        else:
+            rows = Organisation.objects.filter(choices_id__in=choices_ids).values_list('choices_id', 'id')
+        for choices_id, organisation_id in rows:
+            ids = organisation_ids.setdefault(choices_id, [])
+            # A surgery might not have any branches
+            if organisation_id is not None:
+                ids.append(organisation_id)
+        return organisation_ids
 
-        if not created:
-            for field in defaults.keys():
-                setattr(review, field, defaults[field])  # ick-ity yuck :(
-            review.save()
+    @classmethod
+    def _api_keys_clause(cls, keys, params):
+        """Return an SQL clause matching reviews with any of the given
+        (api_posting_id, api_postingorganisationid) keys"""
+        params.extend(value for key in keys for value in key)
+        return """(reviews_display_review.api_posting_id, reviews_display_review.api_postingorganisationid)
+                  IN (VALUES """ + ", ".join(["(%s, %s)"] * len(keys)) + ")"
 
-        # check if the ratings have changed, if they have delete them all and
-        # reinsert
-        current_ratings = [
-            model_to_dict(x, exclude=['id', 'review'])
-            for x
-            in review.ratings.all().order_by('question')
-        ]
+    @classmethod
+    def _review_ids_by_api_key(cls, cursor, keys):
+        """Return a dictionary mapping each of the given
+        (api_posting_id, api_postingorganisationid) keys which is in the
+        database to the id of that review"""
+        keys = set(keys)
+        if not keys:
+            return {}
+        params = []
+        cursor.execute("""SELECT api_posting_id, api_postingorganisationid, id
+                          FROM reviews_display_review
+                          WHERE """ + cls._api_keys_clause(keys, params), params)
+        return dict(((posting_id, posting_organisation_id), review_id)
+                    for posting_id, posting_organisation_id, review_id in cursor.fetchall())
 
-        if current_ratings != api_review['ratings']:
-            review.ratings.all().delete()
+    @classmethod
+    def _remember_counted(cls, cursor, review_ids_sql, params, changed_organisation_ids, changed_days):
+        """Add the organisations and days that some reviews are currently
+        counted on to changed_organisation_ids and changed_days"""
+        cursor.execute("""SELECT reviews_display_review.api_published,
+                                 reviews_display_review_organisations.organisation_id
+                          FROM reviews_display_review
+                          LEFT OUTER JOIN reviews_display_review_organisations
+                          ON reviews_display_review_organisations.review_id = reviews_display_review.id
+                          WHERE reviews_display_review.id IN (""" + review_ids_sql + ")", params)
+        for api_published, organisation_id in cursor.fetchall():
+            changed_days.add(utc_day(api_published))
+            if organisation_id is not None:
+                changed_organisation_ids.add(organisation_id)
 
-        for rating in api_review['ratings']:
-            review.ratings.create(**rating)
+    @classmethod
+    def _bulk_delete(cls, cursor, keys, changed_organisation_ids, changed_days):
+        """Delete the reviews with the given (api_posting_id,
+        api_postingorganisationid) keys, along with any replies to them,
+        their ratings and organisation links, in one statement."""
+        if not keys:
+            return
+        params = []
+        doomed_sql = """SELECT reviews_display_review.id
+                        FROM reviews_display_review
+                        WHERE """ + cls._api_keys_clause(keys, params) + """
+                        OR reviews_display_review.in_reply_to_id IN (
+                            SELECT reviews_display_review.id
+                            FROM reviews_display_review
+                            WHERE """ + cls._api_keys_clause(keys, params) + ")"
+        cls._delete_reviews(cursor, doomed_sql, params, changed_organisation_ids, changed_days)
 
-        return True
+    @classmethod
+    def _delete_reviews(cls, cursor, doomed_sql, params, changed_organisation_ids, changed_days):
+        """Delete the reviews whose ids are selected by doomed_sql, along with
+        their ratings and organisation links, in one statement, and return
+        how many were deleted. Nothing else is deleted, so doomed_sql needs
+        to include any replies to them."""
+        cls._remember_counted(cursor, doomed_sql, list(params), changed_organisation_ids, changed_days)
+        cursor.execute("""WITH doomed AS (""" + doomed_sql + """),
+                               deleted_ratings AS (
+                                   DELETE FROM reviews_display_rating
+                                   WHERE review_id IN (SELECT id FROM doomed)
+                               ),
+                               deleted_organisations AS (
+                                   DELETE FROM reviews_display_review_organisations
+                                   WHERE review_id IN (SELECT id FROM doomed)
+                               )
+                          DELETE FROM reviews_display_review
+                          WHERE id IN (SELECT id FROM doomed)""", params)
+        return cursor.rowcount
+
+    @classmethod
+    def _bulk_upsert(cls, cursor, api_reviews, organisation_ids, replied_to_ids, changed_organisation_ids, changed_days):
+        """Create or update the reviews from the API in one statement, then
+        replace their organisation links and ratings."""
+        if not api_reviews:
+            return
+
+        fields = ['api_posting_id', 'api_postingorganisationid', 'api_published', 'api_updated',
+                  'api_category', 'in_reply_to_id', 'author_display_name', 'title',
+                  'content_liked', 'content_improved', 'content']
+        values_sql = "(%s, %s, %s::timestamp with time zone, %s::timestamp with time zone, %s, %s::integer, %s, %s, %s, %s, %s)"
+        now = timezone.now()
+
+        keys = [cls._api_unique_key(api_review) for api_review in api_reviews]
+        params = []
+        cls._remember_counted(cursor,
+                              "SELECT id FROM reviews_display_review WHERE " + cls._api_keys_clause(keys, params),
+                              params,
+                              changed_organisation_ids,
+                              changed_days)
+
+        params = []
+        for api_review in api_reviews:
+            if api_review['api_category'] == 'reply':
+                in_reply_to_id = replied_to_ids[cls._api_in_reply_to_key(api_review)]
+            else:
+                in_reply_to_id = None
+            params.extend([api_review['api_posting_id'],
+                           api_review['api_postingorganisationid'],
+                           api_review['api_published'],
+                           api_review['api_updated'],
+                           api_review['api_category'],
+                           in_reply_to_id,
+                           api_review['author_display_name'],
+                           api_review['title'],
+                           api_review['content_liked'],
+                           api_review['content_improved'],
+                           api_review['content']])
+        params.extend([now, now, now])
+
+        cursor.execute("""WITH data (""" + ", ".join(fields) + """) AS (
+                              VALUES """ + ", ".join([values_sql] * len(api_reviews)) + """
+                          ),
+                          updated AS (
+                              UPDATE reviews_display_review
+                              SET """ + ", ".join(field + " = data." + field for field in fields[2:]) + """,
+                                  modified = %s
+                              FROM data
+                              WHERE reviews_display_review.api_posting_id = data.api_posting_id
+                              AND reviews_display_review.api_postingorganisationid = data.api_postingorganisationid
+                              RETURNING reviews_display_review.id,
+                                        reviews_display_review.api_posting_id,
+                                        reviews_display_review.api_postingorganisationid,
+                                        reviews_display_review.api_published
+                          ),
+                          inserted AS (
+                              INSERT INTO reviews_display_review (created, modified, """ + ", ".join(fields) + """)
+                              SELECT %s, %s, data.*
+                              FROM data
+                              WHERE NOT EXISTS (
+                                  SELECT 1 FROM reviews_display_review
+                                  WHERE reviews_display_review.api_posting_id = data.api_posting_id
+                                  AND reviews_display_review.api_postingorganisationid = data.api_postingorganisationid
+                              )
+                              RETURNING id, api_posting_id, api_postingorganisationid, api_published
+                          )
+                          SELECT * FROM updated
+                          UNION ALL
+                          SELECT * FROM inserted""", params)
+        review_ids = {}
+        for review_id, posting_id, posting_organisation_id, api_published in cursor.fetchall():
+            review_ids[(posting_id, posting_organisation_id)] = review_id
+            changed_days.add(utc_day(api_published))
+
+        # Assign organisations, replacing any existing ones
+        ids = tuple(review_ids.values())
+        links = []
+        ratings = []
+        for key, api_review in zip(keys, api_reviews):
+            review_id = review_ids[key]
+            for organisation_id in organisation_ids[int(api_review['organisation_choices_id'])]:
+                links.append((review_id, organisation_id))
+                changed_organisation_ids.add(organisation_id)
+            for rating in api_review['ratings']:
+                ratings.append(Rating(review_id=review_id, **rating))
+
+        cursor.execute("DELETE FROM reviews_display_review_organisations WHERE review_id IN %s", [ids])
+        if links:
+            cursor.execute("""INSERT INTO reviews_display_review_organisations (review_id, organisation_id)
+                              VALUES """ + ", ".join(["(%s, %s)"] * len(links)),
+                           [value for link in links for value in link])
+
+        # Replace the ratings
+        cursor.execute("DELETE FROM reviews_display_rating WHERE review_id IN %s", [ids])
+        Rating.objects.bulk_create(ratings)
 
     class Meta:
         # The api_posting_id should be unique for the organisation that added
@@ -237,6 +500,88 @@ class Review(AuditedModel):
         unique_together = (("api_posting_id", "api_postingorganisationid"),)
 
 
+def review_count_days(review_ids):
+    """Return the (UTC) days that the given Reviews are counted on in
+    :model:`organisations.DailyReviewCount`.
+
+    This looks at the database, rather than at instances, because the API
+    importer sets api_published to strings."""
+    published = Review.objects.filter(pk__in=review_ids).values_list('api_published', flat=True)
+    return [utc_day(api_published) for api_published in published]
+
+
+@receiver(post_init, sender=Review)
+def remember_review_count_values(sender, **kwargs):
+    """post_init signal handler to remember what a Review was counted as, so
+    that we can tell if :model:`organisations.DailyReviewCount` needs
+    updating when it is saved."""
+    review = kwargs['instance']
+    review._review_count_values = (review.api_published, review.in_reply_to_id)
+
+
+@receiver(post_save, sender=Review)
+def update_review_counts_on_save(sender, **kwargs):
+    """post_save signal handler to update the daily review counts for a
+    Review's organisations if the day it was published or whether it's a
+    reply has changed.
+
+    New reviews are counted when they are added to their organisations (see
+    update_review_counts_on_organisations_changed)."""
+    review = kwargs['instance']
+    values = (review.api_published, review.in_reply_to_id)
+    previous_values = getattr(review, '_review_count_values', None)
+    if not kwargs['created'] and values != previous_values:
+        days = review_count_days([review.id])
+        if previous_values is not None and isinstance(previous_values[0], datetime.datetime):
+            days.append(utc_day(previous_values[0]))
+        refresh_review_counts(review.organisations.values_list('id', flat=True), days)
+    review._review_count_values = values
+
+
+@receiver(m2m_changed, sender=Review.organisations.through)
+def update_review_counts_on_organisations_changed(sender, **kwargs):
+    """m2m_changed signal handler to update the daily review counts when a
+    Review is added to or removed from organisations."""
+    action = kwargs['action']
+    instance = kwargs['instance']
+
+    if kwargs['reverse']:
+        # Changing an organisation's reviews, which could be on any day
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_review_counts([instance.id])
+        return
+
+    # Replies aren't counted, so which organisations they're on doesn't matter
+    if instance.in_reply_to_id is not None:
+        return
+
+    if action == 'pre_clear':
+        instance._cleared_organisation_ids = list(instance.organisations.values_list('id', flat=True))
+    elif action == 'post_clear':
+        refresh_review_counts(instance._cleared_organisation_ids, review_count_days([instance.id]))
+    elif action in ('post_add', 'post_remove'):
+        refresh_review_counts(kwargs['pk_set'], review_count_days([instance.id]))
+
+
+@receiver(pre_delete, sender=Review)
+def remember_review_organisations(sender, **kwargs):
+    """pre_delete signal handler to remember which organisations and day a
+    Review was counted on, because they'll be gone by post_delete"""
+    review = kwargs['instance']
+    review._deleted_organisation_ids = list(review.organisations.values_list('id', flat=True))
+    review._deleted_days = review_count_days([review.id])
+
+
+@receiver(post_delete, sender=Review)
+def update_review_counts_on_delete(sender, **kwargs):
+    """post_delete signal handler to remove a deleted Review from the daily
+    review counts."""
+    review = kwargs['instance']
+    if review.in_reply_to_id is None:
+        refresh_review_counts(getattr(review, '_deleted_organisation_ids', []),
+                              getattr(review, '_deleted_days', []))
+
+
 class Rating(AuditedModel):
     """A review of a provider, attached to a :model:`reviews_display.Review`.
 
@@ -1,6 +1,10 @@
 import logging
 import re
 import urllib2
+from collections import deque, namedtuple
+from io import BytesIO
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 
 from HTMLParser import HTMLParser
 import lxml.etree as ET
@@ -11,17 +15,51 @@ from organisations.choices_api import ChoicesAPI
 
 logger = logging.getLogger(__name__)
 
+# A parsed page of reviews, along with the urls of the page's "next" and
+# "last" links (or None if it doesn't have them)
+ReviewsPage = namedtuple('ReviewsPage', ['reviews', 'next_url', 'last_url'])
+
+# HTMLParser.unescape doesn't use any of the parser's state, so one parser
+# can be shared by everything, including worker threads
+unescape = HTMLParser().unescape
+
+
+def _local_name(element):
+    """Return element's tag without its namespace, or None for comments and
+    processing instructions"""
+    if not isinstance(element.tag, basestring):
+        return None
+    return element.tag.rpartition('}')[2]
+
+
+def _children_by_name(element):
+    """Return a dict of element's children by their local names, keeping the
+    first if there's more than one with the same name"""
+    children = {}
+    for child in element:
+        children.setdefault(_local_name(child), child)
+    return children
+
 
 class ReviewsAPI(object):
 
     """
     Abstraction around the Choices API that hides the pagination and parsing
     of the XML and lets us use an iterator to access the reviews.
+
+    With workers > 1, pages after the first are fetched concurrently by a pool
+    of that many threads, working out their urls from the first page's "next"
+    and "last" links. Each thread parses the pages it fetches, and they're
+    still handed on in order while the pool carries on fetching the next few.
     """
 
-    def __init__(self, organisation_type, start_page=None, max_fetch=5, since=None):
+    def __init__(self, organisation_type, start_page=None, max_fetch=5, since=None, workers=1):
         self.api = ChoicesAPI()
 
+        self.workers = workers
+        # The ReviewsPages, when fetching concurrently
+        self.pages = None
+
         self.organisation_type = organisation_type
 
         self.fetches_remaining = max_fetch
@@ -70,6 +108,11 @@ class ReviewsAPI(object):
             return None
         self.fetches_remaining -= 1
 
+        return self._fetch_url(url)
+
+    def _fetch_url(self, url):
+        """Fetch and parse a page from the API, without counting it against
+        fetches_remaining, so that it's safe to call from worker threads"""
         logger.debug("Fetching '%s'" % url)
 
         try:
@@ -81,46 +124,64 @@ class ReviewsAPI(object):
             else:
                 raise e
 
-        data = response.read()
-        data = self.cleanup_xml(data)
-        return data
+        # The page is parsed as it's downloaded
+        try:
+            return self.parse_page(response)
+        finally:
+            response.close()
 
-    def cleanup_xml(self, xml):
-        """
-        There does not appear to be a way to tell ElementTree to ignore the
-        namespaces. Use a regex to fix the raw XML string.
+    def parse_page(self, source):
         """
-        xml = re.sub(r'xmlns=".*?"', '', xml)
+        Parse a page of the API's Atom feed from source, a file-like object,
+        in a single pass, and return a ReviewsPage.
 
-        # xml = xml.decode('utf8')
-
-        return xml
+        Each entry is converted into a review as soon as it's been read, and
+        then thrown away, so only one entry is held in memory at a time rather
+        than the whole page. Elements are matched on their local names, so
+        the namespaces the API puts on some of them don't matter.
+        """
+        reviews = []
+        links = {}
+        for event, element in ET.iterparse(source, events=('end',)):
+            name = _local_name(element)
+            if name == 'entry':
+                reviews.append(self.convert_entry_to_review(element))
+                element.clear()
+                # Also drop the elements before this one, which the parser
+                # still holds on to through the feed
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif name == 'link' and _local_name(element.getparent()) == 'feed':
+                links.setdefault(element.get('rel'), element.get('href'))
+        return ReviewsPage(reviews, links.get('next'), links.get('last'))
 
     def _extract_content(self, element):
         if element is None: return ""
         content = ET.tostring(element, method="text", encoding='utf8')
         content = content.decode('utf8')
         content = content or ""
-        content = HTMLParser().unescape(content)
+        content = unescape(content)
         return content
 
     def convert_entry_to_review(self, entry):
 
+        children = _children_by_name(entry)
+
         review = {
-            "api_posting_id": entry.find('id').text,
-            "api_postingorganisationid": entry.find('postingorganisationid').text,
+            "api_posting_id": children['id'].text,
+            "api_postingorganisationid": children['postingorganisationid'].text,
 
-            "api_published": entry.find("published").text,
-            "api_updated": entry.find("updated").text,
+            "api_published": children["published"].text,
+            "api_updated": children["updated"].text,
 
-            "api_category": entry.find("category").get("term"),
+            "api_category": children["category"].get("term"),
 
-            "author_display_name": entry.find("author/name").text,
-            "title":   HTMLParser().unescape(entry.find('title').text or ""),
+            "author_display_name": _children_by_name(children["author"])["name"].text,
+            "title":   unescape(children['title'].text or ""),
         }
 
         # Extract the content so that we can manipulate it a bit
-        content_xml = entry.find('content')
+        content_xml = children['content']
 
         if review['api_category'] == 'comment':
 
@@ -128,9 +189,11 @@ class ReviewsAPI(object):
             # For comments there are nested divs. Remove them, but make sure
             # to put '\n\n' between their content so that they are not just
             # pushed together.
-            review['content_liked'] = self._extract_content(content_xml.find('div[@id="liked"]'))
-            review['content_improved'] = self._extract_content(content_xml.find('div[@id="improved"]'))
-            review['content'] = self._extract_content(content_xml.find('div[@id="anythingElse"]'))
+            divs = dict((div.get('id'), div) for div in reversed(content_xml)
+                        if _local_name(div) == 'div')
+            review['content_liked'] = self._extract_content(divs.get('liked'))
+            review['content_improved'] = self._extract_content(divs.get('improved'))
+            review['content'] = self._extract_content(divs.get('anythingElse'))
         else:
             review['content_liked'] = ''
             review['content_improved'] = ''
@@ -138,41 +201,42 @@ class ReviewsAPI(object):
 
         # for replies we should extract what it is a reply to
         if review['api_category'] == 'reply':
-            review["in_reply_to_id"] = entry.find("in-reply-to").get("postingid")
-            review["in_reply_to_organisation_id"] = entry.find("in-reply-to").get("postingorganisationid")
+            review["in_reply_to_id"] = children["in-reply-to"].get("postingid")
+            review["in_reply_to_organisation_id"] = children["in-reply-to"].get("postingorganisationid")
         else:
             review["in_reply_to_id"] = None
             review["in_reply_to_organisation_id"] = None
 
         # get the organisation
-        org_url = entry.find(
-            'link[@title="Organisation commented on"]').get('href')
+        org_url = next(link.get('href') for link in entry
+                       if _local_name(link) == 'link'
+                       and link.get('title') == "Organisation commented on")
 
         review['organisation_choices_id'] = re.search(
             r'/(\d+)\?', org_url).group(1)
 
         review["ratings"] = []
-        for rating in entry.iter("rating"):
+        for rating in entry.iter():
+            if _local_name(rating) != "rating":
+                continue
+            rating_children = _children_by_name(rating)
             review['ratings'].append({
-                "question": rating.find("questionText").text,
-                "answer": rating.find("answerText").text,
-                "score": rating.find("answerMetric").get('value'),
+                "question": rating_children["questionText"].text,
+                "answer": rating_children["answerText"].text,
+                "score": rating_children["answerMetric"].get('value'),
             })
 
         return review
 
     def extract_reviews_from_xml(self, xml):
+        """Parse the reviews out of a page that's already been read into a
+        string"""
 
         # for 404 responses
         if xml is None:
             return []
 
-        root = ET.fromstring(xml)
-        reviews = []
-        for entry in root.iter('entry'):
-            review = self.convert_entry_to_review(entry)
-            reviews.append(review)
-        return reviews
+        return self.parse_page(BytesIO(xml)).reviews
 
     def extract_next_page_url(self, xml):
 
@@ -180,41 +244,139 @@ class ReviewsAPI(object):
         if xml is None:
             return None
 
-        root = ET.fromstring(xml)
-        next_page_link = root.find('link[@rel="next"]')
-        last_page_link = root.find('link[@rel="last"]')
-        if next_page_link is None or last_page_link is None:
+        return self.next_page_url_from(self.parse_page(BytesIO(xml)))
+
+    def next_page_url_from(self, page):
+        """Return the url of the page after page, or None if it's the last
+        one"""
+        if page.next_url is None or page.last_url is None:
             return None
 
-        next_page_url = next_page_link.get('href')
-        last_page_url = last_page_link.get('href')
-        if next_page_url == last_page_url:
+        if page.next_url == page.last_url:
             return None
 
-        # parse the url and check that the path ends with '.atom'. Add it if
-        # missing.
-        url = furl(next_page_url)
+        return self._atom_url(furl(page.next_url))
+
+    def _atom_url(self, url):
+        """Parse the url and check that the path ends with '.atom'. Add it if
+        missing."""
         if not re.search(r'\.atom$', str(url.path)):
             url.path = str(url.path) + '.atom'
-            next_page_url = str(url)
+        return str(url)
+
+    def extract_page_urls(self, xml):
 
-        return next_page_url
+        # for 404 responses
+        if xml is None:
+            return []
+
+        return self.page_urls_from(self.parse_page(BytesIO(xml)))
+
+    def page_urls_from(self, page):
+        """Return a list of the urls of all the pages after page, worked out
+        from its "next" and "last" links, or None if they don't have the page
+        numbers we need to do that.
+
+        Like next_page_url_from, this stops before the "last" page."""
+
+        if page.next_url is None or page.last_url is None:
+            return []
+
+        next_page_url = furl(page.next_url)
+        try:
+            next_page = int(next_page_url.args['page'])
+            last_page = int(furl(page.last_url).args['page'])
+        except (KeyError, ValueError):
+            return None
+
+        urls = []
+        for page_number in range(next_page, last_page):
+            next_page_url.args['page'] = page_number
+            urls.append(self._atom_url(next_page_url.copy()))
+        return urls
 
     def load_next_page(self):
 
+        if self.workers > 1:
+            return self.load_next_page_concurrently()
+
         if not self.next_page_url:
             return None
 
-        xml = self.fetch_from_api(self.next_page_url)
+        page = self.fetch_from_api(self.next_page_url)
 
         # error with fetching, or have fetched up to our limit
-        if not xml:
+        if page is None:
             self.next_page_url = None
             return None
 
-        reviews_from_xml = self.extract_reviews_from_xml(xml)
-        self.reviews.extend(reviews_from_xml)
+        self.reviews.extend(page.reviews)
+
+        self.next_page_url = self.next_page_url_from(page)
 
-        self.next_page_url = self.extract_next_page_url(xml)
+        return None
+
+    def load_next_page_concurrently(self):
+
+        if self.pages is None:
+            self.pages = self.fetch_pages_concurrently()
+
+        # Keep going until we find a page with some reviews on, or run out
+        for page in self.pages:
+            if page.reviews:
+                self.reviews.extend(page.reviews)
+                break
 
         return None
+
+    def fetch_pages_concurrently(self):
+        """Generate each ReviewsPage in order, fetching all but the first
+        with a pool of self.workers threads."""
+
+        if not self.next_page_url:
+            return
+
+        page = self.fetch_from_api(self.next_page_url)
+        self.next_page_url = None
+
+        # error with fetching, or have fetched up to our limit
+        if page is None:
+            return
+        yield page
+
+        page_urls = self.page_urls_from(page)
+        if page_urls is None:
+            # We can't tell what the pages will be, so just follow the links
+            self.next_page_url = self.next_page_url_from(page)
+            while self.next_page_url:
+                page = self.fetch_from_api(self.next_page_url)
+                if page is None:
+                    self.next_page_url = None
+                    return
+                self.next_page_url = self.next_page_url_from(page)
+                yield page
+            return
+
+        page_urls = page_urls[:self.fetches_remaining]
+        self.fetches_remaining -= len(page_urls)
+        if not page_urls:
+            return
+
+        # Only fetch a few pages ahead of what's been handed on, so that we
+        # don't hold thousands of pages in memory if the database is slower
+        # than the API
+        page_urls = iter(page_urls)
+        pool = ThreadPool(self.workers)
+        try:
+            pending = deque(pool.apply_async(self._fetch_url, (url,))
+                            for url in islice(page_urls, self.workers * 2))
+            while pending:
+                page = pending.popleft().get()
+                for url in islice(page_urls, 1):
+                    pending.append(pool.apply_async(self._fetch_url, (url,)))
+                # They use 404 for empty responses, so there's no more
+                if page is None:
+                    return
+                yield page
+        finally:
+            pool.terminate()
@@ -7,7 +7,8 @@ import django_tables2 as tables
 from django.utils.safestring import mark_safe
 from django.utils.html import conditional_escape
 from django.core.urlresolvers import reverse
-from django.template.loader import render_to_string
+
+from issues.table_columns import render_rating
 
 
 class ReviewTable(tables.Table):
@@ -32,7 +33,7 @@ class ReviewTable(tables.Table):
                             default="See more...")
 
     def render_rating(self, record):
-        return render_to_string('organisations/includes/tables/columns/rating_column.html', {'value': record.main_rating_score})
+        return render_rating(record.main_rating_score)
 
     def render_summary(self, record, value):
         review_link = reverse('review-detail', kwargs={'ods_code': self.organisation.ods_code, 'cobrand': self.cobrand, 'api_posting_id': record.api_posting_id})
@@ -1,24 +1,29 @@
 import copy
 import os
+import re
 import json
 import datetime
 from datetime import timedelta
 import urlparse
+from StringIO import StringIO
 import mock
 import urllib2
 import pytz
 import logging
+from furl import furl
 
 from django.conf import settings
+from django.db import connection
 from django.test import TestCase
 from django.forms.models import model_to_dict
 from django.core.management import call_command
 from django.core.urlresolvers import reverse
 from django.utils.timezone import utc
 
+from organisations.models import Organisation, DailyReviewCount
 from organisations.tests.lib import create_test_organisation, create_test_organisation_parent, AuthorizationTestCase
 
-from .models import Review, OrganisationFromApiDoesNotExist, RepliedToReviewDoesNotExist
+from .models import Review, Rating, OrganisationFromApiDoesNotExist, RepliedToReviewDoesNotExist
 from .reviews_api import ReviewsAPI
 from organisations.choices_api import ChoicesAPI
 
@@ -144,8 +149,7 @@ class ReviewParseApiXmlTests(SampleDirMixin, TestCase):
         expected = self.json
 
         api = ReviewsAPI(organisation_type="hospitals")
-        xml = api.cleanup_xml(self.xml)
-        actual = api.extract_reviews_from_xml(xml)
+        actual = api.extract_reviews_from_xml(self.xml)
 
         # Handy for recreating the JSON when testing
         # open(
@@ -159,6 +163,22 @@ class ReviewParseApiXmlTests(SampleDirMixin, TestCase):
         self.maxDiff = None
         self.assertEqual(actual, expected)
 
+    def test_parse_page(self):
+        api = ReviewsAPI(organisation_type="hospitals")
+        with open(self.sample_xml_filename) as source:
+            page = api.parse_page(source)
+
+        self.maxDiff = None
+        self.assertEqual(page.reviews, self.json)
+        self.assertEqual(furl(page.next_url).args['page'], '1001')
+        self.assertEqual(furl(page.last_url).args['page'], '2305')
+        self.assertEqual(furl(api.next_page_url_from(page)).args['page'], '1001')
+
+    def test_parse_page_without_namespaces(self):
+        api = ReviewsAPI(organisation_type="hospitals")
+        xml = re.sub(r'xmlns=".*?"', '', self.xml)
+        self.assertEqual(api.parse_page(StringIO(xml)).reviews, self.json)
+
     def test_parse_xml_with_no_next_link(self):
         # Issue #1042 - the api code didn't allow for the fact that
         # there might only be one page of reviews coming back, and so
@@ -171,10 +191,9 @@ class ReviewParseApiXmlTests(SampleDirMixin, TestCase):
         self.no_next_link_xml = open(self.no_next_link_xml_filename).read()
 
         api = ReviewsAPI(organisation_type="hospitals")
-        xml = api.cleanup_xml(self.no_next_link_xml)
 
         # This threw an error before
-        next_page_url = api.extract_next_page_url(xml)
+        next_page_url = api.extract_next_page_url(self.no_next_link_xml)
 
         self.assertIsNone(next_page_url)
 
@@ -208,6 +227,84 @@ class ReviewParseEmptyApiXmlTests(SampleDirMixin, TestCase):
         self.assertEqual(api.extract_next_page_url(None), None)
 
 
+class ReviewConcurrentFetchTests(SampleDirMixin, TestCase):
+
+    def setUp(self):
+        super(ReviewConcurrentFetchTests, self).setUp()
+        self.xml = open(os.path.join(self.sample_dir, 'sample.xml')).read()
+
+    def fetch_reviews(self, **kwargs):
+        with mock.patch.object(ChoicesAPI, 'send_api_request') as mock_send_api_request:
+            mock_send_api_request.side_effect = lambda url: StringIO(self.xml)
+            api = ReviewsAPI(organisation_type="hospitals", **kwargs)
+            reviews = list(api)
+            urls = [call[0][0] for call in mock_send_api_request.call_args_list]
+        return reviews, urls
+
+    def test_extract_page_urls(self):
+        api = ReviewsAPI(organisation_type="hospitals")
+        urls = api.extract_page_urls(self.xml)
+        # From the "next" page, up to but not including the "last" one
+        self.assertEqual(len(urls), 2304 - 1001 + 1)
+        self.assertEqual(furl(urls[0]).args['page'], '1001')
+        self.assertEqual(furl(urls[-1]).args['page'], '2304')
+        self.assertTrue(furl(urls[0]).path.segments[-1].endswith('.atom'))
+
+    def test_extract_page_urls_without_page_numbers(self):
+        api = ReviewsAPI(organisation_type="hospitals")
+        xml = self.xml.replace('&amp;page=', '&amp;p=')
+        self.assertIsNone(api.extract_page_urls(xml))
+
+    def test_concurrent_fetch_matches_serial_fetch(self):
+        serial_reviews, serial_urls = self.fetch_reviews(max_fetch=4)
+        concurrent_reviews, concurrent_urls = self.fetch_reviews(max_fetch=4, workers=3)
+        self.assertEqual(len(serial_reviews), 4 * 28)
+        self.assertEqual(concurrent_reviews, serial_reviews)
+        # The same pages were fetched, though possibly not in the same order
+        self.assertEqual(len(concurrent_urls), 4)
+        self.assertEqual(concurrent_urls[0], serial_urls[0])
+        self.assertEqual(sorted(furl(url).args['page'] for url in concurrent_urls[1:]),
+                         ['1001', '1002', '1003'])
+
+    def test_concurrent_fetch_stops_at_empty_page(self):
+        exception = urllib2.HTTPError('http://test.com/', 404, 'Not Found', {}, None)
+
+        def send_api_request(url):
+            if furl(url).args.get('page') == '1002':
+                raise exception
+            return StringIO(self.xml)
+
+        with mock.patch.object(ChoicesAPI, 'send_api_request', side_effect=send_api_request):
+            api = ReviewsAPI(organisation_type="hospitals", max_fetch=10, workers=2)
+            self.assertEqual(len(list(api)), 2 * 28)
+
+
+class GetReviewsFromChoicesAPICommandTests(SampleDirMixin, TestCase):
+
+    def setUp(self):
+        super(GetReviewsFromChoicesAPICommandTests, self).setUp()
+        self.xml = open(os.path.join(self.sample_dir, 'sample.xml')).read()
+
+    def send_api_request(self, url):
+        # One page of reviews of hospitals, and nothing else
+        if 'hospitals' in url and 'page' not in furl(url).args:
+            return StringIO(self.xml)
+        raise urllib2.HTTPError(url, 404, 'Not Found', {}, None)
+
+    def test_fetches_every_organisation_type(self):
+        with mock.patch.object(ChoicesAPI, 'send_api_request', side_effect=self.send_api_request) as mock_send_api_request:
+            with mock.patch.object(Review, 'upsert_or_delete_from_api_data_batch', return_value=[]) as mock_upsert:
+                call_command('get_reviews_from_choices_api', workers=2)
+            requested_types = set(furl(call[0][0]).path.segments[1] for call in mock_send_api_request.call_args_list)
+        self.assertEqual(requested_types, set(settings.ORGANISATION_TYPES))
+        saved = [(call[0][1], len(call[0][0])) for call in mock_upsert.call_args_list]
+        self.assertEqual(saved, [('hospitals', 28)])
+
+    def test_errors_fetching_reviews_are_raised(self):
+        with mock.patch.object(ChoicesAPI, 'send_api_request', side_effect=ValueError('Bad API')):
+            self.assertRaises(ValueError, call_command, 'get_reviews_from_choices_api')
+
+
 class ReviewModelTests(TestCase):
 
     def setUp(self):
@@ -529,6 +626,106 @@ class ReviewModelTests(TestCase):
         self.assertFalse(Review.objects.filter(pk=old_review.id).exists())
         self.assertTrue(Review.objects.filter(pk=young_review.id).exists())
 
+    def test_delete_old_reviews_in_chunks(self):
+        test_age_in_days = settings.NHS_CHOICES_API_MAX_REVIEW_AGE_IN_DAYS + 10
+        old_published = datetime.datetime.now(pytz.utc) - datetime.timedelta(days=test_age_in_days)
+        old_reviews = [create_test_review({'organisation': self.organisation,
+                                           'api_published': old_published}, {})
+                       for i in range(3)]
+        # A recent reply to an old review goes with it
+        reply = create_test_review({'organisation': self.organisation,
+                                    'api_category': 'reply',
+                                    'in_reply_to': old_reviews[1]}, {})
+        young_review = create_test_review({'organisation': self.organisation}, {})
+
+        stdout = StringIO()
+        call_command('delete_old_reviews', chunk_size=1, verbosity=2, stdout=stdout)
+
+        old_ids = [review.id for review in old_reviews] + [reply.id]
+        self.assertFalse(Review.objects.filter(pk__in=old_ids).exists())
+        self.assertFalse(Rating.objects.filter(review__in=old_ids).exists())
+        self.assertEqual(list(self.organisation.reviews.all()), [young_review])
+        self.assertEqual(young_review.ratings.count(), 3)
+        self.assertEqual(sum(DailyReviewCount.objects.filter(organisation=self.organisation).values_list('count', flat=True)), 1)
+        self.assertIn("Deleted 4 old reviews", stdout.getvalue())
+
+    def recent_sample_review(self, posting_id, attributes={}):
+        published = datetime.datetime.utcnow().replace(tzinfo=utc) - timedelta(days=1)
+        api_review = copy.deepcopy(self.sample_review)
+        api_review.update({'api_posting_id': posting_id,
+                           'api_published': published.isoformat(),
+                           'api_updated': published.isoformat()})
+        api_review.update(attributes)
+        return api_review
+
+    def test_upsert_or_delete_batch(self):
+        doomed_review = create_test_review({'organisation': self.organisation}, {})
+        comment = self.recent_sample_review('1001')
+        reply = self.recent_sample_review('1002', {'api_category': 'reply',
+                                                   'in_reply_to_id': '1001',
+                                                   'in_reply_to_organisation_id': '0',
+                                                   'ratings': []})
+        orphan_reply = self.recent_sample_review('1003', {'api_category': 'reply',
+                                                          'in_reply_to_id': '999999',
+                                                          'in_reply_to_organisation_id': '0',
+                                                          'ratings': []})
+        unknown_organisation = self.recent_sample_review('1004', {'organisation_choices_id': '12345678'})
+        deletion = self.recent_sample_review(doomed_review.api_posting_id, {'api_category': 'deletion'})
+
+        # The reply comes before the review it's replying to
+        api_reviews = [reply, comment, orphan_reply, unknown_organisation, deletion]
+        results = Review.upsert_or_delete_from_api_data_batch(api_reviews, self.organisation.organisation_type)
+
+        self.assertEqual(results[0], True)
+        self.assertEqual(results[1], True)
+        self.assertTrue(isinstance(results[2], RepliedToReviewDoesNotExist))
+        self.assertTrue(isinstance(results[3], OrganisationFromApiDoesNotExist))
+        self.assertEqual(results[4], None)
+
+        review = Review.objects.get(api_posting_id='1001')
+        self.assertEqual(list(review.organisations.all()), [self.organisation])
+        self.assertEqual(review.ratings.count(), 3)
+        self.assertEqual(list(review.replies.all()), [Review.objects.get(api_posting_id='1002')])
+        self.assertFalse(Review.objects.filter(api_posting_id__in=['1003', '1004']).exists())
+        self.assertFalse(Review.objects.filter(pk=doomed_review.id).exists())
+        # Only the new review is counted, not the reply or the deleted review
+        self.assertEqual(sum(DailyReviewCount.objects.filter(organisation=self.organisation).values_list('count', flat=True)), 1)
+
+        # Doing it again doesn't duplicate anything
+        results = Review.upsert_or_delete_from_api_data_batch(api_reviews, self.organisation.organisation_type)
+        self.assertEqual(results[:2], [True, True])
+        self.assertEqual(Review.objects.filter(api_posting_id__in=['1001', '1002']).count(), 2)
+        self.assertEqual(review.ratings.count(), 3)
+        self.assertEqual(sum(DailyReviewCount.objects.filter(organisation=self.organisation).values_list('count', flat=True)), 1)
+
+    def test_upsert_or_delete_batch_updates_recommendation_rating(self):
+        api_reviews = [self.recent_sample_review('1001'),
+                       self.recent_sample_review('1002', {'ratings': [{'answer': 'Unlikely',
+                                                                       'question': 'Friends and Family',
+                                                                       'score': 2}]})]
+        Review.upsert_or_delete_from_api_data_batch(api_reviews, self.organisation.organisation_type)
+        organisation = Organisation.objects.get(pk=self.organisation.id)
+        self.assertAlmostEqual(organisation.average_recommendation_rating, 3.5)
+
+    def test_upsert_or_delete_batch_uses_the_last_entry_for_a_review(self):
+        api_reviews = [self.recent_sample_review('1001', {'title': 'First'}),
+                       self.recent_sample_review('1001', {'title': 'Second'})]
+        Review.upsert_or_delete_from_api_data_batch(api_reviews, self.organisation.organisation_type)
+        self.assertEqual(Review.objects.get(api_posting_id='1001').title, 'Second')
+
+    def test_upsert_or_delete_batch_query_count_doesnt_depend_on_size(self):
+        def count_queries(api_reviews):
+            connection.use_debug_cursor = True
+            queries_before = len(connection.queries)
+            Review.upsert_or_delete_from_api_data_batch(api_reviews, self.organisation.organisation_type)
+            query_count = len(connection.queries) - queries_before
+            connection.use_debug_cursor = False
+            return query_count
+
+        small_batch = [self.recent_sample_review(str(2000 + i)) for i in range(2)]
+        large_batch = [self.recent_sample_review(str(3000 + i)) for i in range(20)]
+        self.assertEqual(count_queries(small_batch), count_queries(large_batch))
+
     def test_summary_property(self):
         # Test summary returns "See more..." when content is empty
         # and truncates to 20 words if not
@@ -1,3 +1,4 @@
+from optparse import make_option
 from django.utils import timezone
 from datetime import timedelta
 
@@ -9,13 +10,28 @@ from ...models import Review
 class Command(NoArgsCommand):
     help = "Remove any reviews that were sent to the API over 2 weeks ago"
 
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--chunk-size',
+            action='store',
+            dest='chunk_size',
+            type='int',
+            default=1000,
+            help='How many review ids to remove the reviews in before committing.'
+        ),
+    )
+
     def handle_noargs(self, *args, **options):
         verbosity = int(options.get('verbosity'))
+        chunk_size = max(int(options.get('chunk_size') or 1000), 1)
         now = timezone.now()
         two_weeks_ago = now - timedelta(weeks=2)
-        reviews_to_delete = Review.objects.filter(last_sent_to_api__lt=two_weeks_ago)
 
-        if verbosity >= 2:
-            self.stdout.write("Removing {0} reviews\n".format(reviews_to_delete.count()))
+        def progress(deleted, done_up_to_id, max_id):
+            if verbosity >= 2:
+                self.stdout.write("Removed {0} reviews, up to id {1} of {2}\n".format(deleted, done_up_to_id, max_id))
 
-        reviews_to_delete.delete()
+        deleted = Review.delete_sent_before(two_weeks_ago, chunk_size, progress)
+
+        if verbosity >= 2:
+            self.stdout.write("Removed {0} reviews\n".format(deleted))
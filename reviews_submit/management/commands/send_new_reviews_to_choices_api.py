@@ -1,5 +1,3 @@
-import requests
-
 from django.core.management.base import BaseCommand
 from django.template.loader import render_to_string
 from django.conf import settings
@@ -16,6 +14,7 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         verbosity = int(options.get('verbosity'))
         organisations = Organisation.objects.annotate(num_reviews=Count('submitted_reviews')).filter(num_reviews__gt=0)
+        api = ChoicesAPI()
 
         for organisation in organisations:
             url = self.choices_api_url(organisation)
@@ -27,7 +26,7 @@ class Command(BaseCommand):
 
             for review in reviews:
                 data = self.xml_encode(review)
-                response = requests.post(url, data=data, headers={'content-type': 'application/xml'})
+                response = api.send_api_post(url, data, {'content-type': 'application/xml'})
 
                 if response.status_code == 202:
                     if verbosity >= 1:
@@ -4,7 +4,7 @@ from django.utils import timezone
 from django.db import models
 from django.conf import settings
 
-from citizenconnect.models import AuditedModel
+from citizenconnect.models import AuditedModel, delete_in_chunks
 
 
 class Review(AuditedModel):
@@ -30,6 +30,32 @@ class Review(AuditedModel):
         """String representation of this Review"""
         return u"{0} - {1}".format(self.display_name, self.title)
 
+    @classmethod
+    def delete_sent_before(cls, sent_before, chunk_size=1000, progress=None):
+        """Delete the reviews which were last sent to the API before
+        sent_before, and their ratings, chunk_size ids at a time. See
+        citizenconnect.models.delete_in_chunks for progress. Returns how many
+        reviews were deleted."""
+
+        def delete_chunk(cursor, where_sql, params):
+            cursor.execute("""WITH doomed AS (
+                                  SELECT id FROM reviews_submit_review WHERE """ + where_sql + """
+                              ),
+                              deleted_ratings AS (
+                                  DELETE FROM reviews_submit_rating
+                                  WHERE review_id IN (SELECT id FROM doomed)
+                              )
+                              DELETE FROM reviews_submit_review
+                              WHERE id IN (SELECT id FROM doomed)""", params)
+            return cursor.rowcount
+
+        return delete_in_chunks('reviews_submit_review',
+                                'reviews_submit_review.last_sent_to_api < %s',
+                                [sent_before],
+                                delete_chunk,
+                                chunk_size,
+                                progress)
+
 
 class Rating(models.Model):
     """A rating of an aspect of an :model:`organisations.Organisation`,
@@ -2,8 +2,7 @@ import datetime
 import logging
 from StringIO import StringIO
 
-import requests
-from mock import MagicMock
+from mock import MagicMock, patch
 from dateutil import relativedelta
 
 from selenium.webdriver.common.action_chains import ActionChains
@@ -17,6 +16,7 @@ from django.conf import settings
 from django.forms.models import model_to_dict
 
 from citizenconnect.browser_testing import SeleniumTestCase
+from organisations.choices_api import ChoicesAPI
 from organisations.tests.models import create_test_organisation, create_test_organisation_parent
 from .models import Review, Question, Answer, Rating
 from .forms import ReviewForm
@@ -392,7 +392,9 @@ class PushNewReviewToChoicesCommandTest(TestCase):
         mock_response = MagicMock()
         mock_response.status_code = status
         mock_response.text = body
-        requests.post = MagicMock(return_value=mock_response)
+        patcher = patch.object(ChoicesAPI, 'send_api_post', return_value=mock_response)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def test_posts_to_correct_url(self):
         command = PushReviewsCommand()
@@ -490,6 +492,12 @@ class RemoveReviewsSentToApiTest(TestCase):
         call_command('delete_reviews_sent_to_choices_api', stdout=self.stdout, stderr=self.stderr)
         self.assertEquals(self.organisation.submitted_reviews.count(), 2)
 
+    def test_removes_old_reviews_in_chunks(self):
+        call_command('delete_reviews_sent_to_choices_api', chunk_size=1, verbosity=2, stdout=self.stdout, stderr=self.stderr)
+        self.assertEquals(list(self.organisation.submitted_reviews.order_by('id')),
+                          [self.unsubmitted_review, self.newer_review])
+        self.assertIn("Removed 2 reviews", self.stdout.getvalue())
+
 
 class ReviewsProviderPickerTests(TestCase):
 
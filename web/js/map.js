@@ -1,5 +1,4 @@
 $(document).ready(function () {
-    var defaultProviders = window.CitizenConnect.providers;
     var nhsCentreIcon_1 = L.icon({
         iconUrl: CitizenConnect.STATIC_URL + "img/marker1.png",
         iconRetinaUrl: CitizenConnect.STATIC_URL + "img/marker1@2x.png",
@@ -87,6 +86,10 @@ $(document).ready(function () {
     // A LayerGroup so that we can handle all the markers in one go
     var markersGroup = new L.LayerGroup();
 
+    // The url of the data for each z/x/y tile of the map, which is rendered
+    // with a tile of 0/0/0 for us to fill in
+    var tileUrl = $("#map").data('tile-url').replace(/0\/0\/0$/, '{z}/{x}/{y}');
+
     /**
      * Find a provider by a set of attributes.
      *
@@ -291,54 +294,116 @@ $(document).ready(function () {
         });
     };
 
-    /**
-     * Get the parameters to send in an ajax request
-     * These consist of any currently selected map filters
-     * as well as the current bounding box of the map
-     */
-    var getAjaxRequestParameters = function($form, map) {
-        return [$form.serialize(), $.param({bounds: getBoundingBoxFromMap(map)})].join('&');
+    // Function to draw an array of clusters of providers onto the map,
+    // clicking on one zooms in to the providers in it
+    var drawClusters = function(clusters) {
+        _.each(clusters, function(cluster) {
+            var marker = L.marker([cluster.lat, cluster.lon], {
+                riseOnHover: true,
+                icon: L.divIcon({
+                    className: 'map-cluster',
+                    html: '<span>' + cluster.count + '</span>',
+                    iconSize: [32, 32]
+                })
+            });
+            marker.on('click', function() {
+                var bounds = cluster.bounds;
+                map.fitBounds(L.latLngBounds([bounds[1], bounds[0]], [bounds[3], bounds[2]]));
+            });
+            markersGroup.addLayer(marker);
+        });
     };
 
     /**
-     * Get a list of the map's bounds.
+     * Get the urls of the data for all the tiles the map is showing.
+     *
+     * These are the same z/x/y "slippy map" tiles as the map images, so
+     * each one covers the same area every time, and can be cached.
      *
      * @param {L.Map} map The map instance to use
      * @return {Array}
      */
-    var getBoundingBoxFromMap = function(map) {
-        var mapBounds, ne, sw, bounds;
-        mapBounds = map.getBounds();
-        ne = mapBounds.getNorthEast();
-        sw = mapBounds.getSouthWest();
-        return [sw.lng, sw.lat, ne.lng, ne.lat];
+    var getTileUrlsFromMap = function(map) {
+        var zoom = map.getZoom();
+        var maxTile = Math.pow(2, zoom) - 1;
+        var clamp = function(tile) {
+            return Math.max(0, Math.min(maxTile, tile));
+        };
+        var tileX = function(lon) {
+            return clamp(Math.floor((lon + 180) / 360 * Math.pow(2, zoom)));
+        };
+        var tileY = function(lat) {
+            var latRadians = lat * Math.PI / 180;
+            return clamp(Math.floor((1 - Math.log(Math.tan(latRadians) + 1 / Math.cos(latRadians)) / Math.PI) / 2 * Math.pow(2, zoom)));
+        };
+        var mapBounds = map.getBounds();
+        var ne = mapBounds.getNorthEast();
+        var sw = mapBounds.getSouthWest();
+        var urls = [];
+        for (var x = tileX(sw.lng); x <= tileX(ne.lng); x++) {
+            for (var y = tileY(ne.lat); y <= tileY(sw.lat); y++) {
+                urls.push(tileUrl.replace('{z}', zoom).replace('{x}', x).replace('{y}', y));
+            }
+        }
+        return urls;
     };
 
+    // Each request for the map's tiles is numbered, so that we only draw the
+    // latest one if the map is moved before an earlier one has finished
+    var latestTilesRequest = 0;
+
     /**
-     * Perform a GET request.
+     * Request the providers in all the tiles the map is showing, with the
+     * currently selected filters, and draw them.
      *
      * This handles disabling map controls and adding a spinner before the
-     * request, then re-enabling controls and removing the spinner after the
-     * request.
+     * requests, then re-enabling controls and removing the spinner after
+     * them.
      *
-     * @param {String} url The url to request
-     * @param {String} data Data to include with the request
-     * @return {jqXHR} The promise for the AJAX request
+     * @return {Promise} The promise for all the requests
      */
-    var getRequest = function(url, data) {
+    var requestProvidersInTiles = function() {
+        var tilesRequest = ++latestTilesRequest;
+        var filters = $form.serialize();
+        var requests = _.map(getTileUrlsFromMap(map), function(url) {
+            return $.ajax({
+                type: 'GET',
+                url: url,
+                data: filters,
+                dataType: 'json'
+            });
+        });
+
         // Lock the map
         disableMapControls();
 
         // Add a spinner to the map
         $("#map").spin({shadow:true});
 
-        return $.ajax({
-            type: 'GET',
-            url: url,
-            data: data
-        }).always(function() {
+        return $.when.apply($, requests).always(function() {
             $("#map").spin(false);
             enableMapControls();
+        }).done(function() {
+            if (tilesRequest !== latestTilesRequest) {
+                return;
+            }
+            // $.when gives us the arguments of a single request as they are,
+            // but an array of them for each of several requests
+            var responses = requests.length === 1 ? [arguments] : arguments;
+            var providers = [];
+            var clusters = [];
+            _.each(responses, function(response) {
+                var tile = response[0];
+                providers = providers.concat(tile.organisations);
+                clusters = clusters.concat(tile.clusters);
+            });
+            drawProviders(_.uniq(providers, false, function(provider) {
+                return provider.ods_code;
+            }));
+            drawClusters(clusters);
+        }).fail(function(jqXHR) {
+            // TODO: Let the user know about the server error and/or retry request.
+            console.error(jqXHR);
         });
     };
 
@@ -382,26 +447,6 @@ $(document).ready(function () {
         marker.bindPopup(popupContent, popupOptions).openPopup();
     };
 
-    /**
-     * Request a list of providers within the current bounding box for
-     * the map.
-     *
-     * This is a separate function so that it can be bound and unbound
-     * when we're doing our own zooming (such as when we search for a
-     * provider).
-     */
-    var requestProvidersInBounds = function() {
-        data = getAjaxRequestParameters($form, map);
-        data['format'] = 'json';
-        getRequest(window.location.pathname, data)
-        .done(function(providers) {
-            drawProviders(providers);
-        }).error(function(jqXHR) {
-            // TODO: Let the user know about the server error and/or retry request.
-            console.error(jqXHR);
-        });
-    };
-
     // Actually start up the map
     wax.tilejson('https://dnv9my2eseobd.cloudfront.net/v3/jedidiah.map-3lyys17i.jsonp', function(tilejson) {
         var mapCentre = londonCentre;
@@ -410,8 +455,8 @@ $(document).ready(function () {
         map.addLayer(new wax.leaf.connector(httpstilejson)).setView(mapCentre, 1);
         map.setView(mapCentre, mapZoomLevel);
 
-        debouncedRequestProvidersInBounds = _.debounce(requestProvidersInBounds, 1000, true);
-        map.on('dragend zoomend', debouncedRequestProvidersInBounds);
+        var debouncedRequestProvidersInTiles = _.debounce(requestProvidersInTiles, 1000, true);
+        map.on('dragend zoomend', debouncedRequestProvidersInTiles);
 
         // OverlappingMarkerSpiderifier controls click events on markers
         // because it needs to know whether or not to spiderify them, so
@@ -422,8 +467,8 @@ $(document).ready(function () {
         });
 
         // Add the markers
-        drawProviders(defaultProviders);
         map.addLayer(markersGroup);
+        requestProvidersInTiles();
 
         if (selectedProvider) {
             findProvider(selectedProvider, function(provider) {
@@ -443,9 +488,6 @@ $(document).ready(function () {
     // Hide the submit button
     $(".filters input[type=submit]").hide();
 
-    // Add a hidden "format" field to pass via ajax
-    $(".filters").append('<input type="hidden" name="format" value="json" />');
-
     // Submit the form via ajax on any select change and
     // reload the map pins from the results
     $(".filters select").change(function(e) {
@@ -454,11 +496,8 @@ $(document).ready(function () {
             reopenPopup = currentPopup;
         }
 
-        var formData = getAjaxRequestParameters($form, map);
-
         // Try to get new pins
-        getRequest($form.attr('action'), formData).done(function (response) {
-            drawProviders(response);
+        requestProvidersInTiles().done(function () {
             // Tell the filters to update
             $(".filters").trigger("CitizenConnect.filters.update");
         });